@@ -126,6 +126,9 @@ function startLogStream(sessionId) {
   };
   
   eventSource.onerror = (err) => {
+    // The server closes log streams periodically; EventSource reconnects by itself
+    if (eventSource && eventSource.readyState === EventSource.CONNECTING) return;
+
     console.warn("Log stream disconnected " , err);
     stopLogStream();
 
@@ -1,15 +1,28 @@
 import os
 import base64
-import requests
+import hashlib
+import io
 import json
+import http_client
+import auth_tokens
+import cassettes
 from typing import List, Dict, Any, Union
 from google.cloud import vision
+from PIL import Image
 from google.api_core.exceptions import GoogleAPICallError, RetryError
 from dotenv import load_dotenv
 import google.generativeai as genai
 import google.auth 
-from google.auth.transport.requests import Request  
 import re
+import threading
+import time
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+from startup import register_component, timed_component
+from image_hash import find_similar, remember
+from result_cache import IMAGE_URL_CACHE
+from metrics import cache_lookup, timed_call, timed_stage
 
 load_dotenv()
 
@@ -19,46 +32,212 @@ ENDPOINT_ID = os.getenv("IMG_ENDPOINT_ID")
 LOCATION = os.getenv("LOCATION", "us-central1")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
 
-# ✅ Use Cloud Run / Cloud Function credentials
-credentials, project_id = google.auth.default(
-    scopes=["https://www.googleapis.com/auth/cloud-platform"]
-)
+# Image evaluations running at once across all requests; beyond this they queue
+IMAGE_MAX_WORKERS = int(os.getenv("IMAGE_MAX_WORKERS", "8"))
+# Budget for each step of one image, counted from when a worker starts it
+IMAGE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_TIMEOUT_SECONDS", "45"))
+# Budget for a whole request (queueing + load + Vision + Vertex/Gemini)
+IMAGE_BATCH_TIMEOUT_SECONDS = float(os.getenv("IMAGE_BATCH_TIMEOUT_SECONDS", "90"))
+
+# Downloads larger than this are rejected while streaming
+IMAGE_MAX_DOWNLOAD_BYTES = int(os.getenv("IMAGE_MAX_DOWNLOAD_BYTES", str(15 * 1024 * 1024)))
+# Longest side sent to the models: Gemini tiles at 768px and the Vision
+# feature detectors don't gain from more, so larger images are shrunk once.
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "90"))
+# Small-enough files are passed through untouched even if not re-encoded
+IMAGE_REENCODE_MIN_BYTES = 512 * 1024
+_DOWNLOAD_CHUNK = 64 * 1024
+_GENERIC_CONTENT_TYPES = {"", "application/octet-stream", "binary/octet-stream"}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_vision_client() -> vision.ImageAnnotatorClient:
+    """Lazy Vision client + Gemini config (kept off the import path for fast cold starts)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                with timed_component("vision_client"):
+                    genai.configure(api_key=GEMINI_API_KEY)
 
-client = vision.ImageAnnotatorClient(credentials=credentials)
+                    # ✅ Use Cloud Run / Cloud Function credentials
+                    credentials, project_id = google.auth.default(
+                        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+                    )
+                    _client = vision.ImageAnnotatorClient(credentials=credentials)
+    return _client
+
+
+register_component("vision_client", get_vision_client)
 
 
 # ------------------------- Access Token Helper -------------------------
 def _get_access_token() -> str:
-    """Returns OAuth token using Cloud Run service identity."""
-    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    creds.refresh(Request())
-    return creds.token
+    """Returns OAuth token using Cloud Run service identity (shared, cached provider)."""
+    return auth_tokens.get_access_token()
+
+
+# ------------------------- Image Buffer -------------------------
+class ImageBuffer:
+    """
+    Image bytes loaded once and shared by Vision, Vertex and Gemini (no temp files).
+    `digest` identifies the original download; `content` is the downscaled,
+    re-encoded image the models see (prepared on first use, then the
+    original bytes are dropped).
+    """
+    __slots__ = ("source", "_raw", "_content", "_mime_type", "etag", "last_modified", "_b64", "_digest", "_lock")
+
+    def __init__(self, source: str, content: bytes, mime_type: str = None,
+                 etag: str = None, last_modified: str = None):
+        self.source = source
+        self._raw = content
+        self._content = None
+        self._mime_type = mime_type or _sniff_mime(content)
+        self.etag = etag
+        self.last_modified = last_modified
+        self._b64 = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            with self._lock:
+                if self._digest is None:
+                    self._digest = hashlib.sha256(self._raw).hexdigest()
+        return self._digest
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            self.digest   # must be taken from the original bytes before they're dropped
+            with self._lock:
+                if self._content is None:
+                    self._content, self._mime_type = _downscale(self._raw, self._mime_type)
+                    self._raw = None
+        return self._content
+
+    @property
+    def mime_type(self) -> str:
+        self.content   # re-encoding may change the type
+        return self._mime_type
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.content).decode("utf-8")
+        return self._b64
+
+    def vision_image(self) -> vision.Image:
+        return vision.Image(content=self.content)
+
+
+def _sniff_mime(content: bytes) -> str:
+    if content[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if content[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _flatten_alpha(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+
+def _downscale(raw: bytes, mime_type: str):
+    """Shrink to IMAGE_MAX_SIDE and re-encode as JPEG once. Returns (bytes, mime_type)."""
+    try:
+        img = Image.open(io.BytesIO(raw))
+        if max(img.size) <= IMAGE_MAX_SIDE and len(raw) <= IMAGE_REENCODE_MIN_BYTES:
+            return raw, mime_type
+        img.draft("RGB", (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))   # JPEG: decode at reduced scale
+        img = _flatten_alpha(img)
+        img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Image too large to decode: {e}")
+    except Exception as e:
+        # Let the APIs judge bytes Pillow can't decode
+        print(f"[detect_fake_image] Downscale skipped: {e}")
+        return raw, mime_type
+    if out.tell() >= len(raw):
+        return raw, mime_type
+    return out.getvalue(), "image/jpeg"
 
 
 # ------------------------- Helper Functions -------------------------
-def _read_image(path: str) -> vision.Image:
+def _read_image(path: str) -> ImageBuffer:
     with open(path, "rb") as f:
         content = f.read()
-    return vision.Image(content=content)
+    return ImageBuffer(path, content)
 
 
-def _fetch_image_from_url(url: str, save_as: str = "temp_image.jpg") -> str:
+def _fetch_image_from_url(url: str, cached: Dict[str, Any] = None) -> Union[ImageBuffer, None]:
+    """
+    Download an image. With a `cached` URL-cache entry the request is
+    conditional; None means the server answered 304 Not Modified.
+    """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
-    response = requests.get(url, headers=headers, timeout=10)
-    response.raise_for_status()
-    with open(save_as, "wb") as f:
-        f.write(response.content)
-    return save_as
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    with timed_call("image_download"), http_client.get(url, headers=headers, timeout=10, stream=True) as response:
+        if response.status_code == 304 and cached:
+            return None
+        response.raise_for_status()
+
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if not content_type.startswith("image/") and content_type not in _GENERIC_CONTENT_TYPES:
+            raise ValueError(f"Not an image (Content-Type: {content_type})")
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > IMAGE_MAX_DOWNLOAD_BYTES:
+            raise ValueError(f"Image too large ({declared} bytes > {IMAGE_MAX_DOWNLOAD_BYTES})")
+
+        body = bytearray()
+        for chunk in response.iter_content(_DOWNLOAD_CHUNK):
+            body.extend(chunk)
+            if len(body) > IMAGE_MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"Image too large (> {IMAGE_MAX_DOWNLOAD_BYTES} bytes)")
+
+        return ImageBuffer(
+            url,
+            bytes(body),
+            content_type if content_type.startswith("image/") else None,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+
 
+def _load_image(source: Union[str, ImageBuffer]) -> ImageBuffer:
+    if isinstance(source, ImageBuffer):
+        return source
+    if source.lower().startswith("http"):
+        return _fetch_image_from_url(source)
+    return _read_image(source)
 
-def _safe_vision_call(func, image: vision.Image, retries=2):
+
+def _safe_vision_call(func, image: vision.Image = None, retries=2, **kwargs):
+    if image is not None:
+        kwargs["image"] = image
     for attempt in range(retries + 1):
         try:
-            return func(image=image)
+            return func(**kwargs)
         except (GoogleAPICallError, RetryError):
             if attempt == retries:
                 raise
@@ -72,12 +251,19 @@ def _strip_markdown_code_block(text: str) -> str:
 
 
 # ------------------------- Vision AI Detection -------------------------
-def detect_web_entities(image: vision.Image):
-    response = _safe_vision_call(client.web_detection, image)
-    if response.error.message:
-        raise Exception(f"Web detection error: {response.error.message}")
+# batch_annotate_images accepts at most 16 images per request; also keep the
+# inline payload (base64 grows it by a third) below the 10MB request limit.
+VISION_BATCH_MAX_IMAGES = 16
+VISION_BATCH_MAX_BYTES = 6 * 1024 * 1024
+
+VISION_FEATURES = [
+    vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION),
+    vision.Feature(type_=vision.Feature.Type.FACE_DETECTION),
+    vision.Feature(type_=vision.Feature.Type.WEB_DETECTION),
+]
+
 
-    web_entities = response.web_detection
+def _web_to_dict(web_entities) -> Dict[str, Any]:
     return {
         "entities": [{"description": e.description, "score": e.score} for e in (web_entities.web_entities or [])],
         "exact_matches": [img.url for img in (web_entities.full_matching_images or [])],
@@ -85,41 +271,101 @@ def detect_web_entities(image: vision.Image):
     }
 
 
+def _labels_to_list(label_annotations) -> List[Dict[str, Any]]:
+    return [{"description": label.description, "score": label.score} for label in label_annotations]
+
+
+def _faces_to_list(face_annotations) -> List[Dict[str, Any]]:
+    return [{"detection_confidence": face.detection_confidence} for face in face_annotations]
+
+
+def detect_web_entities(image: vision.Image):
+    response = _safe_vision_call(get_vision_client().web_detection, image)
+    if response.error.message:
+        raise Exception(f"Web detection error: {response.error.message}")
+    return _web_to_dict(response.web_detection)
+
+
 def detect_labels(image: vision.Image):
-    response = _safe_vision_call(client.label_detection, image)
+    response = _safe_vision_call(get_vision_client().label_detection, image)
     if response.error.message:
         raise Exception(f"Label detection error: {response.error.message}")
-    return [{"description": label.description, "score": label.score} for label in response.label_annotations]
+    return _labels_to_list(response.label_annotations)
 
 
 def detect_faces(image: vision.Image):
-    response = _safe_vision_call(client.face_detection, image)
+    response = _safe_vision_call(get_vision_client().face_detection, image)
     if response.error.message:
         raise Exception(f"Face detection error: {response.error.message}")
-    return [{"detection_confidence": face.detection_confidence} for face in response.face_annotations]
-
-
-def analyze_image(path_or_url: str) -> Dict[str, Any]:
-    """Analyzes an image (local path or URL) using Vision AI."""
-    if path_or_url.lower().startswith("http"):
-        path = _fetch_image_from_url(path_or_url)
-    else:
-        path = path_or_url
+    return _faces_to_list(response.face_annotations)
+
+
+def _vision_chunks(images: List[ImageBuffer]) -> List[List[int]]:
+    """Group image indexes into batch requests within the API's count/size limits."""
+    chunks, current, current_bytes = [], [], 0
+    for idx, image in enumerate(images):
+        size = len(image.content)
+        if current and (len(current) >= VISION_BATCH_MAX_IMAGES or current_bytes + size > VISION_BATCH_MAX_BYTES):
+            chunks.append(current)
+            current, current_bytes = [], 0
+        current.append(idx)
+        current_bytes += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def annotate_images(images: List[ImageBuffer]) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    Labels, faces and web detection for every image via batch_annotate_images.
+    Returns one entry per input, in order: the vision_data dict, or the
+    Exception for images the API rejected.
+    """
+    results: List[Union[Dict[str, Any], Exception]] = [None] * len(images)
+    encode, decode = cassettes.proto_codec(vision.BatchAnnotateImagesResponse)
+
+    for chunk in _vision_chunks(images):
+        requests_ = [
+            vision.AnnotateImageRequest(image=images[i].vision_image(), features=VISION_FEATURES)
+            for i in chunk
+        ]
+        try:
+            with timed_call("vision", op="batch_annotate"):
+                batch = cassettes.call(
+                    "vision", "batch_annotate", {"images": [images[i].content for i in chunk]},
+                    lambda: _safe_vision_call(get_vision_client().batch_annotate_images, requests=requests_),
+                    encode=encode,
+                    decode=decode,
+                )
+        except Exception as e:
+            for i in chunk:
+                results[i] = e
+            continue
+
+        for i, response in zip(chunk, batch.responses):
+            if response.error.message:
+                results[i] = Exception(f"Vision annotate error: {response.error.message}")
+                continue
+            results[i] = {
+                "labels": _labels_to_list(response.label_annotations),
+                "faces": _faces_to_list(response.face_annotations),
+                "web": _web_to_dict(response.web_detection),
+            }
+    return results
 
-    image = _read_image(path)
 
-    return {
-        "labels": detect_labels(image),
-        "faces": detect_faces(image),
-        "web": detect_web_entities(image),
-    }
+def analyze_image(source: Union[str, ImageBuffer]) -> Dict[str, Any]:
+    """Analyzes an image (local path, URL or loaded buffer) using one Vision AI request."""
+    result = annotate_images([_load_image(source)])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 
 # ------------------------- Vertex AI Prediction -------------------------
-def call_vertex_ai_prediction(image_path: str) -> Dict[str, Any]:
+def call_vertex_ai_prediction(source: Union[str, ImageBuffer]) -> Dict[str, Any]:
     """Send image to Vertex AI endpoint for authenticity prediction."""
-    with open(image_path, "rb") as f:
-        image_bytes = base64.b64encode(f.read()).decode("utf-8")
+    image_bytes = _load_image(source).b64
 
     data = {
         "instances": [{"content": image_bytes}],
@@ -139,7 +385,10 @@ def call_vertex_ai_prediction(image_path: str) -> Dict[str, Any]:
         "Content-Type": "application/json",
     }
 
-    resp = requests.post(url, headers=headers, json=data)
+    with timed_call("vertex_image") as call:
+        resp = http_client.post(url, headers=headers, json=data, timeout=30)
+        if resp.status_code != 200:
+            call.fail()
 
     try:
         result = resp.json()
@@ -150,11 +399,9 @@ def call_vertex_ai_prediction(image_path: str) -> Dict[str, Any]:
 
 
 # ------------------------- Gemini AI Fallback -------------------------
-def call_gemini_detection(image_path: str) -> Dict[str, Any]:
+def call_gemini_detection(source: Union[str, ImageBuffer]) -> Dict[str, Any]:
     """Send image to Gemini for authenticity analysis."""
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-
         prompt = """
         Analyze this image and determine whether it is AI-generated or real.
         Return JSON only:
@@ -165,8 +412,19 @@ def call_gemini_detection(image_path: str) -> Dict[str, Any]:
         }
         """
 
-        uploaded_file = genai.upload_file(path=image_path)
-        response = model.generate_content([prompt, uploaded_file])
+        image = _load_image(source)
+        contents = [prompt, {"mime_type": image.mime_type, "data": image.content}]
+
+        def _generate():
+            get_vision_client()   # configures genai
+            return genai.GenerativeModel('gemini-2.5-flash').generate_content(contents)
+
+        with timed_call("gemini", op="image_detection"):
+            response = cassettes.call(
+                "gemini", "image_detection", {"contents": contents}, _generate,
+                encode=cassettes.encode_gemini,
+                decode=cassettes.decode_gemini,
+            )
         text = _strip_markdown_code_block(response.text.strip())
 
         parsed = json.loads(text)
@@ -226,60 +484,287 @@ def score_ai_likelihood(vision_data: Dict[str, Any], vertex_result: Dict[str, An
 
 
 # ------------------------- Core Evaluation -------------------------
-def _evaluate_single_image(url_or_path: str) -> Dict[str, Any]:
-    try:
-        print("Evaluating image:", url_or_path)
-        if url_or_path.startswith("http"):
-            path = _fetch_image_from_url(url_or_path)
-        else:
-            path = url_or_path
-        
-        vision_data = analyze_image(path)
-        vertex_result = call_vertex_ai_prediction(path)
-
-        if not vertex_result or "error" in vertex_result or not vertex_result.get("displayNames"):
-            print("[Fallback] Using Gemini...")
-            gemini_result = call_gemini_detection(path)
-            ai_prob = gemini_result.get("ai_probability", 0.5)
-            final_score = int((1 - ai_prob) * 100)
-
-            return {
-                "image_source": url_or_path,
-                "score": final_score,
-                "verdict": gemini_result.get("verdict", "Uncertain"),
-                "explanation": gemini_result.get("explanation", "Gemini fallback used."),
-                "vision_details": vision_data,
-                "vertex_ai_result": {"gemini_result": gemini_result},
-            }
+def _error_result(url_or_path: str, message: str) -> Dict[str, Any]:
+    return {
+        "image_source": url_or_path,
+        "score": 0,
+        "verdict": "Error",
+        "explanation": message,
+        "details": {},
+    }
 
-        result = score_ai_likelihood(vision_data, vertex_result)
-        final_score = int((1 - result["ai_probability"]) * 100)
+
+def _phash_result(url_or_path: str, match: Dict[str, Any]) -> Dict[str, Any]:
+    """Verdict of a near-duplicate image analysed earlier."""
+    doc = match["doc"]
+    print(f"[detect_fake_image] Perceptual-hash hit for {url_or_path} (matches {doc.get('source')})")
+    return {
+        "image_source": url_or_path,
+        "score": doc.get("score", 0),
+        "verdict": doc.get("verdict", "Uncertain"),
+        "explanation": doc.get("explanation", ""),
+        "vision_details": {},
+        "vertex_ai_result": {},
+        "cache": {
+            "type": "phash",
+            "matched_source": doc.get("source"),
+            "phash_distance": match["phash_distance"],
+            "dhash_distance": match["dhash_distance"],
+        },
+    }
+
+
+def _cacheable(result: Dict[str, Any]) -> bool:
+    """Only remember verdicts that came from a working model call."""
+    if result.get("verdict") == "Error":
+        return False
+    return "error" not in result.get("vertex_ai_result", {}).get("gemini_result", {})
+
+
+def _analyze_loaded(url_or_path: str, image: ImageBuffer, vision_data: Dict[str, Any] = None) -> Dict[str, Any]:
+    if vision_data is None:
+        vision_data = analyze_image(image)
+    vertex_result = call_vertex_ai_prediction(image)
+
+    if not vertex_result or "error" in vertex_result or not vertex_result.get("displayNames"):
+        print("[Fallback] Using Gemini...")
+        gemini_result = call_gemini_detection(image)
+        ai_prob = gemini_result.get("ai_probability", 0.5)
+        final_score = int((1 - ai_prob) * 100)
 
         return {
             "image_source": url_or_path,
             "score": final_score,
-            "verdict": result["verdict"],
-            "explanation": result["explanation"],
+            "verdict": gemini_result.get("verdict", "Uncertain"),
+            "explanation": gemini_result.get("explanation", "Gemini fallback used."),
             "vision_details": vision_data,
-            "vertex_ai_result": vertex_result,
+            "vertex_ai_result": {"gemini_result": gemini_result},
         }
 
+    result = score_ai_likelihood(vision_data, vertex_result)
+    final_score = int((1 - result["ai_probability"]) * 100)
+
+    return {
+        "image_source": url_or_path,
+        "score": final_score,
+        "verdict": result["verdict"],
+        "explanation": result["explanation"],
+        "vision_details": vision_data,
+        "vertex_ai_result": vertex_result,
+    }
+
+
+# ------------------------- URL Result Cache -------------------------
+_url_stats_lock = threading.Lock()
+_url_stats = {"not_modified": 0, "digest_matches": 0, "changed": 0}
+
+
+def _count_url(outcome: str):
+    with _url_stats_lock:
+        _url_stats[outcome] += 1
+    cache_lookup("image_url_revalidation", outcome != "changed")
+
+
+def _url_cached_result(url: str, entry: Dict[str, Any], revalidation: str) -> Dict[str, Any]:
+    result = dict(entry["result"])
+    result["image_source"] = url
+    result["cache"] = {"type": "url", "revalidation": revalidation}
+    return result
+
+
+def _remember_url(image: ImageBuffer, result: Dict[str, Any]):
+    if not image.source.lower().startswith("http"):
+        return
+    IMAGE_URL_CACHE.put(image.source, {
+        "digest": image.digest,
+        "etag": image.etag,
+        "last_modified": image.last_modified,
+        "result": {k: v for k, v in result.items() if k != "cache"},
+    })
+
+
+def _load_with_caches(url_or_path: str):
+    """
+    Load an image and consult the result caches before any analysis.
+    Returns (image, cached_result, hashes); image is None when a 304 let us
+    skip the download, cached_result is None when the image must be analysed.
+    """
+    entry = IMAGE_URL_CACHE.get(url_or_path) if url_or_path.lower().startswith("http") else None
+    if entry:
+        image = _fetch_image_from_url(url_or_path, cached=entry)
+        if image is None:
+            _count_url("not_modified")
+            return None, _url_cached_result(url_or_path, entry, "not_modified"), None
+        if image.digest == entry["digest"]:
+            _count_url("digest_matches")
+            _remember_url(image, entry["result"])   # pick up the new validators
+            return image, _url_cached_result(url_or_path, entry, "digest"), None
+        _count_url("changed")
+    else:
+        image = _load_image(url_or_path)
+
+    match, hashes = find_similar(image.content)
+    if match:
+        result = _phash_result(url_or_path, match)
+        _remember_url(image, result)
+        return image, result, hashes
+    return image, None, hashes
+
+
+def get_image_url_cache_stats() -> Dict[str, Any]:
+    stats = IMAGE_URL_CACHE.get_stats()
+    with _url_stats_lock:
+        stats.update(_url_stats)
+    return stats
+
+
+def _evaluate_single_image(
+    url_or_path: str,
+    image: ImageBuffer = None,
+    vision_data: Dict[str, Any] = None,
+    hashes=None,
+) -> Dict[str, Any]:
+    """
+    Full pipeline for one image. Callers that already loaded the image (and
+    checked the result caches) pass `image` and its `hashes`.
+    """
+    try:
+        print("Evaluating image:", url_or_path)
+        if image is None:
+            image, cached, hashes = _load_with_caches(url_or_path)
+            if cached:
+                return cached
+
+        result = _analyze_loaded(url_or_path, image, vision_data)
+        if _cacheable(result):
+            _remember_url(image, result)
+            if hashes:
+                remember(hashes, url_or_path, result)
+        return result
+
     except Exception as e:
         print(f"[detect_fake_image] Error analyzing image: {e}")
-        return {
-            "image_source": url_or_path,
-            "score": 0,
-            "verdict": "Error",
-            "explanation": f"Error analyzing image: {e}",
-            "details": {},
-        }
+        return _error_result(url_or_path, f"Error analyzing image: {e}")
+
+
+# Shared by every request, so timed-out work can never pile up past IMAGE_MAX_WORKERS threads
+_IMAGE_POOL = ThreadPoolExecutor(max_workers=IMAGE_MAX_WORKERS, thread_name_prefix="image-eval")
+
+
+def _map_until(fn, items: list, deadline: float) -> list:
+    """
+    Run fn(item) for every item on the shared pool. An item gets
+    IMAGE_TIMEOUT_SECONDS from the moment a worker starts it, and nothing
+    runs past the monotonic `deadline`. Late items yield FutureTimeout();
+    the ones still queued are cancelled so they never start.
+    """
+    if time.monotonic() >= deadline:
+        return [FutureTimeout() for _ in items]
+    started: Dict[int, float] = {}
+
+    def _run(idx, item):
+        started[idx] = time.monotonic()
+        return fn(item)
+
+    futures = [
+        _IMAGE_POOL.submit(contextvars.copy_context().run, _run, idx, item)
+        for idx, item in enumerate(items)
+    ]
+    pending = set(range(len(futures)))
+    timed_out = set()
+    while pending:
+        now = time.monotonic()
+        for idx in list(pending):
+            if idx in started and now >= started[idx] + IMAGE_TIMEOUT_SECONDS:
+                pending.discard(idx)
+                timed_out.add(idx)
+        if not pending or now >= deadline:
+            break
+        next_expiry = min(
+            [deadline] + [started[i] + IMAGE_TIMEOUT_SECONDS for i in pending if i in started]
+        )
+        done, _ = wait([futures[i] for i in pending], timeout=max(0.0, next_expiry - now),
+                       return_when=FIRST_COMPLETED)
+        pending -= {i for i in pending if futures[i] in done}
+
+    results = []
+    for idx, fut in enumerate(futures):
+        if idx in timed_out or not fut.done():
+            fut.cancel()
+            results.append(FutureTimeout())
+        elif fut.exception() is not None:
+            results.append(fut.exception())
+        else:
+            results.append(fut.result())
+    return results
+
+
+def _outcome_result(url_or_path: str, outcome) -> Dict[str, Any]:
+    if isinstance(outcome, FutureTimeout):
+        print(f"[detect_fake_image] Timed out: {url_or_path}")
+        return _error_result(url_or_path, f"Image analysis timed out after {IMAGE_TIMEOUT_SECONDS:.0f}s")
+    if isinstance(outcome, Exception):
+        print(f"[detect_fake_image] Error analyzing image: {outcome}")
+        return _error_result(url_or_path, f"Error analyzing image: {outcome}")
+    return outcome
+
+
+def _evaluate_one(url_or_path: str) -> Dict[str, Any]:
+    """_evaluate_single_image() on the shared pool, under the same timeouts as a batch."""
+    deadline = time.monotonic() + IMAGE_BATCH_TIMEOUT_SECONDS
+    return _outcome_result(url_or_path, _map_until(_evaluate_single_image, [url_or_path], deadline)[0])
+
+
+def _evaluate_many(inputs: List[str]) -> List[Dict[str, Any]]:
+    """
+    1. Fetch all images concurrently into memory (conditional GETs for
+       cached URLs); answer unchanged URLs and near-duplicates of already
+       analysed images from the result caches.
+    2. One batch_annotate_images call (per 16 images) for labels/faces/web.
+    3. Vertex (+ Gemini fallback) per image concurrently.
+    Each step of an image has IMAGE_TIMEOUT_SECONDS and the request as a
+    whole IMAGE_BATCH_TIMEOUT_SECONDS; images past either get a timeout result.
+    """
+    if len(inputs) <= 1:
+        return [_evaluate_one(i) for i in inputs]
+
+    deadline = time.monotonic() + IMAGE_BATCH_TIMEOUT_SECONDS
+    loaded = _map_until(_load_with_caches, inputs, deadline)
+
+    # Revalidated URLs and near-duplicates skip every external call
+    cached = {
+        i: entry[1]
+        for i, entry in enumerate(loaded)
+        if isinstance(entry, tuple) and entry[1]
+    }
+    ok = [i for i, entry in enumerate(loaded) if isinstance(entry, tuple) and i not in cached]
+    annotations = annotate_images([loaded[i][0] for i in ok]) if ok else []
+    vision_by_idx = dict(zip(ok, annotations))
+
+    def _finish(idx):
+        vision_data = vision_by_idx[idx]
+        if isinstance(vision_data, Exception):
+            raise vision_data
+        image, _, hashes = loaded[idx]
+        return _evaluate_single_image(inputs[idx], image=image, vision_data=vision_data, hashes=hashes)
+
+    finished = _map_until(_finish, ok, deadline)
+    finished_by_idx = dict(zip(ok, finished))
+    finished_by_idx.update(cached)
+
+    return [
+        _outcome_result(url_or_path, finished_by_idx.get(idx, loaded[idx]))
+        for idx, url_or_path in enumerate(inputs)
+    ]
 
 
 def detect_fake_image(inputs: Union[str, List[str]]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
     if isinstance(inputs, str):
-        return _evaluate_single_image(inputs)
+        with timed_stage("detect_fake_image"):
+            return _evaluate_one(inputs)
     elif isinstance(inputs, list):
-        results = [_evaluate_single_image(i) for i in inputs]
+        with timed_stage("detect_fake_image"):
+            results = _evaluate_many(inputs)
         print(f"[detect_fake_image] Processed {len(inputs)} images.")
         return results
     else:
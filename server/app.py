@@ -1,11 +1,11 @@
-from flask import Flask, request, jsonify, session, Response, stream_with_context
+from flask import Flask, request, jsonify, session, Response, stream_with_context, redirect, make_response
 from misinfo_model import detect_fake_text
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from vectorDb import search_feedback_semantic, store_feedback, cleanup_expired
 from database import generate_id, generate_normalized_id, get_article_doc, firestore_semantic_search
-from FakeImageDetection import detect_fake_image
+from FakeImageDetection import detect_fake_image, get_image_url_cache_stats
 from google.cloud import firestore
 from tasks import cancel_session_tasks, get_session_tasks 
 from datetime import datetime
@@ -13,12 +13,28 @@ import os
 from dotenv import load_dotenv
 import numpy as np
 import uuid
-import queue
-import json
-import threading
+import hmac
 from translate import translate_to_english
-from langdetect import detect
-from database import db
+from database import get_db
+from startup import get_readiness, register_component, start_warmup, timed_component
+from result_cache import VERDICT_CACHE
+from singleflight import PIPELINE_FLIGHTS
+from http_client import get_host_stats
+from auth_tokens import get_token_stats
+from domain_scores import get_domain_stats
+from domain_score_writer import DOMAIN_AGGREGATOR
+from persistence_queue import PERSIST_QUEUE
+from embedding_service import get_batcher_stats, get_cache_stats
+from article_index import get_article_index
+from image_hash import get_image_hash_stats
+import cassettes
+from cassettes import get_cassette_stats
+import metrics
+from tracing import TRACE_BUFFER_SIZE, get_trace, recent_traces, render_waterfall, start_trace, tag_trace
+from event_broker import (
+    BROKER, SSE_HEADERS, SSE_PUBLIC_URL, THREAD_STREAM_SLOTS, drain_events, format_retry, format_sse,
+    iter_events_blocking,
+)
 
 load_dotenv()
 
@@ -85,6 +101,22 @@ def make_json_safe(obj):
         return obj
 
 
+_langdetect = None
+
+def get_langdetect():
+    """langdetect loads its language profiles on first import; keep that off the import path."""
+    global _langdetect
+    if _langdetect is None:
+        with timed_component("langdetect"):
+            from langdetect import detect, DetectorFactory
+            DetectorFactory.seed = 0
+            detect("warm up language profiles")
+            _langdetect = detect
+    return _langdetect
+
+register_component("langdetect", get_langdetect)
+
+
 def get_session_id():
     """Extract session ID from various sources"""
     return (
@@ -99,54 +131,42 @@ def get_session_id():
 # Log info 
 # ---------------------------
 
-log_queues = {}
-log_queues_lock = threading.Lock()
-
-def get_log_queue(session_id):
-    """Get or create a log queue for a session"""
-    with log_queues_lock:
-        if session_id not in log_queues:
-            log_queues[session_id] = queue.Queue(maxsize=100)
-        return log_queues[session_id]
-
-def cleanup_log_queue(session_id):
-    """Remove log queue for session"""
-    with log_queues_lock:
-        log_queues.pop(session_id, None)
-
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.route("/ready", methods=["GET"])
+@limiter.exempt
+def ready():
+    """Readiness probe: 200 once required components are warm, 503 while warming."""
+    readiness = get_readiness()
+    return jsonify(readiness), (200 if readiness["ready"] else 503)
+
 @app.route("/stream_logs/<session_id>", methods=["GET"])
 @limiter.exempt
 def stream_logs(session_id):
     """Stream logs to frontend via Server-Sent Events"""
+    # Idle streams belong on the async broker server, not on request threads
+    if SSE_PUBLIC_URL:
+        return redirect(f"{SSE_PUBLIC_URL.rstrip('/')}/stream_logs/{session_id}", code=307)
+
+    if not THREAD_STREAM_SLOTS.acquire(blocking=False):
+        # Every slot is taken: hand over what is buffered and let EventSource reconnect
+        body = format_retry() + "".join(format_sse(e) for e in drain_events(session_id))
+        return Response(body, mimetype="text/event-stream", headers=SSE_HEADERS)
+
     def generate():
-        log_queue = get_log_queue(session_id)
-        try:
-            while True:
-                try:
-                    msg = log_queue.get(timeout=30)
-                    if msg == "DONE":
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        break
-                    yield f"data: {json.dumps(msg)}\n\n"
-                except queue.Empty:
-                    yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-        except GeneratorExit:
-            pass
-        finally:
-            cleanup_log_queue(session_id)
-    
-    return Response(
+        yield format_retry()
+        for event in iter_events_blocking(session_id):
+            yield format_sse(event)
+
+    response = Response(
         stream_with_context(generate()),
         mimetype="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no"
-        }
+        headers=SSE_HEADERS,
     )
+    response.call_on_close(THREAD_STREAM_SLOTS.release)
+    return response
 
 # ---------------------------
 # IMAGE DETECTION 
@@ -184,6 +204,13 @@ def detect_image():
 @app.route("/detect_text", methods=["POST"])
 @limiter.limit("30 per minute")
 def detect_text():
+    with start_trace("detect_text") as trace:
+        response = make_response(_detect_text())
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return response
+
+
+def _detect_text():
     try:
         data = request.json
         original_text = data.get("text", "")
@@ -193,9 +220,18 @@ def detect_text():
         print(f"Processing request for session: {session_id}")
         print(f"User selected text: '{original_text}'")
         print(f"URL: {url}")
+
+        # In-process verdict cache (no network), keyed on the text as sent so a
+        # hit skips language detection and translation too
+        l1_key = generate_id(url, original_text.strip())
+        hot = VERDICT_CACHE.get(l1_key)
+        if hot:
+            tag_trace(hot.get("article_id"))
+            return jsonify({**hot, "source": "verdict_cache", "cached_source": hot.get("source"),
+                            "session_id": session_id})
         
         try:
-            lang = detect(original_text)
+            lang = get_langdetect()(original_text)
         except:
             lang = "unknown"
 
@@ -213,17 +249,23 @@ def detect_text():
 
         article_id = generate_id(url, text)
         norm_id = generate_normalized_id(url, text)
+        tag_trace(article_id)
+
+        def respond(payload):
+            if payload.get("prediction", "Unknown") != "Unknown":
+                VERDICT_CACHE.put(l1_key, payload, tags=[article_id, payload.get("article_id")])
+            return jsonify({**payload, "session_id": session_id})
 
         # Firestore exact match
         cached = get_article_doc(article_id)
+        metrics.cache_lookup("firestore_exact", bool(cached))
         if cached:
-            return jsonify({
+            return respond({
                 "score": cached.get("text_score", 0.5),
                 "prediction": cached.get("prediction", "Unknown"),
                 "explanation": cached.get("text_explanation", ""),
                 "article_id": article_id,
                 "source": "firestore_exact",
-                "session_id": session_id,
                 "details": [{
                     "score": cached.get("text_score", 0.5),
                     "prediction": cached.get("prediction", "Unknown"),
@@ -235,44 +277,45 @@ def detect_text():
 
         # Firestore semantic search
         firestore_semantic = firestore_semantic_search(original_text)
+        metrics.cache_lookup("firestore_semantic", bool(firestore_semantic))
         if firestore_semantic:
             best = firestore_semantic["best"]
             best_id = firestore_semantic["best_id"]
 
-            return jsonify({
+            return respond({
                 "score": best.get("text_score", 0.5),
                 "prediction": best.get("prediction", "Unknown"),
                 "explanation": best.get("text_explanation", ""),
                 "article_id": best_id,
                 "source": "firestore_semantic",
-                "session_id": session_id
             })
 
         # ✅ Pinecone semantic cache
-        pinecone_result = search_feedback_semantic(original_text, article_id=article_id)
+        with metrics.timed_stage("pinecone_semantic_cache"):
+            pinecone_result = search_feedback_semantic(original_text, article_id=article_id)
+        metrics.cache_lookup("pinecone_semantic", pinecone_result.get("source") == "cache")
         if pinecone_result.get("source") == "cache":
-            return jsonify({
+            return respond({
                 **pinecone_result,
                 "article_id": article_id,
                 "source": "semantic_cache",
-                "session_id": session_id
             })
 
-        # 🚀 NEW ANALYSIS (pipeline)
-        model_result = detect_fake_text(original_text)
+        # 🚀 NEW ANALYSIS (pipeline) — concurrent duplicates share one run
+        flight_key = generate_normalized_id("", original_text)
+        model_result = PIPELINE_FLIGHTS.do(flight_key, detect_fake_text, original_text)
 
         text_score = model_result["summary"]["score"] / 100
         text_prediction = model_result["summary"]["prediction"]
         explanation = model_result["summary"]["explanation"]
 
         safe_result = make_json_safe(model_result)
-        return jsonify({
+        return respond({
             "score": text_score,
             "prediction": text_prediction,
             "explanation": explanation,
             "article_id": article_id,
             "source": "new_analysis",
-            "session_id": session_id,
             "details": [safe_result],
             "runtime": safe_result.get("runtime", 0),
             "claims_checked": safe_result.get("claims_checked", 0)
@@ -312,7 +355,7 @@ def detect_text_initial():
 @app.route("/submit_feedback", methods=["POST"])
 @limiter.limit("100 per minute")
 def submit_feedback():
-    from database import generate_id, generate_normalized_id, get_article_doc 
+    from database import generate_id, generate_normalized_id
 
     data = request.json
 
@@ -345,13 +388,13 @@ def submit_feedback():
     if not text or label not in ["REAL", "FAKE"]:
         return jsonify({"error": "Missing text or invalid label (use REAL/FAKE)"}), 400
 
-    doc_ref = db.collection("articles").document(article_id)
-    doc_snapshot = doc_ref.get()
-
-    increment_reports = 1 if label == "FAKE" else 0
-
-    if doc_snapshot.exists:
+    def _record_feedback():
+        """Percentage of reports after counting this one, or None for unknown articles."""
+        doc_ref = get_db().collection("articles").document(article_id)
+        if not doc_ref.get().exists:
+            return None
 
+        increment_reports = 1 if label == "FAKE" else 0
         doc_ref.update({
             "total_views": firestore.Increment(1),
             "total_reports": firestore.Increment(increment_reports),
@@ -366,14 +409,24 @@ def submit_feedback():
             "timestamp": datetime.utcnow()
         })
 
-        doc = get_article_doc(article_id)
+        doc = doc_ref.get().to_dict() or {}
         total_views = doc.get('total_views', 1)
         total_reports = doc.get('total_reports', 0)
         percentage = (total_reports / total_views) * 100
 
         if percentage > 40:
             doc_ref.update({"community_flagged": True})
+        return percentage
 
+    with metrics.timed_call("firestore", op="record_feedback"):
+        percentage = cassettes.call(
+            "firestore", "record_feedback", {"id": article_id, "label": label}, _record_feedback
+        )
+    # Only after the write: invalidating earlier lets a concurrent /detect_text
+    # re-cache the old verdict
+    VERDICT_CACHE.invalidate(article_id)
+
+    if percentage is not None:
         return jsonify({
             "status": "feedback_recorded",
             "percentage_reported": f"{percentage:.0f}%"
@@ -386,6 +439,7 @@ def submit_feedback():
         }), 200
 
     result = store_feedback(text, explanation, sources, user_fingerprint)
+    VERDICT_CACHE.invalidate(article_id)   # the semantic cache tier just changed
 
     if "error" in result:
         return jsonify({"error": result["error"]}), 400
@@ -456,6 +510,76 @@ def cleanup_expired_endpoint():
     return jsonify(result), 200
 
 
+# ---------------------------
+# CACHE STATS
+# ---------------------------
+@app.route("/cache_stats", methods=["GET"])
+@limiter.exempt
+def cache_stats():
+    return jsonify({
+        "verdict_l1": VERDICT_CACHE.get_stats(),
+        "pipeline_singleflight": PIPELINE_FLIGHTS.get_stats(),
+        "embedding_cache": get_cache_stats(),
+        "embedding_batcher": get_batcher_stats(),
+        "article_index": get_article_index().get_stats(),
+        "outbound_http": get_host_stats(),
+        "oauth_token": get_token_stats(),
+        "domain_scores": get_domain_stats(),
+        "domain_score_writer": DOMAIN_AGGREGATOR.get_stats(),
+        "persistence_queue": PERSIST_QUEUE.get_stats(),
+        "image_phash": get_image_hash_stats(),
+        "image_url": get_image_url_cache_stats(),
+        "event_broker": BROKER.get_stats(),
+        "cassettes": get_cassette_stats(),
+    }), 200
+
+
+# ---------------------------
+# METRICS
+# ---------------------------
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus text by default; ?format=json for per-series percentiles."""
+    if request.args.get("format") == "json":
+        return jsonify(metrics.snapshot()), 200
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+# ---------------------------
+# REQUEST TRACES
+# ---------------------------
+TRACE_DEBUG_TOKEN = os.getenv("TRACE_DEBUG_TOKEN")
+
+def _debug_allowed():
+    """Debug endpoints stay closed unless TRACE_DEBUG_TOKEN is configured and supplied."""
+    if not TRACE_DEBUG_TOKEN:
+        return False
+    supplied = request.headers.get("X-Debug-Token") or request.args.get("token") or ""
+    return hmac.compare_digest(supplied.encode("utf-8"), TRACE_DEBUG_TOKEN.encode("utf-8"))
+
+@app.route("/debug/traces", methods=["GET"])
+@limiter.exempt
+def debug_traces():
+    if not _debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify(recent_traces(min(max(limit, 1), TRACE_BUFFER_SIZE))), 200
+
+@app.route("/debug/trace/<article_id>", methods=["GET"])
+@limiter.exempt
+def debug_trace(article_id):
+    """Waterfall of the latest /detect_text trace for an article_id (or trace id)."""
+    if not _debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    trace = get_trace(article_id)
+    if trace is None:
+        return jsonify({"error": "No recent trace for this id"}), 404
+    if request.args.get("format") == "json":
+        return jsonify(trace), 200
+    return Response(render_waterfall(trace, request.args.get("token", "")), mimetype="text/html")
+
+
 # ---------------------------
 # HEALTH CHECK 
 # ---------------------------
@@ -468,5 +592,8 @@ def health_check():
     }), 200
 
 
+start_warmup()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
@@ -0,0 +1,250 @@
+# article_index.py
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from startup import timed_component
+
+EMBED_DIM = 384
+PRUNE_INTERVAL_SECONDS = 300.0
+BOOTSTRAP_RETRY_SECONDS = 60.0
+
+# Fields kept alongside each vector (everything but the embedding itself)
+_SKIP_FIELDS = {"embedding"}
+
+
+def _to_epoch(value) -> float:
+    """Firestore timestamps are tz-aware; run_storage writes naive UTC."""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return 0.0
+
+
+class ArticleIndex:
+    """
+    In-memory mirror of `articles` embeddings for semantic lookup.
+    Vectors are L2-normalised rows of one float32 matrix, so a query is a
+    single matrix-vector product over the whole corpus.
+    """
+
+    def __init__(self, dim: int = EMBED_DIM, initial_capacity: int = 1024):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._last_updated = np.zeros(initial_capacity, dtype=np.float64)
+        self._expire_at = np.zeros(initial_capacity, dtype=np.float64)
+        self._ids: List[str] = []
+        self._docs: List[dict] = []
+        self._row_of: Dict[str, int] = {}
+        self._pruned_at = 0.0
+        self.ready = False
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _grow(self):
+        capacity = self._vectors.shape[0] * 2
+        for name in ("_vectors", "_last_updated", "_expire_at"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: old.shape[0]] = old
+            setattr(self, name, new)
+
+    def upsert(self, doc_id: str, data: dict) -> bool:
+        """Insert or replace one article. Returns False if it has no usable embedding."""
+        emb = data.get("embedding") if data else None
+        if emb is None or not data.get("text"):
+            self.remove(doc_id)
+            return False
+
+        vec = np.asarray(emb, dtype=np.float32).reshape(-1)
+        if vec.shape[0] != self.dim:
+            return False
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return False
+
+        doc = {k: v for k, v in data.items() if k not in _SKIP_FIELDS}
+
+        with self._lock:
+            row = self._row_of.get(doc_id)
+            if row is None:
+                row = len(self._ids)
+                if row >= self._vectors.shape[0]:
+                    self._grow()
+                self._ids.append(doc_id)
+                self._docs.append(doc)
+                self._row_of[doc_id] = row
+            else:
+                self._docs[row] = doc
+            self._vectors[row] = vec / norm
+            self._last_updated[row] = _to_epoch(data.get("last_updated"))
+            self._expire_at[row] = _to_epoch(data.get("expireAt"))
+        return True
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            row = self._row_of.pop(doc_id, None)
+            if row is None:
+                return
+            last = len(self._ids) - 1
+            if row != last:
+                # Move last row into the hole to keep the matrix dense
+                moved_id = self._ids[last]
+                self._vectors[row] = self._vectors[last]
+                self._last_updated[row] = self._last_updated[last]
+                self._expire_at[row] = self._expire_at[last]
+                self._ids[row] = moved_id
+                self._docs[row] = self._docs[last]
+                self._row_of[moved_id] = row
+            self._ids.pop()
+            self._docs.pop()
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._docs.clear()
+            self._row_of.clear()
+
+    def prune_expired(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        with self._lock:
+            n = len(self._ids)
+            expired_rows = np.nonzero((self._expire_at[:n] > 0) & (self._expire_at[:n] < now))[0]
+            expired_ids = [self._ids[r] for r in expired_rows]
+        for doc_id in expired_ids:
+            self.remove(doc_id)
+        self._pruned_at = time.time()
+        return len(expired_ids)
+
+    def maybe_prune(self) -> int:
+        """prune_expired() at most once per PRUNE_INTERVAL_SECONDS."""
+        if time.time() - self._pruned_at < PRUNE_INTERVAL_SECONDS:
+            return 0
+        return self.prune_expired()
+
+    def search(
+        self,
+        query_emb,
+        top_k: int = 5,
+        min_similarity: float = 0.0,
+        updated_since: float = 0.0,
+    ) -> List[dict]:
+        """Return up to top_k {'id', 'doc', 'similarity'} sorted by similarity."""
+        q = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        q = q / norm
+        now = time.time()
+
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return []
+            sims = self._vectors[:n] @ q
+            valid = sims > min_similarity
+            if updated_since:
+                valid &= self._last_updated[:n] >= updated_since
+            expire = self._expire_at[:n]
+            valid &= (expire == 0) | (expire >= now)
+
+            candidates = np.nonzero(valid)[0]
+            if candidates.size == 0:
+                return []
+            if candidates.size > top_k:
+                part = np.argpartition(-sims[candidates], top_k - 1)[:top_k]
+                candidates = candidates[part]
+            order = candidates[np.argsort(-sims[candidates])]
+
+            return [
+                {"id": self._ids[r], "doc": self._docs[r], "similarity": float(sims[r])}
+                for r in order
+            ]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "size": len(self._ids),
+                "capacity": int(self._vectors.shape[0]),
+            }
+
+
+# -----------------------------
+# FIRESTORE SYNC
+# -----------------------------
+_INDEX = ArticleIndex()
+_start_lock = threading.Lock()
+_started = False
+_retry_at = 0.0
+_listener = None
+
+
+def get_article_index() -> ArticleIndex:
+    return _INDEX
+
+
+def _bootstrap(db):
+    global _listener, _started, _retry_at
+    start = time.time()
+    listen_from = datetime.utcnow()
+    loaded = 0
+    try:
+        with timed_component("article_index"):
+            for doc in db.collection("articles").stream():
+                if _INDEX.upsert(doc.id, doc.to_dict()):
+                    loaded += 1
+            _INDEX.prune_expired()
+            _INDEX.ready = True
+        print(f"✅ Article index loaded {loaded} embeddings in {time.time() - start:.2f}s")
+    except Exception as e:
+        print(f"⚠️ Article index bootstrap failed: {e}; retrying in {BOOTSTRAP_RETRY_SECONDS:.0f}s")
+        with _start_lock:
+            _retry_at = time.monotonic() + BOOTSTRAP_RETRY_SECONDS
+            _started = False
+        return
+
+    def _on_snapshot(col_snapshot, changes, read_time):
+        for change in changes:
+            if change.type.name == "REMOVED":
+                _INDEX.remove(change.document.id)
+            else:
+                _INDEX.upsert(change.document.id, change.document.to_dict())
+        # Firestore TTL deletes lag behind expireAt; drop expired rows as we go
+        _INDEX.maybe_prune()
+
+    try:
+        _listener = (
+            db.collection("articles")
+              .where("last_updated", ">=", listen_from)
+              .on_snapshot(_on_snapshot)
+        )
+    except Exception as e:
+        print(f"⚠️ Article index listener failed to start: {e}")
+
+
+def start_article_index(db):
+    """
+    Kick off the bulk load + change listener once per process (non-blocking).
+    A failed bootstrap is retried on a later call after BOOTSTRAP_RETRY_SECONDS.
+    """
+    global _started
+    if _started:
+        if _INDEX.ready:
+            _INDEX.maybe_prune()
+        return
+    with _start_lock:
+        if _started or time.monotonic() < _retry_at:
+            return
+        _started = True
+        threading.Thread(target=_bootstrap, args=(db,), name="article-index", daemon=True).start()
@@ -0,0 +1,126 @@
+# async_runtime.py
+"""
+One long-lived asyncio event loop per worker process, running in a
+background thread, plus a pooled keep-alive aiohttp session bound to it.
+
+Flask handler threads submit coroutines with `run_coroutine(coro)` instead
+of calling asyncio.run() per request, so loop setup and TLS connections to
+googleapis.com are reused across requests.
+"""
+import asyncio
+import atexit
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from startup import register_component
+
+HTTP_POOL_LIMIT = int(os.getenv("ASYNC_HTTP_POOL_LIMIT", "64"))
+HTTP_POOL_PER_HOST = int(os.getenv("ASYNC_HTTP_POOL_PER_HOST", "16"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("ASYNC_HTTP_KEEPALIVE_SECONDS", "60"))
+# asyncio.to_thread() uses the loop's default executor; size it for every
+# concurrent pipeline's blocking Gemini / Firestore calls, not for CPU count.
+TO_THREAD_WORKERS = int(os.getenv("ASYNC_TO_THREAD_WORKERS", "32"))
+
+_loop = None
+_thread = None
+_session = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+    if _loop is not None and _thread.is_alive():
+        return _loop
+    with _lock:
+        if _loop is None or not _thread.is_alive():
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(
+                ThreadPoolExecutor(max_workers=TO_THREAD_WORKERS, thread_name_prefix="async-to-thread")
+            )
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            _thread = threading.Thread(target=_run, name="async-runtime", daemon=True)
+            _thread.start()
+            ready.wait()
+            _loop = loop
+            print("✅ Background event loop started")
+    return _loop
+
+
+register_component("event_loop", get_loop)
+
+
+async def _run_in_context(coro, context: contextvars.Context):
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+
+def run_coroutine(coro, timeout: float = None):
+    """
+    Run `coro` on the shared loop and block the calling thread for its result.
+    The coroutine sees the caller's contextvars (e.g. the active request trace).
+    """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_coroutine() called from the runtime loop itself; await the coroutine instead")
+    context = contextvars.copy_context()
+    return asyncio.run_coroutine_threadsafe(_run_in_context(coro, context), loop).result(timeout)
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Shared keep-alive session; must be awaited on the runtime loop."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+@asynccontextmanager
+async def http_session():
+    """
+    Yield the pooled session when running on the runtime loop; on any other
+    loop (scripts, tests) fall back to a short-lived session.
+    """
+    if _loop is not None and asyncio.get_running_loop() is _loop:
+        yield await get_http_session()
+    else:
+        async with aiohttp.ClientSession() as session:
+            yield session
+
+
+def shutdown(timeout: float = 5.0):
+    loop = _loop
+    if loop is None or not loop.is_running():
+        return
+
+    async def _close():
+        if _session is not None and not _session.closed:
+            await _session.close()
+
+    try:
+        asyncio.run_coroutine_threadsafe(_close(), loop).result(timeout)
+    except Exception as e:
+        print(f"⚠️ Failed to close shared HTTP session: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,125 @@
+# auth_tokens.py
+"""
+Process-wide OAuth access token provider for Vertex AI calls.
+
+Credentials are resolved once; the token is cached and refreshed by a
+background thread shortly before it expires, so request threads normally
+read a valid token without touching the metadata server.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+import google.auth
+from google.auth.transport.requests import Request
+
+import cassettes
+from startup import register_component, timed_component
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+REFRESH_AHEAD_SECONDS = float(os.getenv("TOKEN_REFRESH_AHEAD_SECONDS", "300"))
+MIN_REFRESH_INTERVAL = 30.0
+
+
+class TokenProvider:
+    def __init__(self, scopes=None, refresh_ahead: float = REFRESH_AHEAD_SECONDS):
+        self.scopes = scopes or SCOPES
+        self.refresh_ahead = refresh_ahead
+        self._creds = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh_ms = 0.0
+        self.max_refresh_ms = 0.0
+        self._total_refresh_ms = 0.0
+
+    def _seconds_left(self) -> float:
+        if self._creds is None or not self._creds.token:
+            return 0.0
+        expiry = getattr(self._creds, "expiry", None)
+        if expiry is None:
+            return float("inf")
+        return (expiry - datetime.utcnow()).total_seconds()
+
+    def _refresh_locked(self):
+        start = time.perf_counter()
+        try:
+            if self._creds is None:
+                self._creds, _ = google.auth.default(scopes=self.scopes)
+            self._creds.refresh(Request())
+        except Exception:
+            self.failures += 1
+            raise
+        elapsed = (time.perf_counter() - start) * 1000.0
+        self.refreshes += 1
+        self.last_refresh_ms = elapsed
+        self.max_refresh_ms = max(self.max_refresh_ms, elapsed)
+        self._total_refresh_ms += elapsed
+
+    def get_token(self) -> str:
+        if self._seconds_left() > self.refresh_ahead / 2:
+            return self._creds.token
+        with self._lock:
+            # Only block when the token is missing or about to expire
+            if self._seconds_left() <= self.refresh_ahead / 2:
+                self._refresh_locked()
+            token = self._creds.token
+        self._ensure_refresher()
+        return token
+
+    def _ensure_refresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="token-refresher", daemon=True
+                )
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            wait = max(MIN_REFRESH_INTERVAL, self._seconds_left() - self.refresh_ahead)
+            if wait == float("inf"):
+                wait = 3600.0
+            time.sleep(wait)
+            try:
+                with self._lock:
+                    if self._seconds_left() <= self.refresh_ahead:
+                        self._refresh_locked()
+            except Exception as e:
+                print(f"⚠️ Background token refresh failed: {e}")
+
+    def get_stats(self) -> dict:
+        left = self._seconds_left()
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_refresh_ms": round(self.last_refresh_ms, 2),
+            "max_refresh_ms": round(self.max_refresh_ms, 2),
+            "avg_refresh_ms": round(self._total_refresh_ms / self.refreshes, 2) if self.refreshes else 0.0,
+            "seconds_until_expiry": None if left == float("inf") else round(left, 1),
+        }
+
+
+_PROVIDER = TokenProvider()
+
+
+def get_access_token() -> str:
+    if cassettes.REPLAYING:
+        return "cassette-replay"   # the calls it authorises are replayed too
+    return _PROVIDER.get_token()
+
+
+def get_token_stats() -> dict:
+    return _PROVIDER.get_stats()
+
+
+def _warm_token():
+    with timed_component("oauth_token"):
+        get_access_token()
+
+
+register_component("oauth_token", _warm_token)
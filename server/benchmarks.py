@@ -0,0 +1,446 @@
+# benchmarks.py
+"""
+Offline micro-benchmarks for the request hot paths (no network needed).
+
+    python benchmarks.py run                          # -> bench_results.json
+    python benchmarks.py run --only similarity --sizes 50,10000
+    python benchmarks.py run --save-baseline          # -> benchmarks_baseline.json
+    python benchmarks.py run --baseline benchmarks_baseline.json
+    python benchmarks.py compare bench_results.json benchmarks_baseline.json
+
+Each benchmark reports per-call timings (median / mean / p95 / min, in
+microseconds) and item throughput. `compare` flags any benchmark whose
+median got slower than the baseline by more than --threshold (default
+20%) and exits non-zero, so it can gate a deploy.
+
+Baselines are only comparable on the same machine type; record one on
+the build host with --save-baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Importing app must not start the warm-up thread (which would dial out),
+# and modules that check their keys at import must load without real ones
+os.environ.setdefault("WARMUP_ON_START", "0")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("PINECONE_API", "benchmark")
+os.environ.setdefault("APP_SECRET_KEY", "benchmark")
+
+import numpy as np
+
+DEFAULT_OUTPUT = "bench_results.json"
+DEFAULT_BASELINE = "benchmarks_baseline.json"
+DEFAULT_SIZES = (50, 10_000, 1_000_000)
+DEFAULT_THRESHOLD = 0.20
+EMBED_DIM = 384
+
+# name -> (setup(args) -> (fn, items_per_call))
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Skip(Exception):
+    """Raised by a setup function when the benchmark can't run here."""
+
+
+# -----------------------------
+# FIXTURES
+# -----------------------------
+ARTICLE_TEXT = " ".join(
+    f"Officials in region {i} said on Tuesday that the new policy would take effect next month. "
+    f"Critics argued the figures cited by the ministry were misleading! Was the report accurate? "
+    f"Independent analysts estimated the cost at {i * 13} million dollars."
+    for i in range(12)
+)
+
+SHORT_TEXTS = [
+    f"Claim {i}: the government announced {i * 7} new hospitals will open before the election."
+    for i in range(32)
+]
+
+
+def _unit_vectors(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    vecs = rng.standard_normal((n, EMBED_DIM), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs
+
+
+def _pipeline_payload() -> dict:
+    """Shape of a detect_fake_text result as returned through /detect_text."""
+    evidences = [
+        {
+            "title": f"Article {i}",
+            "link": f"https://news{i}.example.com/story/{i}",
+            "snippet": ARTICLE_TEXT[i * 40:i * 40 + 300],
+            "similarity": np.float32(0.8123 - i / 100),
+            "domain_score": np.float64(0.66),
+            "evidence_score": np.float32(0.74),
+            "is_new_domain": bool(i % 2),
+            "relevance": "supports" if i % 3 else "contradicts",
+            "confidence": np.int64(70 + i),
+        }
+        for i in range(6)
+    ]
+    claim = {
+        "claim_text": SHORT_TEXTS[0],
+        "gemini": {"prediction": "Fake", "confidence": 82},
+        "vertex_ai": {"Real": np.float32(0.21), "Fake": np.float32(0.7), "Misleading": np.float32(0.09)},
+        "fact_check": {
+            "status": "predominantly_false",
+            "fact_checks": [
+                {"claim": SHORT_TEXTS[i], "publisher": "FactCheck", "rating": "false",
+                 "rating_category": "false", "title": "Rating", "url": "https://fc.example.com"}
+                for i in range(5)
+            ],
+            "summary": {"total": 5, "false_count": 4, "true_count": 0, "mixed_count": 1},
+        },
+        "corroboration": {"status": "corroborated", "evidences": evidences},
+        "ensemble": {"final_prediction": "Fake", "final_confidence": 81},
+        "explanation": "Multiple credible outlets contradict the claim." * 3,
+        "evidence_strength": np.float64(-1.2),
+        "raw": b"\x00binary-ish bytes\xff",
+    }
+    return {
+        "summary": {"score": 81, "prediction": "Fake", "explanation": claim["explanation"]},
+        "runtime": 9.81,
+        "claims_checked": 1,
+        "raw_details": [claim],
+    }
+
+
+# -----------------------------
+# BENCHMARKS
+# -----------------------------
+def _embed_model():
+    try:
+        from embedding_backends import load_embed_model
+        from embedding_service import EMBED_BACKEND
+        model, _ = load_embed_model(EMBED_BACKEND)
+        return model
+    except Exception as e:
+        raise Skip(f"embedding model unavailable: {e}")
+
+
+@benchmark("embedding.single")
+def _embedding_single(args):
+    model = _embed_model()
+
+    def run():
+        for text in SHORT_TEXTS:
+            model.encode([text], batch_size=1, convert_to_tensor=False)
+    return run, len(SHORT_TEXTS)
+
+
+@benchmark("embedding.batched")
+def _embedding_batched(args):
+    model = _embed_model()
+
+    def run():
+        model.encode(SHORT_TEXTS, batch_size=len(SHORT_TEXTS), convert_to_tensor=False)
+    return run, len(SHORT_TEXTS)
+
+
+def _index_of(n: int):
+    """ArticleIndex filled straight into its matrix (per-row upsert of 1M docs takes minutes)."""
+    from article_index import ArticleIndex
+
+    index = ArticleIndex(initial_capacity=n)
+    index._vectors[:n] = _unit_vectors(n)
+    index._last_updated[:n] = time.time()
+    index._ids = [f"doc-{i}" for i in range(n)]
+    index._docs = [{"text_score": 0.5} for _ in range(n)]
+    index._row_of = {doc_id: i for i, doc_id in enumerate(index._ids)}
+    index.ready = True
+    return index
+
+
+def _register_similarity(sizes):
+    for n in sizes:
+        def setup(args, n=n):
+            index = _index_of(n)
+            query = _unit_vectors(1, seed=1)[0]
+            cutoff = time.time() - 30 * 86400
+
+            def run():
+                index.search(query, top_k=5, min_similarity=0.0, updated_since=cutoff)
+            return run, 1
+        BENCHMARKS[f"similarity.index_search.{n}"] = setup
+
+
+@benchmark("similarity.python_loop.50")
+def _similarity_loop(args):
+    """The pre-index firestore_semantic_search path: per-doc cosine on Python lists."""
+    from embedding_service import cosine_similarity
+
+    docs = [{"embedding": v.tolist(), "text": "x"} for v in _unit_vectors(50)]
+    query = _unit_vectors(1, seed=1)[0]
+
+    def run():
+        [cosine_similarity(query, d["embedding"]) for d in docs]
+    return run, 50
+
+
+@benchmark("ensemble.adjusted_ensemble")
+def _ensemble(args):
+    from misinfo_model import adjusted_ensemble
+
+    cases = [
+        (pred, conf, {"Real": r, "Fake": 1 - r - 0.1, "Misleading": 0.1}, fc, corr, ev)
+        for pred in ("Real", "Fake", "Misleading", "Unknown")
+        for conf in (40, 70, 95)
+        for r in (0.2, 0.7)
+        for fc in ("predominantly_false", "predominantly_true", "no_fact_checks")
+        for corr in ("corroborated", "weak", "no_results")
+        for ev in (-1.0, 0.0, 1.5)
+    ]
+
+    def run():
+        for case in cases:
+            adjusted_ensemble(*case)
+    return run, len(cases)
+
+
+@benchmark("json.make_json_safe")
+def _json_safe(args):
+    from app import make_json_safe
+
+    payload = _pipeline_payload()
+
+    def run():
+        make_json_safe(payload)
+    return run, 1
+
+
+@benchmark("ids.generate_id")
+def _generate_id(args):
+    from database import generate_id
+
+    def run():
+        generate_id("https://example.com/news/story", ARTICLE_TEXT)
+    return run, 1
+
+
+@benchmark("ids.generate_normalized_id")
+def _generate_normalized_id(args):
+    from database import generate_normalized_id
+
+    def run():
+        generate_normalized_id("https://example.com/news/story", ARTICLE_TEXT)
+    return run, 1
+
+
+@benchmark("text.simple_sentence_split")
+def _sentence_split(args):
+    from misinfo_model import simple_sentence_split
+
+    def run():
+        simple_sentence_split(ARTICLE_TEXT)
+    return run, 1
+
+
+@benchmark("gemini.parse_json.clean")
+def _parse_clean(args):
+    from misinfo_model import parse_gemini_json
+
+    reply = json.dumps({"evaluated": [
+        {"title": f"Article {i}", "link": f"https://n{i}.example.com", "relevance": "supports", "confidence": 80}
+        for i in range(8)
+    ]})
+
+    def run():
+        parse_gemini_json(reply)
+    return run, 1
+
+
+@benchmark("gemini.parse_json.fenced")
+def _parse_fenced(args):
+    """Reply wrapped in prose + a code fence: exercises the regex fallback."""
+    from misinfo_model import parse_gemini_json
+
+    body = json.dumps({"prediction": "Fake", "confidence": 85, "explanation": ARTICLE_TEXT[:600]})
+    reply = f"Here is my assessment of the claim.\n```json\n{body}\n```\nLet me know if you need more."
+
+    def run():
+        parse_gemini_json(reply)
+    return run, 1
+
+
+# -----------------------------
+# RUNNER
+# -----------------------------
+def _measure(fn: Callable, min_time: float, min_rounds: int = 5) -> List[float]:
+    """Per-call seconds; calls are grouped into rounds of >= ~20ms to beat timer noise."""
+    fn()   # warm-up
+    start = time.perf_counter()
+    fn()
+    single = max(time.perf_counter() - start, 1e-7)
+    per_round = max(1, int(0.02 / single))
+
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_rounds or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        for _ in range(per_round):
+            fn()
+        samples.append((time.perf_counter() - start) / per_round)
+    return samples
+
+
+def _summary(samples: List[float], items: int) -> dict:
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    return {
+        "median_us": round(median * 1e6, 3),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 3),
+        "p95_us": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1e6, 3),
+        "min_us": round(ordered[0] * 1e6, 3),
+        "rounds": len(ordered),
+        "items_per_call": items,
+        "items_per_second": round(items / median, 1) if median else None,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def _meta() -> dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "embed_backend": os.getenv("EMBED_BACKEND", "torch"),
+    }
+
+
+def run_benchmarks(only: List[str], min_time: float) -> dict:
+    results = {}
+    for name in sorted(BENCHMARKS):
+        if only and not any(pattern in name for pattern in only):
+            continue
+        try:
+            fn, items = BENCHMARKS[name](None)
+            summary = _summary(_measure(fn, min_time), items)
+            results[name] = summary
+            print(f"  {name:<40} median {summary['median_us']:>12.2f} us   "
+                  f"{summary['items_per_second'] or 0:>14,.1f} items/s")
+        except (Skip, ImportError) as e:
+            results[name] = {"skipped": str(e)}
+            print(f"  {name:<40} skipped: {e}")
+        except Exception as e:   # e.g. a module that needs credentials at import
+            results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+            print(f"  {name:<40} skipped: {type(e).__name__}: {e}")
+    return {"meta": _meta(), "results": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> Tuple[List[dict], bool]:
+    rows, regressed = [], False
+    base_results = baseline.get("results", {})
+    for name, cur in sorted(current.get("results", {}).items()):
+        base = base_results.get(name)
+        if "median_us" not in cur:
+            rows.append({"name": name, "status": "skipped"})
+            continue
+        if not base or "median_us" not in base:
+            rows.append({"name": name, "status": "new", "median_us": cur["median_us"]})
+            continue
+        ratio = cur["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        status = "regression" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else "ok"
+        regressed |= status == "regression"
+        rows.append({
+            "name": name,
+            "status": status,
+            "baseline_us": base["median_us"],
+            "median_us": cur["median_us"],
+            "ratio": round(ratio, 3),
+        })
+    return rows, regressed
+
+
+def _print_comparison(rows: List[dict], threshold: float):
+    print(f"\nComparison against baseline (threshold ±{threshold:.0%}):")
+    for row in rows:
+        if "ratio" in row:
+            print(f"  {row['name']:<40} {row['baseline_us']:>12.2f} -> {row['median_us']:>12.2f} us "
+                  f"x{row['ratio']:<6} {row['status']}")
+        else:
+            print(f"  {row['name']:<40} {row['status']}")
+
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write(path: str, data: dict):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print(f"✅ Wrote {path}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="run the suite")
+    run_p.add_argument("--only", action="append", default=[], help="substring filter (repeatable)")
+    run_p.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_SIZES),
+                       help="corpus sizes for similarity.index_search")
+    run_p.add_argument("--min-time", type=float, default=1.0, help="seconds per benchmark")
+    run_p.add_argument("--output", default=DEFAULT_OUTPUT)
+    run_p.add_argument("--baseline", help="compare against this results file")
+    run_p.add_argument("--save-baseline", action="store_true", help=f"also write {DEFAULT_BASELINE}")
+    run_p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    cmp_p = sub.add_parser("compare", help="compare two results files")
+    cmp_p.add_argument("results")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        rows, regressed = compare(_load(args.results), _load(args.baseline), args.threshold)
+        _print_comparison(rows, args.threshold)
+        return 1 if regressed else 0
+
+    _register_similarity(int(n) for n in args.sizes.split(",") if n.strip())
+    print(f"🔹 Running {len(BENCHMARKS)} benchmark definitions (min {args.min_time}s each)")
+    results = run_benchmarks(args.only, args.min_time)
+    _write(args.output, results)
+    if args.save_baseline:
+        _write(DEFAULT_BASELINE, results)
+
+    if args.baseline:
+        rows, regressed = compare(results, _load(args.baseline), args.threshold)
+        results["comparison"] = rows
+        _write(args.output, results)
+        _print_comparison(rows, args.threshold)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
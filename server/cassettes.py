@@ -0,0 +1,346 @@
+# cassettes.py
+"""
+Record / replay of outbound calls, for profiling the pipelines offline.
+
+    CASSETTE_MODE=record  every Gemini, Vertex, Custom Search, Fact Check,
+                          Vision, Translate, Firestore and Pinecone call runs
+                          normally and is appended (request fingerprint,
+                          response, observed latency) to
+                          CASSETTE_DIR/CASSETTE_NAME.jsonl
+    CASSETTE_MODE=replay  the same calls are answered from the cassette
+                          without touching the network or creating clients,
+                          after sleeping latency * CASSETTE_LATENCY_SCALE
+                          (0 = no sleep, 2 = twice as slow)
+
+Call sites wrap the outbound call in `call()` / `acall()` with the request
+fields that identify it and, for SDK objects, an encode/decode pair that
+turns the response into JSON and back into something with the attributes
+the caller reads.
+
+Replay is deterministic: the n-th call with a given fingerprint gets the
+n-th recording of it (the last one repeats). Dates are masked in
+fingerprints, so a cassette recorded yesterday still matches prompts that
+embed today's date. A fingerprint that was never recorded falls back to
+the next unused recording of the same dependency/op, unless
+CASSETTE_STRICT=1; a miss raises CassetteMiss.
+
+`use_responder()` swaps the cassette for a function that synthesises
+entries (loadtest.py uses it to fake every dependency in-process).
+
+Replay with WARMUP_ON_START=0: start-up warm-up would create real clients.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+CASSETTE_NAME = os.getenv("CASSETTE_NAME", "default")
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0"))
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "0") == "1"
+
+RECORDING = CASSETTE_MODE == "record"
+REPLAYING = CASSETTE_MODE == "replay"
+
+# Never written to disk nor part of a fingerprint (API keys, bearer tokens)
+_SECRET_FIELDS = {"key", "api_key", "authorization", "x-goog-api-key"}
+
+_DATE_PATTERNS = (
+    re.compile(
+        r"\b(?:January|February|March|April|May|June|July|August|September|"
+        r"October|November|December) \d{1,2}, \d{4}\b"
+    ),
+    re.compile(r"\b\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"),
+)
+
+
+class CassetteMiss(Exception):
+    """Replay found no recording for a call."""
+
+
+class ReplayedError(Exception):
+    """An exception the dependency raised while the cassette was recorded."""
+
+
+# -----------------------------
+# SERIALISATION
+# -----------------------------
+def _to_json(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    if hasattr(value, "item"):           # numpy scalars
+        return value.item()
+    if hasattr(value, "tolist"):         # numpy arrays
+        return value.tolist()
+    return str(value)
+
+
+def _from_json(obj: dict):
+    if "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _scrub(value):
+    if isinstance(value, dict):
+        return {str(k): _scrub(v) for k, v in value.items() if str(k).lower() not in _SECRET_FIELDS}
+    if isinstance(value, (list, tuple)):
+        return [_scrub(v) for v in value]
+    if isinstance(value, str):
+        for pattern in _DATE_PATTERNS:
+            value = pattern.sub("<date>", value)
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return "sha256:" + hashlib.sha256(bytes(value)).hexdigest()
+    return value
+
+
+def fingerprint(dependency: str, op: Optional[str], request) -> str:
+    canonical = json.dumps(_scrub(request), sort_keys=True, default=_to_json)
+    return hashlib.sha256(f"{dependency}|{op}|{canonical}".encode("utf-8")).hexdigest()[:32]
+
+
+# -----------------------------
+# CASSETTE STORE
+# -----------------------------
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._by_key = {}      # fingerprint -> [entry, ...] in recorded order
+        self._by_op = {}       # (dependency, op) -> [entry, ...]
+        self._key_pos = {}
+        self._used = set()
+        self._seq = 0
+        self.recorded = 0
+        self.replayed = 0
+        self.fallbacks = 0
+        self.misses = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            print(f"⚠️ Cassette {self.path} not found; every call will miss")
+            return
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line, object_hook=_from_json)
+                self._by_key.setdefault(entry["key"], []).append(entry)
+                self._by_op.setdefault((entry["dependency"], entry["op"]), []).append(entry)
+                self._seq = max(self._seq, entry["seq"] + 1)
+        print(f"✅ Cassette {self.path} loaded ({self._seq} recordings)")
+
+    def append(self, entry: dict):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a")
+            entry["seq"] = self._seq
+            self._seq += 1
+            self._file.write(json.dumps(entry, default=_to_json) + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def take(self, dependency: str, op: Optional[str], key: str) -> dict:
+        with self._lock:
+            entries = self._by_key.get(key)
+            if entries:
+                pos = self._key_pos.get(key, 0)
+                self._key_pos[key] = pos + 1
+                entry = entries[min(pos, len(entries) - 1)]
+                self._used.add(entry["seq"])
+                self.replayed += 1
+                return entry
+            if not CASSETTE_STRICT:
+                for entry in self._by_op.get((dependency, op), ()):
+                    if entry["seq"] not in self._used:
+                        self._used.add(entry["seq"])
+                        self.replayed += 1
+                        self.fallbacks += 1
+                        return entry
+            self.misses += 1
+        raise CassetteMiss(f"No recording for {dependency}:{op} ({key})")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": CASSETTE_MODE,
+                "path": self.path,
+                "latency_scale": CASSETTE_LATENCY_SCALE,
+                "strict": CASSETTE_STRICT,
+                "recordings": self._seq,
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "fallbacks": self.fallbacks,
+                "misses": self.misses,
+            }
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    global _cassette
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                cassette = Cassette(os.path.join(CASSETTE_DIR, f"{CASSETTE_NAME}.jsonl"))
+                if REPLAYING or (RECORDING and os.path.exists(cassette.path)):
+                    cassette.load()   # recording appends after existing entries
+                _cassette = cassette
+    return _cassette
+
+
+def _entry(dependency, op, key, elapsed, response=None, error=None) -> dict:
+    entry = {"dependency": dependency, "op": op, "key": key, "latency": round(elapsed, 6)}
+    if error is not None:
+        entry["error"] = {"type": type(error).__name__, "message": str(error)}
+    else:
+        entry["response"] = response
+    return entry
+
+
+_responder = None
+
+
+def use_responder(responder: Callable):
+    """
+    Answer every call from `responder(dependency, op, request)` instead of
+    a cassette file. It returns an entry: {"latency", "response"} or
+    {"latency", "error": {"type", "message"}}.
+    """
+    global REPLAYING, _responder
+    _responder = responder
+    REPLAYING = True
+
+
+def _take(dependency: str, op: Optional[str], request) -> dict:
+    if _responder is not None:
+        return _responder(dependency, op, request)
+    return get_cassette().take(dependency, op, fingerprint(dependency, op, request))
+
+
+def _replayed(entry: dict, decode: Optional[Callable]):
+    if "error" in entry:
+        raise ReplayedError(f"{entry['error']['type']}: {entry['error']['message']}")
+    response = entry.get("response")
+    return decode(response) if decode else response
+
+
+# -----------------------------
+# CALL WRAPPERS
+# -----------------------------
+def call(dependency: str, op: Optional[str], request, fn: Callable,
+         encode: Optional[Callable] = None, decode: Optional[Callable] = None):
+    """Run `fn()` (off), run and record it (record), or answer from the cassette (replay)."""
+    if REPLAYING:
+        entry = _take(dependency, op, request)
+        time.sleep(entry["latency"] * CASSETTE_LATENCY_SCALE)
+        return _replayed(entry, decode)
+    if not RECORDING:
+        return fn()
+
+    key = fingerprint(dependency, op, request)
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        get_cassette().append(_entry(dependency, op, key, time.perf_counter() - start, error=e))
+        raise
+    elapsed = time.perf_counter() - start
+    get_cassette().append(_entry(dependency, op, key, elapsed, response=encode(result) if encode else result))
+    return result
+
+
+async def acall(dependency: str, op: Optional[str], request, fn: Callable,
+                encode: Optional[Callable] = None, decode: Optional[Callable] = None):
+    """call() for coroutines: `fn` returns an awaitable."""
+    if REPLAYING:
+        entry = _take(dependency, op, request)
+        await asyncio.sleep(entry["latency"] * CASSETTE_LATENCY_SCALE)
+        return _replayed(entry, decode)
+    if not RECORDING:
+        return await fn()
+
+    key = fingerprint(dependency, op, request)
+    start = time.perf_counter()
+    try:
+        result = await fn()
+    except Exception as e:
+        get_cassette().append(_entry(dependency, op, key, time.perf_counter() - start, error=e))
+        raise
+    elapsed = time.perf_counter() - start
+    get_cassette().append(_entry(dependency, op, key, elapsed, response=encode(result) if encode else result))
+    return result
+
+
+def get_cassette_stats() -> dict:
+    return get_cassette().get_stats()
+
+
+# -----------------------------
+# CODECS
+# -----------------------------
+def encode_gemini(resp) -> dict:
+    try:
+        text = resp.candidates[0].content.parts[0].text
+    except Exception:
+        try:
+            text = resp.text
+        except Exception:   # blocked / empty replies raise on .text
+            text = ""
+    return {"text": text}
+
+
+def decode_gemini(data: dict):
+    """Stand-in reply: `.text` is set, `.candidates` is empty (callers fall back to .text)."""
+    return SimpleNamespace(text=data["text"], candidates=[])
+
+
+def proto_codec(message_cls):
+    """(encode, decode) for proto-plus responses (Vision, Translate)."""
+    return (
+        lambda msg: type(msg).to_json(msg),
+        lambda data: message_cls.from_json(data, ignore_unknown_fields=True),
+    )
+
+
+def encode_http(resp) -> dict:
+    return {
+        "status": resp.status_code,
+        "headers": dict(resp.headers),
+        "url": resp.url,
+        "body": resp.content,
+    }
+
+
+def decode_http(data: dict):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    resp = requests.Response()
+    resp.status_code = data["status"]
+    resp.headers = CaseInsensitiveDict(data["headers"])
+    resp.url = data["url"]
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp._content = data["body"]
+    resp._content_consumed = True
+    return resp
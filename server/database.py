@@ -1,16 +1,39 @@
 import hashlib
 import re
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
 import google.auth
 from google.cloud import firestore
 
-from google.cloud import firestore
-from sentence_transformers import util
+import cassettes
+from embedding_service import get_embedding, cosine_similarity
+from article_index import get_article_index, start_article_index
+from startup import register_component, timed_component
+from metrics import timed_call
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db():
+    """Lazy Firestore client (avoids auth + channel setup at import time)."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                with timed_component("firestore"):
+                    credentials, project_id = google.auth.default()
+                    _db = firestore.Client(project=project_id)
+    return _db
+
+
+def _warm_article_index():
+    start_article_index(get_db())
 
-from embedding_service import get_embedding  
-credentials, project_id = google.auth.default()
-db = firestore.Client(project=project_id)  
+
+register_component("firestore", get_db, required=True)
+register_component("article_index", _warm_article_index)
 
 # ---------------- Utility Helpers -----------------
 
@@ -45,8 +68,12 @@ def generate_normalized_id(url: str, text: str) -> str:
 
 def get_article_doc(article_id):
     """Fetch existing article from Firestore"""
-    doc = db.collection("articles").document(article_id).get()
-    return doc.to_dict() if doc.exists else None
+    def _get():
+        doc = get_db().collection("articles").document(article_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    with timed_call("firestore", op="get_article"):
+        return cassettes.call("firestore", "get_article", {"id": article_id}, _get)
 
 
 # ----------------- Semantic Search in Firestore -----------------
@@ -62,26 +89,40 @@ def firestore_semantic_search(
 
     cutoff = datetime.utcnow() - timedelta(days=days_back)
 
-    query = (
-        db.collection("articles")
-          .where("last_updated", ">=", cutoff)
-          .limit(50)
-          .stream()
-    )
+    if cassettes.REPLAYING:
+        # The index mirrors Firestore; its recorded lookups are replayed
+        return _index_semantic_search(get_article_index(), text, min_similarity, cutoff)
+
+    db = get_db()
+    start_article_index(db)
+    index = get_article_index()
+    if index.ready:
+        return _index_semantic_search(index, text, min_similarity, cutoff)
+
+    with timed_call("firestore", op="semantic_scan"):
+        docs = cassettes.call(
+            "firestore", "semantic_scan", {"days_back": days_back},
+            lambda: [
+                (doc.id, doc.to_dict())
+                for doc in db.collection("articles")
+                             .where("last_updated", ">=", cutoff)
+                             .limit(50)
+                             .stream()
+            ],
+        )
 
     query_emb = get_embedding(text) 
     candidates = []
 
-    for doc in query:
-        data = doc.to_dict()
+    for doc_id, data in docs:
         if "embedding" in data and data.get("text"):
             stored_emb = data["embedding"]    # list
-            similarity = util.cos_sim(query_emb, stored_emb)[0][0].item()
+            similarity = cosine_similarity(query_emb, stored_emb)
 
             if similarity > min_similarity:
                 candidates.append({
                     "doc": data,
-                    "id": doc.id,
+                    "id": doc_id,
                     "similarity": similarity
                 })
 
@@ -99,4 +140,34 @@ def firestore_semantic_search(
         }
 
     print("ℹ️ No Firestore semantic match")
-    return None
\ No newline at end of file
+    return None
+
+def _index_semantic_search(index, text: str, min_similarity: float, cutoff: datetime) -> Optional[dict]:
+    """Same contract as firestore_semantic_search, answered from the local article index."""
+    query_emb = get_embedding(text)
+    with timed_call("article_index", op="search"):
+        candidates = cassettes.call(
+            "article_index", "search", {"text": text, "min_similarity": min_similarity},
+            lambda: index.search(
+                query_emb,
+                top_k=5,
+                min_similarity=min_similarity,
+                updated_since=(cutoff - datetime(1970, 1, 1)).total_seconds(),
+            ),
+        )
+
+    if candidates:
+        best = max(
+            candidates,
+            key=lambda c: (c["similarity"], c["doc"].get("text_score", 0))
+        )
+
+        print(f"📌 Index semantic match: sim={best['similarity']:.3f} (corpus={len(index)})")
+        return {
+            "best": best["doc"],
+            "best_id": best["id"],
+            "similarity": best["similarity"]
+        }
+
+    print("ℹ️ No Firestore semantic match")
+    return None
@@ -0,0 +1,160 @@
+# domain_score_writer.py
+"""
+Write-behind aggregation of trusted-source score observations.
+
+Corroboration only records (domain, score) in memory, keyed by the
+lower-cased host exactly as before ('www.bbc.com' stays its own doc), so
+existing averages and vote counts keep accumulating. A background thread
+merges observations per domain and periodically folds them into
+`news_sources` inside a Firestore transaction: one get_all() for every
+touched document, then per-domain writes with an atomic num_votes
+increment. Transactions retry on contention, so concurrent instances
+updating the same running average never lose votes.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict
+
+from google.cloud import firestore
+
+import cassettes
+from domain_scores import get_domain_table
+from metrics import timed_call
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("DOMAIN_FLUSH_INTERVAL_SECONDS", "30"))
+MAX_PENDING_DOMAINS = int(os.getenv("DOMAIN_MAX_PENDING", "200"))
+TRANSACTION_CHUNK = 200   # well under Firestore's 500 writes per transaction
+
+
+class DomainScoreAggregator:
+    def __init__(self, interval: float = FLUSH_INTERVAL_SECONDS, max_pending: int = MAX_PENDING_DOMAINS):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: Dict[str, list] = {}    # domain -> [score_sum, count]
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.observations = 0
+        self.flushes = 0
+        self.flushed_domains = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    def observe(self, domain: str, score: float):
+        key = (domain or "").lower().strip()   # news_sources doc id
+        if not key:
+            return
+        with self._lock:
+            entry = self._pending.setdefault(key, [0.0, 0])
+            entry[0] += float(score)
+            entry[1] += 1
+            self.observations += 1
+            pending = len(self._pending)
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def observe_many(self, domain_scores: Dict[str, float]):
+        for domain, score in domain_scores.items():
+            self.observe(domain, score)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="domain-score-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        with self._flush_lock:
+            start = time.perf_counter()
+            items = list(batch.items())
+            done = 0
+            try:
+                for i in range(0, len(items), TRANSACTION_CHUNK):
+                    chunk = dict(items[i:i + TRANSACTION_CHUNK])
+                    self._commit_chunk(chunk)
+                    done += len(chunk)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Domain score flush failed ({len(items) - done} domains re-queued): {e}")
+                self._requeue(dict(items[done:]))
+            self.flushes += 1
+            self.flushed_domains += done
+            self.last_flush_ms = (time.perf_counter() - start) * 1000.0
+        return done
+
+    def _requeue(self, chunk: Dict[str, list]):
+        with self._lock:
+            for domain, (score_sum, count) in chunk.items():
+                entry = self._pending.setdefault(domain, [0.0, 0])
+                entry[0] += score_sum
+                entry[1] += count
+
+    def _commit_chunk(self, chunk: Dict[str, list]):
+        from database import get_db
+
+        def _commit():
+            db = get_db()
+            refs = {domain: db.collection("news_sources").document(domain) for domain in chunk}
+            applied = {}
+
+            @firestore.transactional
+            def _apply(transaction):
+                applied.clear()
+                snapshots = {snap.id: snap for snap in db.get_all(list(refs.values()), transaction=transaction)}
+                for domain, ref in refs.items():
+                    score_sum, count = chunk[domain]
+                    snap = snapshots.get(domain)
+                    data = snap.to_dict() if snap is not None and snap.exists else {}
+                    current_avg = data.get("avg_score", 0.0)
+                    num_votes = data.get("num_votes", 0)
+                    updated_avg = round((current_avg * num_votes + score_sum) / (num_votes + count), 3)
+                    transaction.set(ref, {
+                        "avg_score": updated_avg,
+                        "num_votes": firestore.Increment(count),
+                        "last_updated": datetime.utcnow(),
+                    }, merge=True)
+                    applied[domain] = (updated_avg, num_votes + count)
+
+            _apply(db.transaction())
+            return applied
+
+        with timed_call("firestore", op="domain_transaction"):
+            applied = cassettes.call("firestore", "domain_transaction", {"domains": sorted(chunk)}, _commit)
+
+        table = get_domain_table()
+        for domain, (avg, votes) in applied.items():
+            table.apply_local(domain, avg, votes)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_domains": pending,
+            "observations": self.observations,
+            "flushes": self.flushes,
+            "flushed_domains": self.flushed_domains,
+            "failures": self.failures,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+
+DOMAIN_AGGREGATOR = DomainScoreAggregator()
+atexit.register(DOMAIN_AGGREGATOR.flush)
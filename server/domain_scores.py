@@ -0,0 +1,225 @@
+# domain_scores.py
+"""
+Locally held mirror of the Firestore `news_sources` collection.
+
+Loaded once in bulk, then kept current by a snapshot listener (or, if the
+listener cannot start, by a background thread reloading every TTL).
+Lookups are plain dict reads on a normalised domain key, so corroboration
+makes no per-evidence Firestore calls and never waits on a (re)load.
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Set
+from urllib.parse import urlparse
+
+import cassettes
+from metrics import timed_call
+from startup import register_component, timed_component
+
+DOMAIN_TABLE_TTL = float(os.getenv("DOMAIN_TABLE_TTL_SECONDS", "300"))
+BOOTSTRAP_RETRY_SECONDS = 60.0
+
+DEFAULT_CREDIBLE_DOMAINS = frozenset([
+    "reuters.com", "bbc.com", "apnews.com", "cnn.com", "nytimes.com",
+    "theguardian.com", "npr.org", "aljazeera.com", "bloomberg.com",
+])
+
+
+def normalize_domain(value: str) -> str:
+    """'https://WWW.BBC.com:443/news' / 'www.bbc.com' / 'bbc.com/' -> 'bbc.com'"""
+    if not value:
+        return ""
+    value = value.strip().lower()
+    if "://" in value:
+        value = urlparse(value).netloc
+    value = value.split("/", 1)[0].split(":", 1)[0].rstrip(".")
+    if value.startswith("www."):
+        value = value[4:]
+    return value
+
+
+class DomainScoreTable:
+    def __init__(self, ttl_seconds: float = DOMAIN_TABLE_TTL):
+        self.ttl = ttl_seconds
+        self._scores: Dict[str, dict] = {}     # normalised domain -> best-voted record
+        self._docs: Dict[str, dict] = {}       # news_sources doc id -> record
+        self._doc_ids: Dict[str, Set[str]] = {}  # normalised domain -> its doc ids
+        self._credible: Set[str] = set()
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._listener = None
+        self._db_getter = None
+        self._reload_lock = threading.Lock()   # single-flight for refresh()
+        self._reloader = None
+        self.reloads = 0
+        self.listener_updates = 0
+
+    # ---- writes -----------------------------------------------------
+    @staticmethod
+    def _record(data: dict) -> dict:
+        return {
+            "avg_score": float(data.get("avg_score", 0.0) or 0.0),
+            "num_votes": int(data.get("num_votes", 0) or 0),
+        }
+
+    def _set_doc(self, doc_id: str, data: Optional[dict]):
+        """Add, replace (data) or remove (None) one doc and re-derive its domain. Lock held."""
+        key = normalize_domain(doc_id)
+        if not key:
+            return
+        ids = self._doc_ids.setdefault(key, set())
+        if data is None:
+            self._docs.pop(doc_id, None)
+            ids.discard(doc_id)
+        else:
+            self._docs[doc_id] = self._record(data)
+            ids.add(doc_id)
+        # 'www.x.com' and 'x.com' docs collapse to one key: the better-voted one wins
+        if ids:
+            self._scores[key] = max((self._docs[i] for i in ids), key=lambda r: r["num_votes"])
+        else:
+            self._doc_ids.pop(key, None)
+            self._scores.pop(key, None)
+
+    def _rebuild_credible(self):
+        self._credible = {d for d, r in self._scores.items() if r["num_votes"] >= 1}
+
+    def load(self, db_getter):
+        scores: Dict[str, dict] = {}
+        with timed_call("firestore", op="load_news_sources"):
+            docs = cassettes.call(
+                "firestore", "load_news_sources", {},
+                lambda: [(doc.id, doc.to_dict() or {}) for doc in db_getter().collection("news_sources").stream()],
+            )
+        raw = {doc_id: self._record(data) for doc_id, data in docs if normalize_domain(doc_id)}
+        doc_ids: Dict[str, Set[str]] = {}
+        for doc_id, record in raw.items():
+            key = normalize_domain(doc_id)
+            doc_ids.setdefault(key, set()).add(doc_id)
+            existing = scores.get(key)
+            if existing is None or record["num_votes"] > existing["num_votes"]:
+                scores[key] = record
+        with self._lock:
+            self._docs = raw
+            self._doc_ids = doc_ids
+            self._scores = scores
+            self._rebuild_credible()
+            self._loaded_at = time.time()
+            self.reloads += 1
+
+    def apply_local(self, doc_id: str, avg_score: float, num_votes: int):
+        """Reflect a write made by this process before the listener echoes it."""
+        with self._lock:
+            self._set_doc(doc_id, {"avg_score": avg_score, "num_votes": num_votes})
+            self._rebuild_credible()
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        with self._lock:
+            for change in changes:
+                removed = change.type.name == "REMOVED"
+                self._set_doc(change.document.id, None if removed else change.document.to_dict() or {})
+                self.listener_updates += 1
+            self._rebuild_credible()
+            self._loaded_at = time.time()
+
+    def start(self, db_getter):
+        """Bulk load + listener. Safe to call repeatedly."""
+        self._db_getter = db_getter
+        if self._loaded_at:
+            return
+        with timed_component("domain_scores"):
+            self.load(db_getter)
+            if cassettes.REPLAYING:
+                # The bulk load was replayed; a live listener would read real Firestore
+                print(f"✅ Domain score table replayed ({len(self._scores)} domains)")
+                return
+            try:
+                self._listener = db_getter().collection("news_sources").on_snapshot(self._on_snapshot)
+            except Exception as e:
+                print(f"⚠️ news_sources listener unavailable ({e}); using {self.ttl:.0f}s TTL reloads")
+                self._reloader = threading.Thread(target=self._reload_loop, name="domain-scores", daemon=True)
+                self._reloader.start()
+        print(f"✅ Domain score table loaded ({len(self._scores)} domains)")
+
+    def refresh(self) -> bool:
+        """Reload from Firestore now. Returns False if a reload is already running or fails."""
+        if self._db_getter is None or not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self.load(self._db_getter)
+            return True
+        except Exception as e:
+            print(f"⚠️ Domain table reload failed: {e}")
+            return False
+        finally:
+            self._reload_lock.release()
+
+    def _reload_loop(self):
+        while True:
+            time.sleep(self.ttl)
+            self.refresh()
+
+    # ---- reads ------------------------------------------------------
+    def get(self, domain: str) -> Optional[dict]:
+        return self._scores.get(normalize_domain(domain))
+
+    def score(self, domain: str) -> float:
+        record = self.get(domain)
+        return record["avg_score"] if record else 0.0
+
+    def credible_domains(self) -> Set[str]:
+        return self._credible or set(DEFAULT_CREDIBLE_DOMAINS)
+
+    def is_credible(self, domain: str) -> bool:
+        return normalize_domain(domain) in self.credible_domains()
+
+    def get_stats(self) -> dict:
+        return {
+            "domains": len(self._scores),
+            "credible": len(self._credible),
+            "mode": "replay" if cassettes.REPLAYING else "listener" if self._listener is not None else "ttl",
+            "reloads": self.reloads,
+            "listener_updates": self.listener_updates,
+            "age_seconds": round(time.time() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+
+_TABLE = DomainScoreTable()
+_start_lock = threading.Lock()
+_started = False
+_retry_at = 0.0
+
+
+def _bootstrap():
+    global _started, _retry_at
+    from database import get_db
+    try:
+        _TABLE.start(get_db)
+    except Exception as e:
+        print(f"⚠️ Domain table load failed: {e}; retrying in {BOOTSTRAP_RETRY_SECONDS:.0f}s")
+        with _start_lock:
+            _retry_at = time.monotonic() + BOOTSTRAP_RETRY_SECONDS
+            _started = False
+
+
+def get_domain_table() -> DomainScoreTable:
+    """
+    Domain table; the first call starts the bulk load in the background.
+    Until it lands (or while it keeps failing) lookups score 0 and
+    credible_domains() serves DEFAULT_CREDIBLE_DOMAINS.
+    """
+    global _started
+    if not _started and time.monotonic() >= _retry_at:
+        with _start_lock:
+            if not _started and time.monotonic() >= _retry_at:
+                _started = True
+                threading.Thread(target=_bootstrap, name="domain-scores-load", daemon=True).start()
+    return _TABLE
+
+
+def get_domain_stats() -> dict:
+    return _TABLE.get_stats()
+
+
+register_component("domain_scores", get_domain_table)
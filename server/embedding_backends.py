@@ -0,0 +1,198 @@
+# embedding_backends.py
+"""
+Selectable inference backends for the MiniLM embedder.
+
+    EMBED_BACKEND=torch   full-precision SentenceTransformer (default)
+    EMBED_BACKEND=int8    same model with dynamic int8 quantized Linear layers
+    EMBED_BACKEND=onnx    exported ONNX graph (int8 unless exported with --fp32) on onnxruntime
+
+Every backend exposes SentenceTransformer-style encode() and returns
+384-dim L2-normalised float32 vectors.
+"""
+import os
+import sys
+import time
+from typing import List, Union
+
+import numpy as np
+
+MODEL_DIR = os.getenv("EMBED_MODEL_DIR", "./models/all-MiniLM-L6-v2")
+ONNX_PATH = os.getenv("EMBED_ONNX_PATH", "./models/all-MiniLM-L6-v2-onnx/model_int8.onnx")
+MAX_SEQ_LENGTH = 256
+
+PARITY_SAMPLE_TEXTS = [
+    "Government announces new tax relief for small businesses starting next month.",
+    "Scientists confirm the discovery of water ice on the surface of the moon.",
+    "Viral post claims drinking hot water cures viral infections.",
+    "The central bank raised interest rates by 25 basis points on Wednesday.",
+    "Breaking: celebrity spotted at local cafe, fans gather outside.",
+]
+
+
+# -----------------------------
+# TORCH BACKENDS
+# -----------------------------
+def _load_torch_model():
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(MODEL_DIR, device="cpu")
+
+    # Force full materialization (prevents meta tensors)
+    for _, param in model._first_module().named_parameters():
+        param.data = param.data.to(torch.device("cpu"))
+    return model
+
+
+def _load_int8_model():
+    import torch
+
+    model = _load_torch_model()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# -----------------------------
+# ONNX BACKEND
+# -----------------------------
+class OnnxEmbedder:
+    """Tokenizer + onnxruntime session + mean pooling, matching the MiniLM pipeline."""
+
+    def __init__(self, onnx_path: str = ONNX_PATH, tokenizer_dir: str = MODEL_DIR):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("❌ EMBED_BACKEND=onnx requires the onnxruntime package") from e
+        from transformers import AutoTokenizer
+
+        if not os.path.exists(onnx_path):
+            raise RuntimeError(f"❌ ONNX model not found at {onnx_path} (run: python embedding_backends.py export)")
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.intra_op_num_threads = int(os.getenv("EMBED_ONNX_THREADS", "0"))
+        self.session = ort.InferenceSession(onnx_path, opts, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_tensor: bool = False, **_):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = []
+
+        for i in range(0, len(texts), max(1, batch_size)):
+            chunk = texts[i:i + batch_size]
+            enc = self.tokenizer(
+                chunk, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np"
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self._input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+
+        vectors = np.concatenate(out, axis=0) if out else np.zeros((0, 384), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+
+def export_onnx(out_path: str = ONNX_PATH, quantize: bool = True) -> str:
+    """Export the MiniLM transformer to ONNX (optionally int8 dynamic-quantized)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
+    model = AutoModel.from_pretrained(MODEL_DIR).eval()
+
+    dummy = tokenizer(["export sample"], return_tensors="pt")
+    fp32_path = os.path.splitext(out_path)[0] + "_fp32.onnx" if quantize else out_path
+
+    torch.onnx.export(
+        model,
+        (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "seq"},
+            "attention_mask": {0: "batch", 1: "seq"},
+            "token_type_ids": {0: "batch", 1: "seq"},
+            "last_hidden_state": {0: "batch", 1: "seq"},
+        },
+        opset_version=17,
+    )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+
+    print(f"✅ Exported ONNX embedder to {out_path}")
+    return out_path
+
+
+# -----------------------------
+# LOADER
+# -----------------------------
+def load_embed_model(backend: str = "torch"):
+    """
+    Load the embedder for `backend`; unknown or failing backends fall back to
+    torch. Raises RuntimeError when torch itself cannot be loaded.
+    """
+    backend = (backend or "torch").lower()
+    start = time.time()
+    try:
+        if backend == "onnx":
+            model = OnnxEmbedder()
+        elif backend == "int8":
+            model = _load_int8_model()
+        else:
+            backend = "torch"
+            model = _load_torch_model()
+    except Exception as e:
+        if backend == "torch":
+            raise RuntimeError(f"❌ Embedding backend 'torch' failed to load: {e}") from e
+        print(f"⚠️ Embedding backend '{backend}' failed ({e}); falling back to torch")
+        try:
+            model = _load_torch_model()
+        except Exception as torch_error:
+            raise RuntimeError(
+                f"❌ Embedding backend '{backend}' failed ({e}) and the torch fallback failed too: {torch_error}"
+            ) from torch_error
+        backend = "torch"
+
+    print(f"✅ Embedding backend '{backend}' ready in {time.time() - start:.2f}s")
+    return model, backend
+
+
+def parity_check(model, texts: List[str] = None, reference=None) -> dict:
+    """Cosine drift of `model` against the full-precision torch backend."""
+    texts = texts or PARITY_SAMPLE_TEXTS
+    reference = reference or _load_torch_model()
+
+    ref = np.asarray(reference.encode(texts, convert_to_tensor=False), dtype=np.float32)
+    got = np.asarray(model.encode(texts, convert_to_tensor=False), dtype=np.float32)
+
+    ref /= np.linalg.norm(ref, axis=1, keepdims=True)
+    got /= np.linalg.norm(got, axis=1, keepdims=True)
+    cos = (ref * got).sum(axis=1)
+
+    return {
+        "samples": len(texts),
+        "dim": int(got.shape[1]),
+        "mean_cosine": round(float(cos.mean()), 6),
+        "min_cosine": round(float(cos.min()), 6),
+        "max_drift": round(float(1.0 - cos.min()), 6),
+    }
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "parity"
+    if cmd == "export":
+        export_onnx(quantize="--fp32" not in sys.argv)
+    elif cmd == "parity":
+        backend = sys.argv[2] if len(sys.argv) > 2 else os.getenv("EMBED_BACKEND", "torch")
+        model, loaded = load_embed_model(backend)
+        print(f"[{loaded}]", parity_check(model))
+    else:
+        print("usage: python embedding_backends.py [export [--fp32] | parity [torch|int8|onnx]]")
@@ -0,0 +1,186 @@
+# embedding_cache.py
+"""
+Content-hash keyed embedding store on a shared memory-mapped file.
+
+Layout: a fixed header followed by `capacity` slots of
+    [16-byte key][int64 last-access stamp][float32 x dim vector]
+Slots are found by open addressing inside a small probe window; when the
+window is full the least recently used slot in it is overwritten.
+
+All gunicorn workers map the same file, so an embedding computed by one
+worker (or by a previous instance, if the path is on a persistent volume)
+is reused by every other. The file must be host-local: network
+filesystems (NFS, Filestore, GCS FUSE) give no reliable flock or
+MAP_SHARED coherence across hosts. On Cloud Run that means the cache
+lives as long as the instance. Writes are serialised with flock; reads are
+lock-free and re-check the key after copying the vector to detect a
+concurrent overwrite.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+MAGIC = b"EMBCACH1"
+HEADER = struct.Struct("<8sIIQ")   # magic, dim, probe window, capacity
+HEADER_SIZE = 64
+KEY_SIZE = 16
+STAMP_SIZE = 8
+EMPTY_KEY = b"\x00" * KEY_SIZE
+
+
+def normalize_for_embedding(text: str) -> str:
+    """MiniLM is uncased and whitespace-insensitive, so these variants embed identically."""
+    return " ".join(text.lower().split())
+
+
+def content_key(text: str) -> bytes:
+    return hashlib.sha256(normalize_for_embedding(text).encode("utf-8")).digest()[:KEY_SIZE]
+
+
+class MmapEmbeddingCache:
+    def __init__(self, path: str, capacity: int = 32768, dim: int = 384, probe: int = 8):
+        self.path = path
+        self.capacity = capacity
+        self.dim = dim
+        self.probe = probe
+        self.slot_size = KEY_SIZE + STAMP_SIZE + dim * 4
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock_fd = os.open(path + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+        size = HEADER_SIZE + capacity * self.slot_size
+
+        with self._file_lock():
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+            if not self._header_matches(fd, size):
+                # New file or incompatible geometry: start fresh. Never truncate a
+                # file other workers may have mapped (they would SIGBUS); build a
+                # new one and swap it in, old mappings keep their old inode.
+                os.close(fd)
+                self._create(path, size)
+                fd = os.open(path, os.O_RDWR)
+            try:
+                self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            finally:
+                os.close(fd)
+
+    def _create(self, path: str, size: int):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_CREAT | os.O_TRUNC | os.O_RDWR, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            os.pwrite(fd, HEADER.pack(MAGIC, self.dim, self.probe, self.capacity), 0)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+
+    def _header_matches(self, fd, size: int) -> bool:
+        raw = os.pread(fd, HEADER.size, 0)
+        if len(raw) < HEADER.size or os.fstat(fd).st_size < size:
+            return False
+        magic, dim, probe, capacity = HEADER.unpack(raw)
+        return magic == MAGIC and dim == self.dim and probe == self.probe and capacity == self.capacity
+
+    @contextmanager
+    def _file_lock(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _slots(self, key: bytes):
+        start = int.from_bytes(key[:8], "little") % self.capacity
+        for i in range(self.probe):
+            yield HEADER_SIZE + ((start + i) % self.capacity) * self.slot_size
+
+    def _touch(self, offset: int):
+        self._mm[offset + KEY_SIZE: offset + KEY_SIZE + STAMP_SIZE] = struct.pack("<q", time.time_ns())
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        mm = self._mm
+        vec_len = self.dim * 4
+        for off in self._slots(key):
+            slot_key = mm[off: off + KEY_SIZE]
+            if slot_key == EMPTY_KEY:
+                break
+            if slot_key != key:
+                continue
+            vec_off = off + KEY_SIZE + STAMP_SIZE
+            vec = np.frombuffer(mm[vec_off: vec_off + vec_len], dtype=np.float32).copy()
+            if mm[off: off + KEY_SIZE] != key:
+                break   # overwritten while we were reading
+            self._touch(off)
+            with self._lock:
+                self.hits += 1
+            return vec
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: bytes, vector) -> None:
+        vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vec.shape[0] != self.dim:
+            return
+        mm = self._mm
+
+        with self._file_lock():
+            target = None
+            oldest_stamp = None
+            for off in self._slots(key):
+                slot_key = mm[off: off + KEY_SIZE]
+                if slot_key == key or slot_key == EMPTY_KEY:
+                    target = off
+                    break
+                stamp = struct.unpack("<q", mm[off + KEY_SIZE: off + KEY_SIZE + STAMP_SIZE])[0]
+                if oldest_stamp is None or stamp < oldest_stamp:
+                    target, oldest_stamp = off, stamp
+            else:
+                with self._lock:
+                    self.evictions += 1
+
+            # Clear key first so lock-free readers never pair an old key with a new vector
+            mm[target: target + KEY_SIZE] = EMPTY_KEY
+            vec_off = target + KEY_SIZE + STAMP_SIZE
+            mm[vec_off: vec_off + self.dim * 4] = vec.tobytes()
+            self._touch(target)
+            mm[target: target + KEY_SIZE] = key
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def open_embedding_cache(backend: str) -> Optional[MmapEmbeddingCache]:
+    """Open the shared cache for this backend, or None if it cannot be mapped."""
+    if os.getenv("EMBED_CACHE_DISABLED") == "1":
+        return None
+    cache_dir = os.getenv("EMBED_CACHE_DIR", "/tmp/embedding-cache")
+    capacity = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "32768"))
+    path = os.path.join(cache_dir, f"minilm-{backend}.bin")
+    try:
+        cache = MmapEmbeddingCache(path, capacity=capacity)
+        print(f"✅ Embedding cache mapped at {path} ({capacity} slots)")
+        return cache
+    except Exception as e:
+        print(f"⚠️ Embedding cache unavailable ({e}); embeddings will not be cached")
+        return None
@@ -1,25 +1,254 @@
 # embedding_service.py
-from functools import lru_cache
-from sentence_transformers import SentenceTransformer
-import torch
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import List
 
-print("🔹 Loading MiniLM embedding model at startup...")
+import numpy as np
 
-EMBED_MODEL = SentenceTransformer(
-    "./models/all-MiniLM-L6-v2",
-    device="cpu"
-)
+from embedding_backends import load_embed_model, parity_check
+from embedding_cache import content_key, normalize_for_embedding, open_embedding_cache
+from metrics import cache_lookup, count, timed_call
+from startup import register_component, timed_component
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+
+# -----------------------------
+# MICRO-BATCHING CONFIG
+# -----------------------------
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent encode requests for up to `max_wait_ms` and runs
+    them through the model as one batched encode call.
+    Callers block on a Future and receive only their own vector.
+    """
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._batches = 0
+        self._encode_seconds = 0.0
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        fut = Future()
+        self._ensure_worker()
+        self._queue.put((text, fut))
+        return fut
+
+    def encode(self, text: str):
+        return self.submit(text).result()
+
+    def encode_many(self, texts: List[str]) -> list:
+        futures = [self.submit(t) for t in texts]
+        return [f.result() for f in futures]
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+
+            # Identical texts in one window are encoded once
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+
+            start = time.perf_counter()
+            try:
+                with timed_call("embedding", op="encode"):
+                    vectors = self.model.encode(
+                        unique_texts,
+                        batch_size=len(unique_texts),
+                        convert_to_tensor=False,
+                    )
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            by_text = dict(zip(unique_texts, vectors))
+            for text, fut in batch:
+                fut.set_result(by_text[text])
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._encode_seconds += elapsed
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_encode_ms": round(self._encode_seconds * 1000.0 / self._batches, 2) if self._batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
+
+
+# -----------------------------
+# LAZY MODEL / CACHE
+# -----------------------------
+EMBED_MODEL = None
+_BATCHER = None
+_CACHE = None
+_cache_opened = False
+_cache_backend = None
+_init_lock = threading.Lock()
+_cache_lock = threading.Lock()
 
-# Force full materialization (prevents meta tensors)
-for _, param in EMBED_MODEL._first_module().named_parameters():
-    param.data = param.data.to(torch.device("cpu"))
 
 def get_embed_model():
+    """Load the embedding model on first use (or from the warm-up thread)."""
+    global EMBED_MODEL, EMBED_BACKEND, _BATCHER
+    if _BATCHER is not None:
+        return EMBED_MODEL
+    with _init_lock:
+        if _BATCHER is None:
+            with timed_component("embedding_model"):
+                print(f"🔹 Loading MiniLM embedding model (backend={EMBED_BACKEND})...")
+                EMBED_MODEL, EMBED_BACKEND = load_embed_model(EMBED_BACKEND)
+                _match_cache_to_backend()
+
+                if EMBED_BACKEND != "torch" and os.getenv("EMBED_PARITY_CHECK") == "1":
+                    print(f"🔹 Embedding parity vs torch: {parity_check(EMBED_MODEL)}")
+
+                _BATCHER = EmbeddingBatcher(
+                    EMBED_MODEL,
+                    max_batch_size=EMBED_BATCH_MAX_SIZE,
+                    max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+                )
     return EMBED_MODEL
 
-@lru_cache(maxsize=8192)
+
+def _get_batcher() -> EmbeddingBatcher:
+    if _BATCHER is None:
+        get_embed_model()
+    return _BATCHER
+
+
+def _get_cache():
+    """
+    Cache hits never need the model, so the cache is opened independently of
+    it, under the configured backend's name. Writes only follow an encode,
+    i.e. after the model loaded and _match_cache_to_backend() ran.
+    """
+    global _CACHE, _cache_opened, _cache_backend
+    if not _cache_opened:
+        with _cache_lock:
+            if not _cache_opened:
+                with timed_component("embedding_cache"):
+                    _CACHE = open_embedding_cache(EMBED_BACKEND)
+                _cache_backend = EMBED_BACKEND
+                _cache_opened = True
+    return _CACHE
+
+
+def _match_cache_to_backend():
+    """After a fallback (e.g. onnx -> torch), switch to the file of the backend that loaded."""
+    global _CACHE, _cache_backend
+    with _cache_lock:
+        if _cache_opened and _cache_backend != EMBED_BACKEND:
+            print(f"🔹 Embedding cache switched to backend={EMBED_BACKEND}")
+            _CACHE = open_embedding_cache(EMBED_BACKEND)
+            _cache_backend = EMBED_BACKEND
+
+
+register_component("embedding_cache", _get_cache)
+register_component("embedding_model", get_embed_model, required=True)
+
+
 def get_embedding(text: str):
-    return EMBED_MODEL.encode(text, convert_to_tensor=False)
+    """Embedding for `text`, served from the shared on-disk cache when possible."""
+    norm = normalize_for_embedding(text)
+    cache = _get_cache()
+    if cache is None:
+        return _get_batcher().encode(norm)
+
+    key = content_key(norm)
+    vec = cache.get(key)
+    cache_lookup("embedding_mmap", vec is not None)
+    if vec is None:
+        vec = _get_batcher().encode(norm)
+        cache = _get_cache()   # may have switched files when the model loaded
+        if cache is not None:
+            cache.put(key, vec)
+    return vec
+
+def get_embeddings(texts: List[str]) -> list:
+    """Embed many texts in one batched encode; returns vectors in input order."""
+    norms = [normalize_for_embedding(t) for t in texts]
+    cache = _get_cache()
+    if cache is None:
+        return _get_batcher().encode_many(norms)
+
+    keys = [content_key(n) for n in norms]
+    vectors = [cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    count("cache_lookups_total", len(vectors) - len(missing), tier="embedding_mmap", result="hit")
+    count("cache_lookups_total", len(missing), tier="embedding_mmap", result="miss")
+    if missing:
+        encoded = _get_batcher().encode_many([norms[i] for i in missing])
+        cache = _get_cache()   # may have switched files when the model loaded
+        for i, vec in zip(missing, encoded):
+            if cache is not None:
+                cache.put(keys[i], vec)
+            vectors[i] = vec
+    return vectors
 
 def embed_text(text: str) -> list:
-    return EMBED_MODEL.encode(text, convert_to_tensor=False).tolist()
+    return get_embedding(text).tolist()
+
+def cosine_similarity(a, b) -> float:
+    """Plain numpy cosine (avoids importing sentence_transformers.util / torch)."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1)
+    b = np.asarray(b, dtype=np.float32).reshape(-1)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / denom if denom else 0.0
+
+def get_batcher_stats() -> dict:
+    if _BATCHER is None:
+        return {"backend": EMBED_BACKEND, "loaded": False}
+    return {"backend": EMBED_BACKEND, "loaded": True, **_BATCHER.get_stats()}
+
+def get_cache_stats() -> dict:
+    return _CACHE.get_stats() if _CACHE is not None else {"enabled": False}
@@ -0,0 +1,278 @@
+# event_broker.py
+"""
+Per-session SSE event broker living on the shared asyncio loop.
+
+Producers call `publish(session_id, event)` from any thread. Each session
+keeps a bounded replay buffer until a subscriber connects; each subscriber
+gets its own bounded queue (oldest events are dropped for slow clients).
+Sessions nobody reads are evicted after SSE_SESSION_TTL_SECONDS.
+
+When SSE_PORT is set, a small aiohttp server on the same loop serves
+`/stream_logs/<session_id>`, so an idle stream costs a coroutine instead
+of a gunicorn thread, and the Flask route redirects there (SSE_PUBLIC_URL).
+That needs a deployment that routes a second port to the container;
+Cloud Run only exposes $PORT, so leave both unset there.
+
+Without SSE_PUBLIC_URL (the Cloud Run deployment) the Flask route streams
+from the broker on a request thread, but never lets log streams starve
+the API: at most SSE_MAX_THREAD_STREAMS threads (keep it below gunicorn's
+--threads) are parked, each for at most SSE_THREAD_STREAM_SECONDS. A client
+over the cap gets the events buffered so far in one short response; every
+response carries an SSE `retry:` so EventSource reconnects and resumes
+from the session buffer.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from aiohttp import web
+
+from async_runtime import get_loop, run_coroutine
+from startup import register_component, timed_component
+
+SSE_PORT = int(os.getenv("SSE_PORT", "0"))             # 0 = no dedicated server
+SSE_PUBLIC_URL = os.getenv("SSE_PUBLIC_URL", "")       # where clients reach SSE_PORT
+SSE_BUFFER_SIZE = int(os.getenv("SSE_BUFFER_SIZE", "100"))
+SSE_SESSION_TTL_SECONDS = float(os.getenv("SSE_SESSION_TTL_SECONDS", "600"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "30"))
+SSE_MAX_THREAD_STREAMS = int(os.getenv("SSE_MAX_THREAD_STREAMS", "2"))   # < gunicorn --threads (8)
+SSE_THREAD_STREAM_SECONDS = float(os.getenv("SSE_THREAD_STREAM_SECONDS", "25"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "2000"))
+SWEEP_INTERVAL_SECONDS = 60.0
+
+DONE = "DONE"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_retry(ms: int = SSE_RETRY_MS) -> str:
+    return f"retry: {ms}\n\n"
+
+
+def format_sse(event) -> str:
+    if event == DONE:
+        event = {"type": "done"}
+    return f"data: {json.dumps(event)}\n\n"
+
+
+class _Session:
+    __slots__ = ("buffer", "subscribers", "last_active")
+
+    def __init__(self, maxlen: int):
+        self.buffer = deque(maxlen=maxlen)
+        self.subscribers = set()
+        self.last_active = time.monotonic()
+
+
+class EventBroker:
+    """All state is touched only on the runtime loop; publish() hops onto it."""
+
+    def __init__(self, buffer_size: int = SSE_BUFFER_SIZE, ttl_seconds: float = SSE_SESSION_TTL_SECONDS):
+        self.buffer_size = buffer_size
+        self.ttl = ttl_seconds
+        self._sessions = {}
+        self._sweeper = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def _session(self, session_id: str) -> _Session:
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        sess = self._sessions.get(session_id)
+        if sess is None:
+            sess = self._sessions[session_id] = _Session(self.buffer_size)
+        return sess
+
+    # ---- producers ---------------------------------------------------
+    def publish(self, session_id: str, event):
+        """Thread-safe, non-blocking."""
+        if session_id:
+            get_loop().call_soon_threadsafe(self._publish, session_id, event)
+
+    def finish(self, session_id: str):
+        self.publish(session_id, DONE)
+
+    def _publish(self, session_id: str, event):
+        sess = self._session(session_id)
+        sess.last_active = time.monotonic()
+        self.published += 1
+        if not sess.subscribers:
+            if len(sess.buffer) == sess.buffer.maxlen:
+                self.dropped += 1
+            sess.buffer.append(event)
+            return
+        for q in sess.subscribers:
+            if q.full():
+                q.get_nowait()
+                self.dropped += 1
+            q.put_nowait(event)
+
+    # ---- consumers ---------------------------------------------------
+    async def subscribe(self, session_id: str, max_seconds: float = None):
+        """
+        Async generator of events (with heartbeats) until DONE, or until
+        `max_seconds` have passed. Undelivered events go back to the
+        session buffer for the next subscriber.
+        """
+        sess = self._session(session_id)
+        q = asyncio.Queue(maxsize=self.buffer_size)
+        while sess.buffer:
+            q.put_nowait(sess.buffer.popleft())
+        sess.subscribers.add(q)
+        until = time.monotonic() + max_seconds if max_seconds else None
+        try:
+            while True:
+                wait = SSE_HEARTBEAT_SECONDS
+                if until is not None:
+                    wait = min(wait, until - time.monotonic())
+                    if wait <= 0:
+                        return
+                try:
+                    event = await asyncio.wait_for(q.get(), wait)
+                except asyncio.TimeoutError:
+                    if until is None or time.monotonic() < until:
+                        yield {"type": "heartbeat"}
+                    continue
+                self.delivered += 1
+                yield event
+                if event == DONE:
+                    return
+        finally:
+            sess.subscribers.discard(q)
+            sess.last_active = time.monotonic()
+            while not q.empty():
+                sess.buffer.append(q.get_nowait())
+            if not sess.subscribers and not sess.buffer:
+                self._sessions.pop(session_id, None)
+
+    async def drain(self, session_id: str) -> list:
+        """Take the session's buffered events without subscribing."""
+        sess = self._sessions.get(session_id)
+        if sess is None:
+            return []
+        events = list(sess.buffer)
+        sess.buffer.clear()
+        sess.last_active = time.monotonic()
+        self.delivered += len(events)
+        if DONE in events and not sess.subscribers:
+            self._sessions.pop(session_id, None)
+        return events
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+            cutoff = time.monotonic() - self.ttl
+            stale = [
+                sid for sid, sess in self._sessions.items()
+                if not sess.subscribers and sess.last_active < cutoff
+            ]
+            for sid in stale:
+                del self._sessions[sid]
+            self.evicted += len(stale)
+
+    async def _stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "subscribers": sum(len(s.subscribers) for s in self._sessions.values()),
+            "buffered_events": sum(len(s.buffer) for s in self._sessions.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "server_port": SSE_PORT or None,
+        }
+
+    def get_stats(self) -> dict:
+        return run_coroutine(self._stats(), timeout=2)
+
+
+BROKER = EventBroker()
+
+
+# -----------------------------
+# FLASK THREAD FALLBACK
+# -----------------------------
+# Caps how many gunicorn threads can ever be parked on log streams
+THREAD_STREAM_SLOTS = threading.BoundedSemaphore(max(SSE_MAX_THREAD_STREAMS, 0))
+
+
+def drain_events(session_id: str) -> list:
+    """Buffered events for a client that gets no thread slot."""
+    return run_coroutine(BROKER.drain(session_id), timeout=2)
+
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+
+async def _aclose(agen):
+    await agen.aclose()
+
+
+def iter_events_blocking(session_id: str, max_seconds: float = SSE_THREAD_STREAM_SECONDS):
+    """Blocking iterator over a time-boxed subscription, for the Flask fallback route."""
+    agen = BROKER.subscribe(session_id, max_seconds)
+    try:
+        while True:
+            try:
+                event = run_coroutine(_anext(agen))
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        run_coroutine(_aclose(agen), timeout=2)
+
+
+# -----------------------------
+# DEDICATED SSE SERVER
+# -----------------------------
+_runner = None
+_start_lock = threading.Lock()
+
+
+async def _handle_stream(request: web.Request) -> web.StreamResponse:
+    resp = web.StreamResponse(headers={
+        **SSE_HEADERS,
+        "Content-Type": "text/event-stream",
+        "Access-Control-Allow-Origin": "*",
+    })
+    await resp.prepare(request)
+    await resp.write(format_retry().encode("utf-8"))
+    try:
+        async for event in BROKER.subscribe(request.match_info["session_id"]):
+            await resp.write(format_sse(event).encode("utf-8"))
+    except ConnectionResetError:
+        pass
+    return resp
+
+
+async def _start_server():
+    app = web.Application()
+    app.router.add_get("/stream_logs/{session_id}", _handle_stream)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", SSE_PORT).start()
+    return runner
+
+
+def start_event_broker():
+    """Start the dedicated SSE server once (no-op when SSE_PORT is unset)."""
+    global _runner
+    if not SSE_PORT or _runner is not None:
+        return
+    with _start_lock:
+        if _runner is None:
+            with timed_component("event_broker"):
+                _runner = run_coroutine(_start_server(), timeout=10)
+            print(f"✅ SSE broker listening on :{SSE_PORT}")
+
+
+register_component("event_broker", start_event_broker)
@@ -0,0 +1,127 @@
+# http_client.py
+"""
+Shared outbound HTTP layer for synchronous calls.
+
+One requests.Session with a mounted HTTPAdapter keeps a keep-alive
+connection pool per API host, so Fact Check and Vertex skip DNS/TCP/TLS
+setup after the first call. Everything else (user-supplied image URLs)
+goes through a second, cookie-less session with its own pools, so
+arbitrary hosts can neither evict the API pools nor leave cookies behind.
+Latency and errors are counted per API host; other hosts share one
+"other" bucket. Every request goes through the cassette layer
+(record/replay).
+"""
+import os
+from http.cookiejar import DefaultCookiePolicy
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cassettes
+
+# Pools are per host; size them for gunicorn threads + the async to_thread pool
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "16"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_FETCH_POOL_CONNECTIONS = int(os.getenv("HTTP_FETCH_POOL_CONNECTIONS", "8"))
+API_HOST_SUFFIXES = (".googleapis.com",)
+OTHER_HOSTS = "other"
+
+_session = None
+_fetch_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_host_stats = {}
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_fetch_session() -> requests.Session:
+    """Session for arbitrary (user-supplied) hosts: separate pools, no cookies."""
+    global _fetch_session
+    if _fetch_session is None:
+        with _session_lock:
+            if _fetch_session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_FETCH_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _fetch_session = session
+    return _fetch_session
+
+
+def is_api_host(host: str) -> bool:
+    return any(host == s.lstrip(".") or host.endswith(s) for s in API_HOST_SUFFIXES)
+
+
+def _record(host: str, elapsed: float, ok: bool):
+    with _stats_lock:
+        st = _host_stats.setdefault(
+            host, {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        )
+        st["requests"] += 1
+        st["total_ms"] += elapsed * 1000.0
+        st["max_ms"] = max(st["max_ms"], elapsed * 1000.0)
+        if not ok:
+            st["errors"] += 1
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    host = urlparse(url).netloc.lower() or "unknown"
+    api = is_api_host(host)
+    session = get_session if api else get_fetch_session
+    start = time.perf_counter()
+    ok = False
+    try:
+        resp = cassettes.call(
+            "http", host,
+            {"method": method, "url": url, **{k: kwargs.get(k) for k in ("params", "json", "data", "headers")}},
+            lambda: session().request(method, url, **kwargs),
+            encode=cassettes.encode_http,
+            decode=cassettes.decode_http,
+        )
+        ok = resp.status_code < 500
+        return resp
+    finally:
+        _record(host if api else OTHER_HOSTS, time.perf_counter() - start, ok)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def get_host_stats() -> dict:
+    with _stats_lock:
+        return {
+            host: {
+                "requests": st["requests"],
+                "errors": st["errors"],
+                "avg_ms": round(st["total_ms"] / st["requests"], 2) if st["requests"] else 0.0,
+                "max_ms": round(st["max_ms"], 2),
+            }
+            for host, st in _host_stats.items()
+        }
@@ -0,0 +1,364 @@
+# image_hash.py
+"""
+Perceptual-hash index of image verdicts.
+
+Reposts of the same picture (resized, recompressed, served from another
+CDN) keep nearly identical pHash/dHash values, so a Hamming-distance
+lookup over previously analysed images returns a stored verdict before
+Vision, Vertex or Gemini are called. Entries live in the Firestore
+`image_hashes` collection and are mirrored in memory by a snapshot
+listener, so every instance shares the same index. Each entry keeps its
+expireAt: lookups ignore expired rows and evict them.
+
+The bulk load runs on a background thread; until it finishes, lookups
+only see verdicts stored by this process.
+"""
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import cassettes
+from metrics import cache_lookup, count, timed_call
+from startup import register_component, timed_component
+
+PHASH_MAX_DISTANCE = int(os.getenv("IMAGE_PHASH_MAX_DISTANCE", "6"))
+DHASH_MAX_DISTANCE = int(os.getenv("IMAGE_DHASH_MAX_DISTANCE", "10"))
+IMAGE_HASH_TTL_DAYS = int(os.getenv("IMAGE_HASH_TTL_DAYS", "30"))
+BOOTSTRAP_RETRY_SECONDS = 60.0
+# Firestore writes allowed to wait for the writer thread; beyond this they are dropped
+IMAGE_HASH_WRITE_BACKLOG = int(os.getenv("IMAGE_HASH_WRITE_BACKLOG", "200"))
+COLLECTION = "image_hashes"
+
+# Only the verdict itself is stored; vision/vertex details are not replayed
+_STORED_FIELDS = ("score", "verdict", "explanation")
+
+# popcount for every byte value, used to count differing bits of XOR-ed hashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# -----------------------------
+# HASHING
+# -----------------------------
+def _grayscale(content: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(content))
+    img.seek(0)   # first frame of animated GIF/WebP
+    return img.convert("L")
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.reshape(-1):
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(gray: Image.Image) -> int:
+    """64-bit DCT hash: low-frequency 8x8 block compared against its median."""
+    import cv2   # keep OpenCV off the cold-start import path
+    pixels = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float32)
+    low = cv2.dct(pixels)[:8, :8]
+    median = np.median(low.reshape(-1)[1:])   # ignore the DC term
+    return _bits_to_int(low > median)
+
+
+def dhash(gray: Image.Image) -> int:
+    """64-bit gradient hash: each pixel compared with its right neighbour."""
+    pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def compute_hashes(content: bytes) -> Tuple[int, int]:
+    gray = _grayscale(content)
+    return phash(gray), dhash(gray)
+
+
+def _to_epoch(value) -> float:
+    """Firestore timestamps are tz-aware; remember() writes naive UTC. 0 = never expires."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return 0.0
+
+
+def _hamming(hashes: np.ndarray, value: int) -> np.ndarray:
+    diff = np.bitwise_xor(hashes, np.uint64(value))
+    return _POPCOUNT[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+# -----------------------------
+# INDEX
+# -----------------------------
+class PerceptualHashIndex:
+    def __init__(
+        self,
+        phash_max: int = PHASH_MAX_DISTANCE,
+        dhash_max: int = DHASH_MAX_DISTANCE,
+        initial_capacity: int = 1024,
+    ):
+        self.phash_max = phash_max
+        self.dhash_max = dhash_max
+        self._lock = threading.RLock()
+        self._phash = np.zeros(initial_capacity, dtype=np.uint64)
+        self._dhash = np.zeros(initial_capacity, dtype=np.uint64)
+        self._expire_at = np.zeros(initial_capacity, dtype=np.float64)
+        self._ids: List[str] = []
+        self._docs: List[dict] = []
+        self._row_of: Dict[str, int] = {}
+        self.ready = False
+        self.lookups = 0
+        self.hits = 0
+        self.stored = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _grow(self):
+        capacity = self._phash.shape[0] * 2
+        for name in ("_phash", "_dhash", "_expire_at"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: old.shape[0]] = old
+            setattr(self, name, new)
+
+    def upsert(self, doc_id: str, data: dict) -> bool:
+        try:
+            p = int(data["phash"], 16)
+            d = int(data["dhash"], 16)
+        except (KeyError, TypeError, ValueError):
+            return False
+        doc = {k: data.get(k) for k in _STORED_FIELDS + ("source",)}
+
+        with self._lock:
+            row = self._row_of.get(doc_id)
+            if row is None:
+                row = len(self._ids)
+                if row >= self._phash.shape[0]:
+                    self._grow()
+                self._ids.append(doc_id)
+                self._docs.append(doc)
+                self._row_of[doc_id] = row
+            else:
+                self._docs[row] = doc
+            self._phash[row] = np.uint64(p)
+            self._dhash[row] = np.uint64(d)
+            self._expire_at[row] = _to_epoch(data.get("expireAt"))
+        return True
+
+    def store(self, doc_id: str, data: dict):
+        """upsert() for a verdict computed by this process."""
+        with self._lock:
+            if self.upsert(doc_id, data):
+                self.stored += 1
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            row = self._row_of.pop(doc_id, None)
+            if row is None:
+                return
+            last = len(self._ids) - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._phash[row] = self._phash[last]
+                self._dhash[row] = self._dhash[last]
+                self._expire_at[row] = self._expire_at[last]
+                self._ids[row] = moved_id
+                self._docs[row] = self._docs[last]
+                self._row_of[moved_id] = row
+            self._ids.pop()
+            self._docs.pop()
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._docs.clear()
+            self._row_of.clear()
+
+    def lookup(self, p: int, d: int) -> Optional[dict]:
+        """Closest unexpired verdict within both distance thresholds, or None."""
+        with self._lock:
+            self.lookups += 1
+            n = len(self._ids)
+            if n == 0:
+                return None
+            expire = self._expire_at[:n]
+            live = (expire == 0) | (expire >= time.time())
+            p_dist = _hamming(self._phash[:n], p)
+            d_dist = _hamming(self._dhash[:n], d)
+            candidates = np.nonzero(live & (p_dist <= self.phash_max) & (d_dist <= self.dhash_max))[0]
+            match = None
+            if candidates.size:
+                best = candidates[np.argmin(p_dist[candidates] + d_dist[candidates])]
+                self.hits += 1
+                match = {
+                    "id": self._ids[best],
+                    "doc": self._docs[best],
+                    "phash_distance": int(p_dist[best]),
+                    "dhash_distance": int(d_dist[best]),
+                }
+            # Evict expired rows seen by this scan (removal reorders rows, so after the match)
+            for doc_id in [self._ids[r] for r in np.nonzero(~live)[0]]:
+                self.remove(doc_id)
+                self.expired += 1
+            return match
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "size": len(self._ids),
+                "phash_max_distance": self.phash_max,
+                "dhash_max_distance": self.dhash_max,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "stored": self.stored,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            }
+
+
+# -----------------------------
+# FIRESTORE SYNC
+# -----------------------------
+_INDEX = PerceptualHashIndex()
+_start_lock = threading.Lock()
+_started = False
+_retry_at = 0.0
+_listener = None
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-hash-writer")
+_write_slots = threading.BoundedSemaphore(IMAGE_HASH_WRITE_BACKLOG)
+_writes_dropped = 0
+
+
+def _bootstrap():
+    global _listener, _started, _retry_at
+
+    def _stream():
+        from database import get_db
+        return [
+            (doc.id, doc.to_dict() or {})
+            for doc in get_db().collection(COLLECTION).where("expireAt", ">", listen_from).stream()
+        ]
+
+    start = time.time()
+    listen_from = datetime.utcnow()
+    try:
+        with timed_component("image_hash_index"), timed_call("firestore", op="load_image_hashes"):
+            docs = cassettes.call("firestore", "load_image_hashes", {}, _stream)
+        for doc_id, data in docs or []:
+            _INDEX.upsert(doc_id, data)
+        print(f"✅ Image hash index loaded {len(_INDEX)} entries in {time.time() - start:.2f}s")
+    except Exception as e:
+        # Still usable as a process-local index; the next lookup retries after a pause
+        print(f"⚠️ Image hash index bootstrap failed: {e}")
+        with _start_lock:
+            _retry_at = time.monotonic() + BOOTSTRAP_RETRY_SECONDS
+            _started = False
+        return
+    _INDEX.ready = True
+    if cassettes.REPLAYING:
+        return   # no live listener while replaying
+
+    def _on_snapshot(col_snapshot, changes, read_time):
+        for change in changes:
+            if change.type.name == "REMOVED":
+                _INDEX.remove(change.document.id)
+            else:
+                _INDEX.upsert(change.document.id, change.document.to_dict() or {})
+
+    from database import get_db
+    try:
+        _listener = (
+            get_db().collection(COLLECTION)
+              .where("last_updated", ">=", listen_from)
+              .on_snapshot(_on_snapshot)
+        )
+    except Exception as e:
+        print(f"⚠️ Image hash listener failed to start: {e}")
+
+
+def get_image_hash_index() -> PerceptualHashIndex:
+    """Hash index; the first call starts the bulk load + listener in the background."""
+    global _started
+    if not _started and time.monotonic() >= _retry_at:
+        with _start_lock:
+            if not _started and time.monotonic() >= _retry_at:
+                _started = True
+                threading.Thread(target=_bootstrap, name="image-hash-index", daemon=True).start()
+    return _INDEX
+
+
+def find_similar(content: bytes) -> Tuple[Optional[dict], Optional[Tuple[int, int]]]:
+    """
+    (match, hashes) for raw image bytes. `hashes` is None when the bytes
+    cannot be decoded; `match` is None on a miss.
+    """
+    try:
+        hashes = compute_hashes(content)
+    except Exception as e:
+        print(f"⚠️ Perceptual hash failed: {e}")
+        return None, None
+    try:
+        match = get_image_hash_index().lookup(*hashes)
+        cache_lookup("image_phash", match is not None)
+        return match, hashes
+    except Exception as e:
+        print(f"⚠️ Image hash lookup failed: {e}")
+        return None, hashes
+
+
+def remember(hashes: Tuple[int, int], source: str, result: dict):
+    """
+    Store a fresh verdict locally and in Firestore (off the request path).
+    The Firestore write is skipped when the writer is already backed up.
+    """
+    global _writes_dropped
+    p, d = hashes
+    doc_id = f"{p:016x}{d:016x}"
+    now = datetime.utcnow()
+    data = {k: result.get(k) for k in _STORED_FIELDS}
+    data.update({
+        "phash": f"{p:016x}",
+        "dhash": f"{d:016x}",
+        "source": source,
+        "last_updated": now,
+        "expireAt": now + timedelta(days=IMAGE_HASH_TTL_DAYS),
+    })
+    _INDEX.store(doc_id, data)
+
+    def _store():
+        from database import get_db
+        get_db().collection(COLLECTION).document(doc_id).set(data)
+
+    def _write():
+        try:
+            with timed_call("firestore", op="write_image_hash"):
+                cassettes.call("firestore", "write_image_hash", {"id": doc_id}, _store)
+        except Exception as e:
+            print(f"⚠️ Image hash store failed: {e}")
+        finally:
+            _write_slots.release()
+
+    if not _write_slots.acquire(blocking=False):
+        _writes_dropped += 1
+        count("image_hash_writes_dropped_total")
+        print("⚠️ Image hash writer backed up — Firestore write dropped")
+        return
+    _writer.submit(_write)
+
+
+def get_image_hash_stats() -> dict:
+    return {**_INDEX.get_stats(), "writes_dropped": _writes_dropped}
+
+
+register_component("image_hash_index", get_image_hash_index)
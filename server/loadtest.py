@@ -0,0 +1,563 @@
+# loadtest.py
+"""
+In-process load test of the Flask app against synthetic dependencies.
+
+    python loadtest.py --rps 4 --duration 60 --threads 8
+    python loadtest.py --threads 4,8,16 --mix detect_text=50,detect_text_initial=30,detect_image=10,submit_feedback=10
+    python loadtest.py --hit-ratio exact=0.3,semantic=0.1,pinecone=0.05 --latency-scale 0.5 --clients 5
+
+Requests arrive as a Poisson process (open loop) and are served by a pool
+of --threads threads, the way one gunicorn gthread worker serves them.
+Every outbound call is answered in-process by SyntheticBackend through the
+cassette layer: latencies are drawn from per-dependency log-normal
+distributions (LATENCY_PROFILES), payloads are shaped like the real APIs'
+and the cache tiers hit with the --hit-ratio probabilities. Local work
+(embeddings, langdetect, ensemble, JSON) runs for real, so CPU contention
+shows up as it would in production.
+
+Each run starts with cold result caches and indexes, so a sweep's runs
+see the same traffic under the same conditions.
+
+Per run: throughput, p50/p95/p99 latency per endpoint (arrival to
+response, so queueing is included), queue wait, thread saturation,
+rate-limiter rejections (429) and CPU utilisation. CPU utilisation near
+1.0 means the worker is GIL-bound: add gunicorn workers, not threads.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# Every dependency is faked: keep start-up from dialling out and satisfy
+# the import-time key checks
+os.environ.setdefault("WARMUP_ON_START", "0")
+os.environ.setdefault("GEMINI_API_KEY", "loadtest")
+os.environ.setdefault("PINECONE_API", "loadtest")
+os.environ.setdefault("APP_SECRET_KEY", "loadtest")
+
+import cassettes
+
+DEFAULT_MIX = "detect_text=50,detect_text_initial=25,detect_image=15,submit_feedback=10"
+DEFAULT_HIT_RATIO = "exact=0.2,semantic=0.1,pinecone=0.05,feedback=0.5"
+DEFAULT_OUTPUT = "loadtest_results.json"
+SAMPLE_INTERVAL = 0.1
+
+ENDPOINTS = {
+    "detect_text": "/detect_text",
+    "detect_text_initial": "/detect_text_initial",
+    "detect_image": "/detect_image",
+    "submit_feedback": "/submit_feedback",
+}
+
+# (dependency, op) -> (median, p95) seconds; op None is the dependency default
+LATENCY_PROFILES = {
+    ("gemini", None): (2.5, 6.0),
+    ("gemini", "summarize_claim"): (0.8, 2.0),
+    ("gemini", "initial_assessment"): (1.5, 4.0),
+    ("vision", None): (0.8, 2.0),
+    ("translate", None): (0.12, 0.35),
+    ("custom_search", None): (0.45, 1.2),
+    ("firestore", None): (0.025, 0.08),
+    ("firestore", "write_articles"): (0.06, 0.2),
+    ("firestore", "domain_transaction"): (0.08, 0.25),
+    ("article_index", None): (0.001, 0.004),
+    ("pinecone", None): (0.06, 0.18),
+    ("http", "factchecktools.googleapis.com"): (0.3, 0.9),
+    ("http", "aiplatform"): (0.35, 1.0),
+    ("http", None): (0.25, 1.0),         # image downloads
+}
+_FALLBACK_PROFILE = (0.05, 0.2)
+_Z95 = 1.645
+
+
+# -----------------------------
+# SYNTHETIC DEPENDENCIES
+# -----------------------------
+def _entry(latency: float, response=None) -> dict:
+    return {"latency": latency, "response": response}
+
+
+def _http_response(body, status: int = 200, content_type: str = "application/json") -> dict:
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8")
+    return {
+        "status": status,
+        "headers": {"Content-Type": content_type, "Content-Length": str(len(body))},
+        "url": "",
+        "body": body,
+    }
+
+
+def _sample_jpeg() -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 480), (90, 120, 150)).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+class SyntheticBackend:
+    """Cassette responder that fakes every outbound dependency."""
+
+    def __init__(self, hit_ratios: Dict[str, float], latency_scale: float = 1.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.hit_ratios = hit_ratios
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._image = _sample_jpeg()
+        self.calls = Counter()
+
+    def _profile(self, dependency: str, op) -> tuple:
+        if dependency == "http" and op and op.endswith("aiplatform.googleapis.com"):
+            op = "aiplatform"
+        return (
+            LATENCY_PROFILES.get((dependency, op))
+            or LATENCY_PROFILES.get((dependency, None))
+            or _FALLBACK_PROFILE
+        )
+
+    def _latency(self, dependency: str, op) -> float:
+        median, p95 = self._profile(dependency, op)
+        sigma = math.log(p95 / median) / _Z95
+        with self._lock:
+            return self._rng.lognormvariate(math.log(median), sigma) * self.latency_scale
+
+    def _chance(self, p: float) -> bool:
+        with self._lock:
+            return self._rng.random() < p
+
+    def hit(self, tier: str) -> bool:
+        return self._chance(self.hit_ratios.get(tier, 0.0))
+
+    def respond(self, dependency: str, op, request) -> dict:
+        with self._lock:
+            self.calls[f"{dependency}:{op}"] += 1
+        latency = self._latency(dependency, op)
+        if self.error_rate and self._chance(self.error_rate):
+            return {"latency": latency, "error": {"type": "SyntheticError", "message": f"{dependency} unavailable"}}
+        handler = getattr(self, f"_{dependency}", None)
+        return _entry(latency, handler(op, request) if handler else None)
+
+    # ---- Google APIs -------------------------------------------------
+    def _gemini(self, op, request) -> dict:
+        if op == "metadata":
+            reply = {"title": "Synthetic article", "author": "Staff", "source": "example.com", "category": "Politics"}
+        elif op == "summarize_claim":
+            reply = {"query": "government hospitals announcement election"}
+        elif op == "corroboration":
+            links = re.findall(r'"link": "([^"]+)"', request.get("prompt", ""))
+            reply = {"evaluated": [
+                {"title": f"Article {i}", "link": link, "relevance": "contradicts" if i % 3 else "supports",
+                 "confidence": 70 + i}
+                for i, link in enumerate(links)
+            ]}
+        elif op == "claim_check":
+            reply = {"prediction": "Fake", "confidence": 80, "explanation": "Contradicted by multiple outlets."}
+        elif op == "initial_assessment":
+            return {"text": "The text makes a specific numeric claim without citing a source."}
+        elif op == "image_detection":
+            reply = {"ai_probability": 0.35, "verdict": "Uncertain", "explanation": "Natural lighting, no artefacts."}
+        else:
+            reply = {}
+        return {"text": json.dumps(reply)}
+
+    def _http(self, host, request) -> dict:
+        if host == "factchecktools.googleapis.com":
+            if not self._chance(0.5):
+                return _http_response({})
+            return _http_response({"claims": [{
+                "text": request["params"]["query"][:150],
+                "claimReview": [{
+                    "publisher": {"name": "FactCheck.org"},
+                    "textualRating": "False",
+                    "title": "Fact check",
+                    "url": "https://factcheck.example.com/review",
+                }],
+            }]})
+        if host and host.endswith("aiplatform.googleapis.com"):
+            # Carries both the text (classes/scores) and image (displayNames/confidences) shapes
+            return _http_response({"predictions": [{
+                "classes": ["Real", "Fake", "Misleading"],
+                "scores": [0.25, 0.65, 0.10],
+                "displayNames": ["real", "ai_generated"],
+                "confidences": [0.8, 0.2],
+            }]})
+        # Image download; conditional requests revalidate
+        headers = request.get("headers") or {}
+        if "If-None-Match" in headers:
+            return _http_response(b"", status=304, content_type="image/jpeg")
+        resp = _http_response(self._image, content_type="image/jpeg")
+        resp["headers"]["ETag"] = '"synthetic"'
+        return resp
+
+    def _custom_search(self, op, request) -> dict:
+        query = request["params"]["q"]
+        return {"status": 200, "data": {"items": [
+            {
+                "title": f"Report {i} on {query[:40]}",
+                "link": f"https://news{i}.example.com/story/{zlib.crc32(query.encode()) % 10_000}",
+                "snippet": f"Outlet {i} reports that officials disputed the figures behind: {query[:80]}",
+            }
+            for i in range(8)
+        ]}}
+
+    def _vision(self, op, request) -> str:
+        response = {
+            "labelAnnotations": [{"description": "Photograph", "score": 0.93}, {"description": "Sky", "score": 0.81}],
+            "webDetection": {
+                "webEntities": [{"description": "News", "score": 0.6}],
+                "visuallySimilarImages": [{"url": "https://img.example.com/similar.jpg"}],
+            },
+        }
+        return json.dumps({"responses": [response for _ in request["images"]]})
+
+    def _translate(self, op, request) -> str:
+        if op == "detect_language":
+            return json.dumps({"languages": [{"languageCode": "es", "confidence": 0.98}]})
+        return json.dumps({"translations": [{"translatedText": text} for text in request["contents"]]})
+
+    # ---- Firestore / Pinecone ----------------------------------------
+    def _firestore(self, op, request):
+        if op == "get_article":
+            if self.hit("exact"):
+                return {"text_score": 0.2, "prediction": "Fake", "text_explanation": "Previously analysed."}
+            return None
+        if op == "load_news_sources":
+            return [["bbc.com", {"avg_score": 0.95, "num_votes": 150}], ["reuters.com", {"avg_score": 0.96, "num_votes": 200}]]
+        if op == "domain_transaction":
+            return {domain: [0.8, 2] for domain in request["domains"]}
+        if op == "record_feedback":
+            return 25.0 if self.hit("feedback") else None
+        if op in ("semantic_scan", "load_image_hashes"):
+            return []
+        return None   # writes
+
+    def _article_index(self, op, request):
+        if not self.hit("semantic"):
+            return []
+        return [{
+            "id": "synthetic-semantic",
+            "doc": {"text_score": 0.3, "prediction": "Fake", "text_explanation": "Near-duplicate article."},
+            "similarity": 0.95,
+        }]
+
+    def _pinecone(self, op, request):
+        if op == "fetch":
+            return {"vectors": {}}
+        if op == "query":
+            if not self.hit("pinecone"):
+                return {"matches": []}
+            return {"matches": [{
+                "id": "synthetic-feedback",
+                "score": 0.9,
+                "metadata": {"score": 0.2, "explanation": "Community verified.", "prediction": "Fake",
+                             "text": request["text"], "article_id": None},
+            }]}
+        return None
+
+
+# -----------------------------
+# TRAFFIC
+# -----------------------------
+_CLAIMS = (
+    "Officials announced that {n} new hospitals will open in the capital before the election next spring.",
+    "A viral post claims the central bank printed {n} billion in new notes overnight to cover the deficit.",
+    "Health ministry data shows vaccination rates fell by {n} percent in rural districts this year.",
+    "Scientists reported that the river flooded {n} villages after the dam gates were opened without warning.",
+)
+
+
+class TrafficGenerator:
+    def __init__(self, mix: Dict[str, float], repeat_ratio: float, clients: int, seed: int):
+        self.endpoints = list(mix)
+        self.weights = [mix[e] for e in self.endpoints]
+        self.repeat_ratio = repeat_ratio
+        self.clients = clients
+        self._rng = random.Random(seed)
+        self._counter = itertools.count()
+        self._texts: List[str] = []
+        self._urls: List[str] = []
+
+    def _text(self) -> str:
+        if self._texts and self._rng.random() < self.repeat_ratio:
+            return self._rng.choice(self._texts)
+        n = next(self._counter)
+        text = _CLAIMS[n % len(_CLAIMS)].format(n=n) + f" Report #{n} cites {n * 7 % 97} anonymous sources."
+        self._texts.append(text)
+        return text
+
+    def _image_url(self) -> str:
+        if self._urls and self._rng.random() < self.repeat_ratio:
+            return self._rng.choice(self._urls)
+        url = f"https://img{next(self._counter) % 20}.example.com/{len(self._urls)}.jpg"
+        self._urls.append(url)
+        return url
+
+    def next(self):
+        endpoint = self._rng.choices(self.endpoints, self.weights)[0]
+        return (endpoint, *self.request_for(endpoint))
+
+    def request_for(self, endpoint: str):
+        client = f"loadtest-{self._rng.randrange(self.clients)}"
+        headers = {"user-fingerprint": client}
+        if endpoint == "detect_image":
+            payload = {"urls": [self._image_url()]}
+        elif endpoint == "submit_feedback":
+            payload = {"text": self._text(), "url": "https://example.com/story",
+                       "response": self._rng.choice(["yes", "no"]), "explanation": "Load test feedback"}
+        elif endpoint == "detect_text":
+            payload = {"text": self._text(), "url": "https://example.com/story", "session_id": client}
+        else:
+            payload = {"text": self._text()}
+        return payload, headers
+
+
+# -----------------------------
+# RUNNER
+# -----------------------------
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _latency_summary(seconds: List[float]) -> dict:
+    return {
+        "count": len(seconds),
+        "p50_ms": round(_pct(seconds, 0.50) * 1000.0, 1),
+        "p95_ms": round(_pct(seconds, 0.95) * 1000.0, 1),
+        "p99_ms": round(_pct(seconds, 0.99) * 1000.0, 1),
+        "max_ms": round(max(seconds, default=0.0) * 1000.0, 1),
+    }
+
+
+class LoadRun:
+    def __init__(self, app, traffic: TrafficGenerator, threads: int, rps: float, duration: float, seed: int):
+        self.app = app
+        self.traffic = traffic
+        self.threads = threads
+        self.rps = rps
+        self.duration = duration
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._queued = 0
+        self._samples = []          # (busy, queued)
+        self._records = []          # (endpoint, status, arrival, started, finished)
+
+    def _request(self, endpoint: str, payload: dict, headers: dict, arrival: float):
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+        try:
+            client = self.app.test_client(use_cookies=False)
+            resp = client.post(ENDPOINTS[endpoint], json=payload, headers=headers)
+            resp.get_data()
+            status = resp.status_code
+        except Exception:
+            status = 599
+        finally:
+            with self._lock:
+                self._busy -= 1
+        with self._lock:
+            self._records.append((endpoint, status, arrival, started, time.perf_counter()))
+
+    def warm_up(self):
+        """One unmeasured request per endpoint: loads models and lazy singletons."""
+        for endpoint in self.traffic.endpoints:
+            payload, headers = self.traffic.request_for(endpoint)
+            self.app.test_client(use_cookies=False).post(ENDPOINTS[endpoint], json=payload, headers=headers).get_data()
+
+    def _sample(self, stop: threading.Event):
+        while not stop.wait(SAMPLE_INTERVAL):
+            with self._lock:
+                self._samples.append((self._busy, self._queued))
+
+    def execute(self) -> dict:
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(stop,), name="loadtest-sampler", daemon=True)
+        pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="loadtest-worker")
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        sampler.start()
+
+        next_at = start
+        while True:
+            next_at += self._rng.expovariate(self.rps)
+            if next_at - start > self.duration:
+                break
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint, payload, headers = self.traffic.next()
+            with self._lock:
+                self._queued += 1
+            pool.submit(self._request, endpoint, payload, headers, time.perf_counter())
+
+        pool.shutdown(wait=True)
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        stop.set()
+        sampler.join()
+        return self._report(wall, cpu)
+
+    def _report(self, wall: float, cpu: float) -> dict:
+        by_endpoint = defaultdict(list)
+        statuses = defaultdict(Counter)
+        waits, all_latency = [], []
+        for endpoint, status, arrival, started, finished in self._records:
+            statuses[endpoint][status] += 1
+            waits.append(started - arrival)
+            if status != 429:
+                by_endpoint[endpoint].append(finished - arrival)
+                all_latency.append(finished - arrival)
+
+        total = len(self._records)
+        rejected = sum(s[429] for s in statuses.values())
+        ok = sum(n for s in statuses.values() for code, n in s.items() if 200 <= code < 300)
+        errors = sum(n for s in statuses.values() for code, n in s.items() if code >= 500)
+        busy = [b for b, _ in self._samples]
+        queued = [q for _, q in self._samples]
+
+        return {
+            "threads": self.threads,
+            "offered_rps": self.rps,
+            "duration_s": round(wall, 2),
+            "requests": total,
+            "throughput_rps": round(total / wall, 2) if wall else 0.0,
+            "goodput_rps": round(ok / wall, 2) if wall else 0.0,
+            "rate_limited": rejected,
+            "server_errors": errors,
+            "latency": _latency_summary(all_latency),
+            "queue_wait": _latency_summary(waits),
+            "endpoints": {
+                endpoint: {**_latency_summary(by_endpoint[endpoint]),
+                           "status": {str(code): n for code, n in sorted(statuses[endpoint].items())}}
+                for endpoint in sorted(statuses)
+            },
+            "saturation": {
+                "mean_busy_threads": round(sum(busy) / len(busy), 2) if busy else 0.0,
+                "utilisation": round(sum(busy) / (len(busy) * self.threads), 3) if busy else 0.0,
+                "saturated_fraction": round(sum(b >= self.threads for b in busy) / len(busy), 3) if busy else 0.0,
+                "max_queue_depth": max(queued, default=0),
+                "mean_queue_depth": round(sum(queued) / len(queued), 2) if queued else 0.0,
+            },
+            "cpu_utilisation": round(cpu / wall, 3) if wall else 0.0,
+        }
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def _parse_weights(spec: str) -> Dict[str, float]:
+    out = {}
+    for part in spec.split(","):
+        if part.strip():
+            name, _, value = part.partition("=")
+            out[name.strip()] = float(value)
+    return out
+
+
+def _print_run(result: dict):
+    sat = result["saturation"]
+    print(f"\n🔹 threads={result['threads']} offered={result['offered_rps']} rps "
+          f"-> {result['throughput_rps']} rps ({result['goodput_rps']} ok), "
+          f"429={result['rate_limited']}, 5xx={result['server_errors']}")
+    print(f"   latency p50/p95/p99 {result['latency']['p50_ms']}/{result['latency']['p95_ms']}/"
+          f"{result['latency']['p99_ms']} ms | queue wait p95 {result['queue_wait']['p95_ms']} ms")
+    print(f"   threads busy {sat['mean_busy_threads']} avg ({sat['utilisation']:.0%}), saturated "
+          f"{sat['saturated_fraction']:.0%} of the time, max queue {sat['max_queue_depth']} | "
+          f"cpu {result['cpu_utilisation']:.2f} cores")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"   {endpoint:<22} n={stats['count']:<5} p50 {stats['p50_ms']:>9} p95 {stats['p95_ms']:>9} "
+              f"p99 {stats['p99_ms']:>9} ms  status {stats['status']}")
+
+
+def _reset_state():
+    """Start every run cold: drain pending writes, then drop what earlier runs (and warm-up) cached."""
+    from article_index import get_article_index
+    from image_hash import get_image_hash_index
+    from persistence_queue import PERSIST_QUEUE
+    from result_cache import IMAGE_URL_CACHE, VERDICT_CACHE
+
+    PERSIST_QUEUE.flush()
+    VERDICT_CACHE.clear()
+    IMAGE_URL_CACHE.clear()
+    get_image_hash_index().clear()
+    get_article_index().clear()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", default="8", help="request threads per run; comma list for a sweep")
+    parser.add_argument("--rps", type=float, default=2.0, help="offered load (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of arrivals per run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights")
+    parser.add_argument("--hit-ratio", default=DEFAULT_HIT_RATIO,
+                        help="hit probability per tier: exact, semantic, pinecone, feedback")
+    parser.add_argument("--repeat-ratio", type=float, default=0.1,
+                        help="share of requests reusing an earlier text / image URL")
+    parser.add_argument("--clients", type=int, default=50, help="distinct rate-limit identities")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier on dependency latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of dependency calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own logging")
+    args = parser.parse_args(argv)
+
+    mix = _parse_weights(args.mix)
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+    backend = SyntheticBackend(_parse_weights(args.hit_ratio), args.latency_scale, args.error_rate, args.seed)
+    cassettes.use_responder(backend.respond)
+
+    import metrics
+    from app import app, limiter
+
+    log_sink = open(os.devnull, "w") if not args.verbose else sys.stdout
+    results = []
+    for threads in (int(t) for t in args.threads.split(",") if t.strip()):
+        run = LoadRun(
+            app, TrafficGenerator(mix, args.repeat_ratio, args.clients, args.seed),
+            threads, args.rps, args.duration, args.seed,
+        )
+        with contextlib.redirect_stdout(log_sink):
+            run.warm_up()
+            _reset_state()
+            limiter.reset()
+            metrics.reset()
+            result = run.execute()
+        result["dependency_latency"] = metrics.snapshot().get("dependency_latency_seconds", [])
+        results.append(result)
+        _print_run(result)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "verbose")},
+            "dependency_calls": dict(backend.calls),
+            "runs": results,
+        }, f, indent=2)
+    print(f"\n✅ Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
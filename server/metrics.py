@@ -0,0 +1,199 @@
+# metrics.py
+"""
+Process-local latency histograms and counters, served at /metrics.
+
+Three families cover the request path:
+  stage_latency_seconds{stage}                 pipeline phases
+  dependency_latency_seconds{dependency, op}   every external / local model call
+  cache_lookups_total{tier, result}            hit / miss per cache tier
+
+    with timed_call("gemini", op="metadata") as call:
+        resp = ...
+        if not resp.ok:
+            call.fail()      # for code paths that swallow their exceptions
+
+Exceptions escaping the block are counted as errors automatically. Each
+timed block is also recorded as a span of the active request trace.
+Rendered in Prometheus text format; `?format=json` adds p50/p95/p99
+estimated from the buckets.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from tracing import span
+
+# Seconds; external calls here range from ~5ms (Firestore) to ~30s (Gemini)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+_HELP = {
+    "stage_latency_seconds": "Latency of detect_fake_text / detect_fake_image phases",
+    "dependency_latency_seconds": "Latency of calls to external services and local models",
+    "cache_lookups_total": "Cache lookups by tier and result",
+    "persist_dropped_total": "Analysis results dropped because the persistence queue was full",
+    "image_hash_writes_dropped_total": "pHash verdict writes dropped because the writer was backed up",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "errors", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+                return lower + (upper - lower) * ((rank - seen) / n)
+            seen += n
+        return self.max
+
+
+_lock = threading.Lock()
+_histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+_counters: Dict[str, Dict[LabelKey, int]] = {}
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def observe(metric: str, seconds: float, error: bool = False, **labels):
+    key = _key(labels)
+    with _lock:
+        series = _histograms.setdefault(metric, {})
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram()
+        hist.observe(seconds, error)
+
+
+def count(metric: str, value: int = 1, **labels):
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(metric, {})
+        series[key] = series.get(key, 0) + value
+
+
+class _Timer:
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+@contextmanager
+def timed(metric: str, **labels):
+    timer = _Timer()
+    start = time.perf_counter()
+    try:
+        with span(":".join(v for _, v in _key(labels))):
+            yield timer
+    except BaseException:
+        timer.failed = True
+        raise
+    finally:
+        observe(metric, time.perf_counter() - start, timer.failed, **labels)
+
+
+def timed_stage(stage: str):
+    return timed("stage_latency_seconds", stage=stage)
+
+
+def timed_call(dependency: str, op: str = None):
+    return timed("dependency_latency_seconds", dependency=dependency, op=op)
+
+
+def cache_lookup(tier: str, hit: bool):
+    count("cache_lookups_total", tier=tier, result="hit" if hit else "miss")
+
+
+# -----------------------------
+# EXPORT
+# -----------------------------
+def _fmt_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        for metric, series in sorted(_histograms.items()):
+            lines.append(f"# HELP {metric} {_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+            for key, hist in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + (float("inf"),), hist.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{metric}_bucket{_fmt_labels(key, (('le', le),))} {cumulative}")
+                lines.append(f"{metric}_sum{_fmt_labels(key)} {hist.sum:.6f}")
+                lines.append(f"{metric}_count{_fmt_labels(key)} {hist.count}")
+            errors = metric.replace("_seconds", "_errors_total")
+            lines.append(f"# TYPE {errors} counter")
+            for key, hist in sorted(series.items()):
+                lines.append(f"{errors}{_fmt_labels(key)} {hist.errors}")
+        for metric, series in sorted(_counters.items()):
+            lines.append(f"# HELP {metric} {_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{metric}{_fmt_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    out = {}
+    with _lock:
+        for metric, series in _histograms.items():
+            out[metric] = [
+                {
+                    "labels": dict(key),
+                    "count": hist.count,
+                    "errors": hist.errors,
+                    "avg_ms": round(hist.sum * 1000.0 / hist.count, 2) if hist.count else 0.0,
+                    "p50_ms": round(hist.quantile(0.50) * 1000.0, 2),
+                    "p95_ms": round(hist.quantile(0.95) * 1000.0, 2),
+                    "p99_ms": round(hist.quantile(0.99) * 1000.0, 2),
+                    "max_ms": round(hist.max * 1000.0, 2),
+                }
+                for key, hist in sorted(series.items())
+            ]
+        for metric, series in _counters.items():
+            out[metric] = [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+    return out
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -1,17 +1,10 @@
 import os
 from dotenv import load_dotenv
-import google.auth
-from google.cloud import firestore
+from database import get_db
 from embedding_service import get_embedding  
 
 load_dotenv()
 
-# -----------------------------
-# FIRESTORE CONFIG
-# -----------------------------
-credentials, project_id = google.auth.default()
-db = firestore.Client(project=project_id)  
-
 # -----------------------------
 # GENERATE EMBEDDING (uses shared model)
 # -----------------------------
@@ -25,6 +18,7 @@ def generate_embedding(text: str) -> list:
 # -----------------------------
 def migrate_embeddings():
     """Add missing embeddings & verified flag to Firestore documents."""
+    db = get_db()
     docs = db.collection("articles").stream()
     batch = db.batch()
     updated_count = 0
@@ -4,26 +4,28 @@ import html
 import time
 import json
 import requests
+import http_client
+import auth_tokens
+import cassettes
+from domain_scores import get_domain_table, normalize_domain
+from domain_score_writer import DOMAIN_AGGREGATOR
+from persistence_queue import PERSIST_QUEUE
 from functools import lru_cache
 from typing import List, Dict, Any
 from urllib.parse import urlparse
 from dotenv import load_dotenv
-from sentence_transformers import util
 import google.generativeai as genai
-from google.auth.transport.requests import Request
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import hashlib
-import google.auth
 
-from database import db
 from vectorDb import (
     embed_text,
-    store_feedback,
     pc, INDEX_NAME
 )
-from datetime import datetime, timedelta
-import aiohttp
+from datetime import datetime
 import asyncio
+from startup import register_component, timed_component
+from async_runtime import http_session, run_coroutine
+from metrics import timed_call, timed_stage
 
 # ----------------- Gemini config ----------------
 load_dotenv()
@@ -37,10 +39,23 @@ GEM_MODEL = None
 def get_gemini_model():
     global GEM_MODEL
     if GEM_MODEL is None:
-        genai.configure(api_key=GEMINI_API_KEY)
-        GEM_MODEL = genai.GenerativeModel("gemini-2.5-flash")
+        with timed_component("gemini"):
+            genai.configure(api_key=GEMINI_API_KEY)
+            GEM_MODEL = genai.GenerativeModel("gemini-2.5-flash")
     return GEM_MODEL
 
+register_component("gemini", get_gemini_model)
+
+
+def generate_content(prompt: str, prompt_type: str):
+    """Gemini call through the cassette layer (record/replay)."""
+    return cassettes.call(
+        "gemini", prompt_type, {"prompt": prompt},
+        lambda: get_gemini_model().generate_content(prompt),
+        encode=cassettes.encode_gemini,
+        decode=cassettes.decode_gemini,
+    )
+
 # ---------------- Vertex AI config ----------------
 PROJECT_ID = os.getenv("PROJECT_ID")
 ENDPOINT_ID = os.getenv("TEXT_ENDPOINT_ID")
@@ -53,15 +68,13 @@ CX_ID = os.getenv("GOOGLE_SEARCH_CX")
 FACT_CHECK_API_KEY = os.getenv("GEMINI_API_KEY") 
 
 def get_access_token():
-
-    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    creds.refresh(Request())
-    return creds.token
+    """Cached token from the shared provider (refreshed in the background)."""
+    return auth_tokens.get_access_token()
 
 
 # ---------------- Embeddings ----------------
 
-from embedding_service import get_embedding
+from embedding_service import get_embeddings, cosine_similarity
 
 # ---------------- Constants ----------------
 CLAIM_MIN_LEN = 30
@@ -93,91 +106,62 @@ def domain_from_url(url: str) -> str:
     return m.group(2).lower() if m else ""
 
 def get_trusted_score(domain: str) -> float:
-    """Return avg_score of domain or 0 if not found"""
-    domain = domain.lower().strip()
-    doc = db.collection("news_sources").document(domain).get()
-    if doc.exists:
-        return doc.to_dict().get("avg_score", 0.0)
-    return 0.0
+    """Return avg_score of domain or 0 if not found (local domain table, no network)"""
+    return get_domain_table().score(domain)
 
 def domain_score_for_url(url: str) -> float:
     """
     Return the score for a domain.
-    Pulls from Firestore dynamically.
+    Served from the in-memory news_sources mirror.
     """
     d = domain_from_url(url)
     score = get_trusted_score(d)
     return score
 
-_CACHE_TTL = 300 
-_last_cache_time = 0
-_cached_domains = []
-
 def invalidate_domain_cache():
-    """Force cache invalidation (e.g. after updates)."""
-    global _last_cache_time
-    _last_cache_time = 0
-
-def load_credible_domains_cached() -> List[str]:
-    """Loads credible domains from Firestore with 5-min TTL cache."""
-    global _cached_domains, _last_cache_time
-    now = time.time()
-    if not _cached_domains or (now - _last_cache_time) > _CACHE_TTL:
-        _cached_domains = load_credible_domains()
-        _last_cache_time = now
-    return _cached_domains
+    """Force a reload of the domain table (normally kept current by its listener / TTL thread)."""
+    get_domain_table().refresh()
+
+def load_credible_domains_cached() -> set:
+    """Set of credible (normalised) domains from the local domain table."""
+    return get_domain_table().credible_domains()
 
 def add_or_update_trusted_sources_batch(domain_scores: Dict[str, float]):
     """
-    Batch update Firestore for multiple domains at once.
+    Queue score observations for multiple domains.
     domain_scores: {domain: new_score, ...}
+    Merged per domain and written to Firestore in the background
+    (see domain_score_writer); this call never blocks on the network.
     """
-    batch = db.batch()
-    for domain, new_score in domain_scores.items():
-        domain = domain.lower().strip()
-        doc_ref = db.collection("news_sources").document(domain)
-        doc = doc_ref.get()
-        if doc.exists:
-            data = doc.to_dict()
-            current_avg = data.get("avg_score", 0.0)
-            num_votes = data.get("num_votes", 0)
-            updated_avg = round((current_avg * num_votes + new_score) / (num_votes + 1), 3)
-            batch.update(doc_ref, {
-                "avg_score": updated_avg,
-                "num_votes": num_votes + 1,
-                "last_updated": datetime.utcnow()
-            })
-        else:
-            batch.set(doc_ref, {
-                "avg_score": round(new_score, 3),
-                "num_votes": 1,
-                "last_updated": datetime.utcnow()
-            })
-    batch.commit()
-    invalidate_domain_cache()
+    DOMAIN_AGGREGATOR.observe_many(domain_scores)
 
 # ---------------- Gemini helper ----------------
+def parse_gemini_json(text: str) -> Dict[str, Any]:
+    """JSON body of a Gemini reply: whole text first, then the outermost {...} span."""
+    try:
+        parsed = json.loads(text)
+        return {"parsed": parsed, "raw_text": text}
+    except Exception:
+        match = re.search(r"\{[\s\S]*\}", text)
+        if match:
+            try:
+                parsed = json.loads(match.group(0))
+                return {"parsed": parsed, "raw_text": text}
+            except Exception:
+                pass
+        return {"parsed": {}, "raw_text": text}
+
 @retry
-def ask_gemini_structured(prompt: str) -> Dict[str, Any]:
+def ask_gemini_structured(prompt: str, prompt_type: str = "generic") -> Dict[str, Any]:
     try:
-        resp = get_gemini_model().generate_content(prompt)
+        with timed_call("gemini", op=prompt_type):
+            resp = generate_content(prompt, prompt_type)
         text = ""
         try:
             text = resp.candidates[0].content.parts[0].text.strip()
         except Exception:
             text = getattr(resp, "text", "").strip() or str(resp)
-        try:
-            parsed = json.loads(text)
-            return {"parsed": parsed, "raw_text": text}
-        except Exception:
-            match = re.search(r"\{[\s\S]*\}", text)
-            if match:
-                try:
-                    parsed = json.loads(match.group(0))
-                    return {"parsed": parsed, "raw_text": text}
-                except Exception:
-                    pass
-            return {"parsed": {}, "raw_text": text}
+        return parse_gemini_json(text)
 
     except Exception as e:
         return {"error": str(e), "parsed": {}}
@@ -187,8 +171,6 @@ def query_google_fact_check_api(text: str, max_results: int = 5) -> dict:
     Queries Google's Fact Check Tools API for claims related to the input text.
     Returns structured results with summary counts (same format as before).
     """
-    import requests, re
-
     def empty_result(status="no_fact_checks", error=None):
         res = {
             "status": status,
@@ -205,16 +187,19 @@ def query_google_fact_check_api(text: str, max_results: int = 5) -> dict:
         refined = max(sentences, key=len, default=text[:100]).strip()[:400]
 
         # --- API call ---
-        resp = requests.get(
-            "https://factchecktools.googleapis.com/v1alpha1/claims:search",
-            params={
-                "key": FACT_CHECK_API_KEY,
-                "query": refined,
-                "pageSize": max_results,
-                "languageCode": "en",
-            },
-            timeout=6,
-        )
+        with timed_call("fact_check") as call:
+            resp = http_client.get(
+                "https://factchecktools.googleapis.com/v1alpha1/claims:search",
+                params={
+                    "key": FACT_CHECK_API_KEY,
+                    "query": refined,
+                    "pageSize": max_results,
+                    "languageCode": "en",
+                },
+                timeout=6,
+            )
+            if resp.status_code != 200:
+                call.fail()
 
         if resp.status_code != 200:
             return empty_result("api_error")
@@ -287,7 +272,7 @@ def query_google_fact_check_api(text: str, max_results: int = 5) -> dict:
 def extract_metadata_with_gemini(text: str) -> dict:
     try:
         prompt = f""" Extract structured information from the following news article text. Return only valid JSON with keys: title, text, author, date, source, category. Rules: - Infer 'title' and 'category' from the text. - If 'author' or 'source' is not present, use "Unknown". - If 'date' is missing, use today's date in YYYY-MM-DD. Text: {text} """
-        gem_resp = ask_gemini_structured(prompt)
+        gem_resp = ask_gemini_structured(prompt, prompt_type="metadata")
         parsed = gem_resp.get("parsed", {})
         return {
             "title": parsed.get("title") or "Inferred",
@@ -316,12 +301,15 @@ def predict_with_vertex_ai(metadata: dict) -> dict:
             "Content-Type": "application/json"
         }
 
-        response = requests.post(
-            PREDICT_URL,
-            headers=headers,
-            json={"instances": [metadata]},
-            timeout=15
-        )
+        with timed_call("vertex_text") as call:
+            response = http_client.post(
+                PREDICT_URL,
+                headers=headers,
+                json={"instances": [metadata]},
+                timeout=15
+            )
+            if response.status_code != 200:
+                call.fail()
 
         if response.status_code != 200:
             print(f"[Vertex AI] ⚠️ Endpoint returned {response.status_code}: {response.text[:200]}")
@@ -493,32 +481,23 @@ def adjusted_ensemble(
 
 def load_credible_domains() -> List[str]:
     """
-    Return the list of currently trusted domains from Firestore.
+    Return the list of currently trusted domains.
     Only include domains with at least 1 vote.
     """
-    docs = db.collection("news_sources").where("num_votes", ">=", 1).stream()
-    domains = [doc.id for doc in docs]
-    if not domains:
-        domains = ["reuters.com", "bbc.com", "apnews.com", "cnn.com", "nytimes.com",
-                   "theguardian.com", "npr.org", "aljazeera.com", "bloomberg.com"]
-    return domains
+    return sorted(get_domain_table().credible_domains())
 
 def get_domain_bonus(domain: str) -> float:
     """
     Return a very small bonus (2%) if the domain is highly credible (avg_score >= 0.9)
     and has more than 100 votes. Returns 0 otherwise.
     """
-    domain = domain.lower().strip().rstrip("/") 
+    domain = normalize_domain(domain)
     if not domain or domain in ["unknown", ""]:
         return 0.0
     try:
-        doc_ref = db.collection("news_sources").document(domain)
-        doc = doc_ref.get()
-        if doc.exists:
-            data = doc.to_dict()
-            avg_score = data.get("avg_score", 0.0)
-            num_votes = data.get("num_votes", 0)
-            if avg_score >= 0.9 and num_votes > 100:
+        record = get_domain_table().get(domain)
+        if record:
+            if record["avg_score"] >= 0.9 and record["num_votes"] > 100:
                 return 0.02 
         return 0.0
     except Exception as e:
@@ -536,13 +515,19 @@ async def fetch_google(session, query, num_results=None):
             "num": limit
         }
 
-        async with session.get(
-            "https://www.googleapis.com/customsearch/v1",
-            params=params,
-            timeout=10
-        ) as resp:
-            data = await resp.json()
-            return data.get("items", [])[:limit]
+        async def _search():
+            async with session.get(
+                "https://www.googleapis.com/customsearch/v1",
+                params=params,
+                timeout=10
+            ) as resp:
+                return {"status": resp.status, "data": await resp.json()}
+
+        with timed_call("custom_search") as call:
+            result = await cassettes.acall("custom_search", None, {"params": params}, _search)
+            if result["status"] != 200:
+                call.fail()
+        return result["data"].get("items", [])[:limit]
     except Exception as e:
         print(f"❌ Google fetch failed: {e}")
         return []
@@ -556,7 +541,7 @@ Return ONLY the query text, no JSON, no quotes, no explanation.
 
 Text: {claim}
 """
-        resp = await asyncio.to_thread(ask_gemini_structured, prompt)
+        resp = await asyncio.to_thread(ask_gemini_structured, prompt, "summarize_claim")
         
         if "error" in resp:
             print(f"⚠️ Summarization error: {resp['error']}")
@@ -595,7 +580,7 @@ async def corroborate_all_with_google_async(claims: List[str]) -> Dict[str, Any]
     CREDIBLE_DOMAINS = load_credible_domains_cached()
     domain_updates: Dict[str, float] = {}
 
-    async with aiohttp.ClientSession() as session:
+    async with http_session() as session:
         tasks = []
 
         for claim in claims:
@@ -614,10 +599,12 @@ async def corroborate_all_with_google_async(claims: List[str]) -> Dict[str, Any]
 
     emb_cache = {}
 
-    def get_emb(text):
-        if text not in emb_cache:
-            emb_cache[text] = get_embedding(text)
-        return emb_cache[text]
+    async def embed_missing(texts):
+        """One batched encode, off the shared loop, for texts not embedded yet."""
+        missing = list(dict.fromkeys(t for t in texts if t not in emb_cache))
+        if missing:
+            for t, emb in zip(missing, await asyncio.to_thread(get_embeddings, missing)):
+                emb_cache[t] = emb
 
     for claim, items in zip(claims, results_list):
         if not items:
@@ -659,11 +646,18 @@ Return STRICT JSON ONLY:
 }}
 """
 
-        gem_resp = await asyncio.to_thread(ask_gemini_structured, gem_prompt)
+        gem_resp = await asyncio.to_thread(ask_gemini_structured, gem_prompt, "corroboration")
         evaluated = gem_resp.get("parsed", {}).get("evaluated", []) if isinstance(gem_resp, dict) else []
 
         claim_evidences = []
 
+        relevant = [r for r in evaluated if r.get("relevance") in ["supports", "contradicts"]]
+        snippets = {}
+        for a in articles:
+            snippets.setdefault(a["link"], a["snippet"])
+        if relevant:
+            await embed_missing([claim] + [snippets.get(r.get("link", ""), "") for r in relevant])
+
         for result in evaluated:
             relevance = result.get("relevance")
             if relevance not in ["supports", "contradicts"]:
@@ -671,12 +665,12 @@ Return STRICT JSON ONLY:
 
             link = result.get("link", "")
             domain = urlparse(link).netloc.lower()
-            snippet = next((a["snippet"] for a in articles if a["link"] == link), "")
+            snippet = snippets.get(link, "")
 
             # Compute similarity with embedding
-            claim_emb = get_emb(claim)
-            snippet_emb = get_emb(snippet)
-            similarity = float(util.cos_sim(claim_emb, snippet_emb))
+            claim_emb = emb_cache[claim]
+            snippet_emb = emb_cache[snippet]
+            similarity = cosine_similarity(claim_emb, snippet_emb)
 
             # Domain score (credibility)
             domain_score = domain_score_for_url(link)
@@ -691,7 +685,7 @@ Return STRICT JSON ONLY:
                 "similarity": round(similarity, 3),
                 "domain_score": domain_score,
                 "evidence_score": evidence_score,
-                "is_new_domain": domain not in CREDIBLE_DOMAINS,
+                "is_new_domain": normalize_domain(domain) not in CREDIBLE_DOMAINS,
                 "relevance": relevance,
                 "confidence": result.get("confidence", 50)
             })
@@ -704,9 +698,9 @@ Return STRICT JSON ONLY:
         top = sorted(claim_evidences, key=lambda x: x["evidence_score"], reverse=True)[:3]
         evidences.extend(top)
 
-    # Update trusted domain score DB
+    # Update trusted domain score DB (write-behind)
     if domain_updates:
-        await asyncio.to_thread(add_or_update_trusted_sources_batch, domain_updates)
+        add_or_update_trusted_sources_batch(domain_updates)
 
     # Final status classification
     status = (
@@ -857,7 +851,8 @@ def quick_initial_assessment(text: str) -> dict:
     """
 
     try:
-        resp = get_gemini_model().generate_content(prompt)
+        with timed_call("gemini", op="initial_assessment"):
+            resp = generate_content(prompt, "initial_assessment")
         return {
             "status": "ok",
             "initial_analysis": resp.text.strip(),
@@ -870,47 +865,21 @@ def quick_initial_assessment(text: str) -> dict:
         }
 
 def run_storage(text, score, label, explanation):
+    """
+    Queue the verdict for persistence (Firestore article, Pinecone fallback).
+    Returns as soon as the record is queued; see persistence_queue.
+    """
     try:
-        embedding = [float(x) for x in get_embedding(text).tolist()]
-
-        if db:
-            doc_id = hashlib.sha256(text.encode("utf-8")).hexdigest()
-
-            db.collection("articles").document(doc_id).set({
-                "text": text,
-                "embedding": embedding,
-                "verified": True,
-                "prediction": label,
-                "text_score": score / 100,
-                "gemini_reasoning": explanation,
-                "text_explanation": explanation,
-                "last_updated": datetime.utcnow(),
-                "expireAt": datetime.utcnow() + timedelta(days=10),
-                "type": "text"
-            }, merge=True)
-
-            print("[Firestore] ✅ Stored successfully")
-            return True
-
-    except Exception as e:
-        print(f"[Firestore Storage Error] ❌ {e}")
-
-    try:
-        store_feedback(
-            text=text,
-            explanation=explanation,
-            sources=[],                 
-            user_fingerprint="system",
-            score=score / 100,    
-            prediction=label,
-            verified=True,
-        )
-
-        print("[Pinecone] ✅ Stored successfully")
+        PERSIST_QUEUE.submit({
+            "text": text,
+            "score": score,
+            "label": label,
+            "explanation": explanation,
+        })
         return True
-
     except Exception as e:
-        print(f"[Pinecone Store Error] ❌ {e}")
+        print(f"[Storage Queue Error] ❌ {e}")
+        return False
 
 def detect_fake_text(text: str) -> dict:
     """
@@ -938,23 +907,14 @@ def detect_fake_text(text: str) -> dict:
         return _wrap
 
     async def _call_maybe_async(fn, *args, **kwargs):
+        # The loop is shared by every request: sync callables run on a thread
         if inspect.isawaitable(fn) and not callable(fn):
             return await fn
         if callable(fn):
-            res = fn(*args, **kwargs)
+            res = await _ensure_coroutine_func(fn)(*args, **kwargs)
             return await res if inspect.isawaitable(res) else res
         return fn
 
-    def _run_sync_main(coro):
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = None
-        if loop and loop.is_running():
-            import nest_asyncio
-            nest_asyncio.apply()
-        return asyncio.run(coro)
-
     # ----------------------------------------------------------------------
     # PHASE 1: Fact-check + metadata in parallel
     # ----------------------------------------------------------------------
@@ -981,17 +941,23 @@ def detect_fake_text(text: str) -> dict:
     # ----------------------------------------------------------------------
     async def run_parallel_phase2(metadata):
         meta_text = metadata.get("text", text) if isinstance(metadata, dict) else text
-        claim_summary = await summarize_claim(meta_text) 
+        with timed_stage("summarize_claim"):
+            claim_summary = await summarize_claim(meta_text)
         claims = [claim_summary]
 
         async def _vertex_wrapper():
-            pv = await _call_maybe_async(predict_with_vertex_ai, metadata)
-            ev = extract_vertex_scores(pv)
-            return await ev if inspect.isawaitable(ev) else ev
+            with timed_stage("vertex_classification"):
+                pv = await _call_maybe_async(predict_with_vertex_ai, metadata)
+                ev = extract_vertex_scores(pv)
+                return await ev if inspect.isawaitable(ev) else ev
+
+        async def _corroboration():
+            with timed_stage("corroboration"):
+                return await corroborate_all_with_google_async([claim_summary])
 
         tasks = [
             asyncio.create_task(_vertex_wrapper()),
-            asyncio.create_task(corroborate_all_with_google_async([claim_summary]))
+            asyncio.create_task(_corroboration())
         ]
 
         vertex_scores, corroboration_data = await asyncio.gather(*tasks, return_exceptions=True)
@@ -1040,7 +1006,8 @@ def detect_fake_text(text: str) -> dict:
                         corroboration_data.get("status"),
                         fact_check_results,
                         full_text=metadata.get("text", text)
-                    )
+                    ),
+                    prompt_type="claim_check",
                 )
             except Exception as e:
                 print(f"[WARN] gemini structured failed for claim '{claim}': {e}")
@@ -1098,9 +1065,12 @@ def detect_fake_text(text: str) -> dict:
     # MAIN EXECUTION
     # ----------------------------------------------------------------------
     async def main():
-        fact_check_results, metadata = await run_parallel_phase1()
-        vertex_scores, corroboration_data, claims = await run_parallel_phase2(metadata)
-        results = await run_parallel_claim_checks(claims, corroboration_data, fact_check_results, metadata, vertex_scores)
+        with timed_stage("run_parallel_phase1"):
+            fact_check_results, metadata = await run_parallel_phase1()
+        with timed_stage("run_parallel_phase2"):
+            vertex_scores, corroboration_data, claims = await run_parallel_phase2(metadata)
+        with timed_stage("run_parallel_claim_checks"):
+            results = await run_parallel_claim_checks(claims, corroboration_data, fact_check_results, metadata, vertex_scores)
 
         if not results:
             return {
@@ -1141,7 +1111,8 @@ def detect_fake_text(text: str) -> dict:
             and "could not" not in combined_explanation.lower()
         ):
             try:
-                await _call_maybe_async(run_storage, text, overall_conf, overall_label, combined_explanation)
+                with timed_stage("storage"):
+                    await _call_maybe_async(run_storage, text, overall_conf, overall_label, combined_explanation)
             except Exception as e:
                 print(f"[WARN] run_storage failed: {e}")
         else:
@@ -1154,4 +1125,5 @@ def detect_fake_text(text: str) -> dict:
             "raw_details": results
         }
 
-    return _run_sync_main(main())
\ No newline at end of file
+    with timed_stage("detect_fake_text"):
+        return run_coroutine(main())
\ No newline at end of file
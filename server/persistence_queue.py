@@ -0,0 +1,242 @@
+# persistence_queue.py
+"""
+Bounded write-behind queue for analysis results.
+
+run_storage() enqueues a record and returns immediately. A background
+worker drains the queue in batches: embeddings are computed in one
+batched encode, Firestore article writes go out as one WriteBatch, and
+records whose Firestore write ultimately fails fall back to Pinecone.
+Transient failures are retried with exponential backoff; the queue is
+drained at shutdown.
+
+When the queue is full (PERSIST_QUEUE_MAX) the record is dropped, not
+written: submit() runs on the shared pipeline loop, so it never blocks
+and never writes itself. Drops are counted in get_stats()["dropped"] and
+the persist_dropped_total metric.
+"""
+import atexit
+import hashlib
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import cassettes
+from metrics import count, timed_call
+
+PERSIST_QUEUE_MAX = int(os.getenv("PERSIST_QUEUE_MAX", "1000"))
+PERSIST_BATCH_MAX = int(os.getenv("PERSIST_BATCH_MAX", "50"))
+PERSIST_BATCH_WAIT_SECONDS = float(os.getenv("PERSIST_BATCH_WAIT_SECONDS", "0.5"))
+PERSIST_RETRIES = int(os.getenv("PERSIST_RETRIES", "3"))
+FIRESTORE_BATCH_LIMIT = 500
+
+_STOP = object()
+
+
+def _with_backoff(fn, tries: int, on_retry=None, base_delay: float = 0.5):
+    for i in range(tries):
+        try:
+            return fn()
+        except Exception:
+            if i == tries - 1:
+                raise
+            if on_retry:
+                on_retry()
+            time.sleep(base_delay * (2 ** i))
+
+
+class PersistenceQueue:
+    def __init__(self, maxsize: int = PERSIST_QUEUE_MAX):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written_firestore = 0
+        self.written_pinecone = 0
+        self.failed = 0
+        self.retries = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.batches = 0
+        self.last_batch_ms = 0.0
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="persistence-queue", daemon=True)
+                self._thread.start()
+
+    def submit(self, record: dict) -> bool:
+        """Enqueue a record without blocking; drops (and counts) it when the queue is full."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._count(dropped=1)
+            count("persist_dropped_total")
+            print("[Persist] ⚠️ Queue full — record dropped")
+            return False
+        with self._stats_lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _collect(self) -> List[dict]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [first]
+        batch = [first]
+        deadline = time.monotonic() + PERSIST_BATCH_WAIT_SECONDS
+        while len(batch) < PERSIST_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is _STOP
+            records = [r for r in batch if r is not _STOP]
+            if records:
+                self._write_batch(records)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    # ---- actual writes ---------------------------------------------
+    def _write_batch(self, records: List[dict]):
+        from embedding_service import get_embeddings
+
+        start = time.perf_counter()
+        try:
+            vectors = get_embeddings([r["text"] for r in records])
+        except Exception as e:
+            print(f"[Persist] ❌ Embedding failed for {len(records)} records: {e}")
+            self._count(failed=len(records))
+            return
+
+        articles = []
+        for record, vec in zip(records, vectors):
+            now = datetime.utcnow()
+            articles.append((
+                hashlib.sha256(record["text"].encode("utf-8")).hexdigest(),
+                {
+                    "text": record["text"],
+                    "embedding": [float(x) for x in vec],
+                    "verified": True,
+                    "prediction": record["label"],
+                    "text_score": record["score"] / 100,
+                    "gemini_reasoning": record["explanation"],
+                    "text_explanation": record["explanation"],
+                    "last_updated": now,
+                    "expireAt": now + timedelta(days=10),
+                    "type": "text",
+                },
+            ))
+
+        try:
+            _with_backoff(lambda: self._commit_firestore(articles), PERSIST_RETRIES,
+                          on_retry=lambda: self._count(retries=1))
+            self._count(written_firestore=len(articles))
+            print(f"[Firestore] ✅ Stored {len(articles)} article(s)")
+        except Exception as e:
+            print(f"[Firestore Storage Error] ❌ {e}")
+            self._pinecone_fallback(records)
+
+        self._count(batches=1)
+        self.last_batch_ms = (time.perf_counter() - start) * 1000.0
+
+    def _commit_firestore(self, articles):
+        from database import get_db
+        from article_index import get_article_index
+
+        def _commit(chunk):
+            db = get_db()
+            batch = db.batch()
+            for doc_id, article in chunk:
+                batch.set(db.collection("articles").document(doc_id), article, merge=True)
+            batch.commit()
+
+        for i in range(0, len(articles), FIRESTORE_BATCH_LIMIT):
+            chunk = articles[i:i + FIRESTORE_BATCH_LIMIT]
+            with timed_call("firestore", op="write_articles"):
+                cassettes.call(
+                    "firestore", "write_articles", {"ids": [doc_id for doc_id, _ in chunk]},
+                    lambda: _commit(chunk),
+                )
+
+        index = get_article_index()
+        for doc_id, article in articles:
+            index.upsert(doc_id, article)
+
+    def _pinecone_fallback(self, records: List[dict]):
+        from vectorDb import store_feedback_many
+
+        feedback = [{
+            "text": r["text"],
+            "explanation": r["explanation"],
+            "sources": [],
+            "user_fingerprint": "system",
+            "score": r["score"] / 100,
+            "prediction": r["label"],
+            "verified": True,
+        } for r in records]
+        try:
+            _with_backoff(lambda: store_feedback_many(feedback), PERSIST_RETRIES,
+                          on_retry=lambda: self._count(retries=1))
+            self._count(written_pinecone=len(records))
+        except Exception as e:
+            self._count(failed=len(records))
+            print(f"[Pinecone Store Error] ❌ {e}")
+
+    # ---- lifecycle -------------------------------------------------
+    def flush(self, timeout: float = 30.0):
+        """Drain everything queued so far and stop the worker."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print("[Persist] ⚠️ Queue still full at shutdown; some writes may be lost")
+            return
+        self._thread.join(timeout)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "depth": self._queue.qsize(),
+                "capacity": self.maxsize,
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "written_firestore": self.written_firestore,
+                "written_pinecone": self.written_pinecone,
+                "failed": self.failed,
+                "retries": self.retries,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "last_batch_ms": round(self.last_batch_ms, 2),
+            }
+
+
+PERSIST_QUEUE = PersistenceQueue()
+atexit.register(PERSIST_QUEUE.flush)
@@ -0,0 +1,119 @@
+# result_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from metrics import cache_lookup
+
+
+class TTLCache:
+    """
+    Thread-safe LRU with a per-entry TTL and hit/miss counters.
+    Entries may carry tags (e.g. the article_id a semantic match resolved to)
+    so they can be invalidated by any id they depend on.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 300.0, name: str = "cache"):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[str, tuple[float, object, tuple]]" = OrderedDict()
+        self._tags: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: str) -> Optional[object]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                cache_lookup(self.name, False)
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        cache_lookup(self.name, True)
+        return entry[1]
+
+    def put(self, key: str, value, tags: Iterable[str] = ()):
+        tags = tuple(t for t in tags if t)
+        with self._lock:
+            self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_entries:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key_or_tag: str) -> int:
+        """Remove the entry stored under `key_or_tag` and every entry tagged with it."""
+        with self._lock:
+            keys = set(self._tags.get(key_or_tag, ()))
+            if key_or_tag in self._data:
+                keys.add(key_or_tag)
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# -----------------------------
+# /detect_text VERDICT CACHE
+# -----------------------------
+VERDICT_CACHE = TTLCache(
+    max_entries=int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "4096")),
+    ttl_seconds=float(os.getenv("VERDICT_CACHE_TTL_SECONDS", "600")),
+    name="verdict_l1",
+)
+
+
+# -----------------------------
+# /detect_image URL RESULT CACHE
+# -----------------------------
+# url -> {"digest", "etag", "last_modified", "result"}; every hit is still
+# revalidated with a conditional GET, the TTL only bounds how long we keep trying.
+IMAGE_URL_CACHE = TTLCache(
+    max_entries=int(os.getenv("IMAGE_URL_CACHE_MAX_ENTRIES", "2048")),
+    ttl_seconds=float(os.getenv("IMAGE_URL_CACHE_TTL_SECONDS", "86400")),
+    name="image_url",
+)
@@ -0,0 +1,73 @@
+# singleflight.py
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+
+class SingleFlight:
+    """
+    In-process request coalescing: while a call for `key` is running, every
+    other caller with the same key waits for that call's result instead of
+    starting its own.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_waiters = 0
+        self._waiters: Dict[str, int] = {}
+
+    def do(self, key: str, fn: Callable, *args, **kwargs):
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                self._waiters[key] = self._waiters.get(key, 0) + 1
+                self.max_waiters = max(self.max_waiters, self._waiters[key])
+                leader = False
+            else:
+                fut = Future()
+                self._calls[key] = fut
+                self._waiters[key] = 0
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            return fut.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+                self._calls.pop(key, None)
+                self._waiters.pop(key, None)
+            fut.set_exception(e)
+            raise
+
+        with self._lock:
+            self._calls.pop(key, None)
+            self._waiters.pop(key, None)
+        fut.set_result(result)
+        return result
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                "name": self.name,
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "max_waiters": self.max_waiters,
+                "coalesce_rate": round(self.coalesced / total, 4) if total else 0.0,
+            }
+
+
+# Full detect_fake_text pipeline runs, keyed by normalized input text
+PIPELINE_FLIGHTS = SingleFlight("detect_fake_text")
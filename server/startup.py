@@ -0,0 +1,88 @@
+# startup.py
+"""
+Component registry for lazy initialization and warm-up.
+
+Each heavy subsystem wraps its one-time init in `timed_component(name)`,
+which records how long it took and whether it succeeded. `start_warmup()`
+initializes registered components in a background thread so the first
+requests don't pay for them, and `get_readiness()` reports what is warm.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+_lock = threading.Lock()
+_components: Dict[str, dict] = {}
+_warmers: Dict[str, Callable] = {}
+_required = set()
+_warmup_thread = None
+_process_start = time.time()
+
+
+def _entry(name: str) -> dict:
+    return _components.setdefault(name, {"state": "cold", "seconds": None, "error": None})
+
+
+def register_component(name: str, warm_fn: Callable, required: bool = False):
+    """Register a lazy getter to be called by the warm-up thread."""
+    with _lock:
+        _warmers[name] = warm_fn
+        _entry(name)
+        if required:
+            _required.add(name)
+
+
+@contextmanager
+def timed_component(name: str):
+    with _lock:
+        _entry(name)["state"] = "warming"
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _entry(name).update(state="error", seconds=round(elapsed, 3), error=str(e))
+        print(f"❌ [startup] {name} failed after {elapsed:.2f}s: {e}")
+        raise
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _entry(name).update(state="warm", seconds=round(elapsed, 3), error=None)
+    print(f"⏱️ [startup] {name} ready in {elapsed:.2f}s")
+
+
+def _warm_all():
+    start = time.perf_counter()
+    for name, fn in list(_warmers.items()):
+        try:
+            fn()
+        except Exception:
+            pass   # already recorded by timed_component
+    print(f"✅ [startup] warm-up finished in {time.perf_counter() - start:.2f}s")
+
+
+def start_warmup():
+    """Initialize all registered components in the background (once per process)."""
+    global _warmup_thread
+    if os.getenv("WARMUP_ON_START", "1") != "1":
+        return
+    with _lock:
+        if _warmup_thread is not None:
+            return
+        _warmup_thread = threading.Thread(target=_warm_all, name="warmup", daemon=True)
+    _warmup_thread.start()
+
+
+def get_readiness() -> dict:
+    with _lock:
+        components = {name: dict(info) for name, info in _components.items()}
+        required = set(_required)
+    ready = all(components.get(n, {}).get("state") == "warm" for n in required)
+    return {
+        "ready": ready,
+        "uptime_seconds": round(time.time() - _process_start, 1),
+        "required": sorted(required),
+        "components": components,
+    }
@@ -0,0 +1,237 @@
+# tracing.py
+"""
+Per-request span recording for the /detect_text critical path.
+
+`start_trace()` opens a trace for the current request; `span(name)` records
+a timed child of whatever span is active. The active trace and span live
+in contextvars, so they follow asyncio tasks and asyncio.to_thread() calls
+(and run_coroutine(), which starts its task in the caller's context).
+metrics.timed() opens a span for every stage and dependency call, so the
+waterfall shows each phase with the external calls inside it.
+
+Finished traces are kept in a bounded ring buffer and looked up by trace
+id or by the article_id they were tagged with.
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_MAX_SPANS = 500   # per trace; protects the buffer from runaway loops
+
+
+class Trace:
+    def __init__(self, name: str, key: str = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.keys = {key} if key else set()
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+        self.spans: List[dict] = []
+        self.dropped_spans = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def offset_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000.0
+
+    def add_span(self, record: dict):
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return
+            self.spans.append(record)
+
+    def next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "keys": sorted(self.keys),
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "dropped_spans": self.dropped_spans,
+            "spans": spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+_buffer: "deque[Trace]" = deque(maxlen=TRACE_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+
+
+@contextmanager
+def start_trace(name: str, key: str = None):
+    trace = Trace(name, key)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.duration_ms = round(trace.offset_ms(), 2)
+        with _buffer_lock:
+            _buffer.append(trace)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def tag_trace(key: str):
+    """Make the active trace findable by `key` (e.g. the article_id)."""
+    trace = _current_trace.get()
+    if trace is not None and key:
+        trace.keys.add(key)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Timed child span of the active span; a no-op outside a trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    span_id = trace.next_id()
+    parent = _current_span.get()
+    token = _current_span.set(span_id)
+    start = trace.offset_ms()
+    error = None
+    try:
+        yield span_id
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        trace.add_span({
+            "id": span_id,
+            "parent_id": parent,
+            "name": name,
+            "start_ms": round(start, 2),
+            "duration_ms": round(trace.offset_ms() - start, 2),
+            "thread": threading.current_thread().name,
+            "error": error,
+            "attrs": {k: v for k, v in attrs.items() if v is not None},
+        })
+
+
+def get_trace(key: str) -> Optional[dict]:
+    """Most recent finished trace with this trace id or tag."""
+    with _buffer_lock:
+        for trace in reversed(_buffer):
+            if trace.trace_id == key or key in trace.keys:
+                return trace.to_dict()
+    return None
+
+
+def recent_traces(limit: int = 50) -> List[dict]:
+    with _buffer_lock:
+        traces = list(_buffer)[-limit:]
+    return [
+        {
+            "trace_id": t.trace_id,
+            "name": t.name,
+            "keys": sorted(t.keys),
+            "started_at": t.started_at,
+            "duration_ms": t.duration_ms,
+            "spans": len(t.spans),
+            "error": t.error,
+        }
+        for t in reversed(traces)
+    ]
+
+
+# -----------------------------
+# WATERFALL VIEW
+# -----------------------------
+def _span_depths(spans: List[dict]) -> dict:
+    parents = {s["id"]: s["parent_id"] for s in spans}
+    depths = {}
+    for span_id in parents:
+        depth, cursor = 0, parents.get(span_id)
+        while cursor is not None and depth < 50:
+            depth += 1
+            cursor = parents.get(cursor)
+        depths[span_id] = depth
+    return depths
+
+
+def _ordered(spans: List[dict]) -> List[dict]:
+    """Depth-first: each span followed by its children, siblings by start time."""
+    children = {}
+    for s in spans:
+        children.setdefault(s["parent_id"], []).append(s)
+    known = {s["id"] for s in spans}
+    out = []
+
+    def _walk(parent_id):
+        for s in sorted(children.get(parent_id, []), key=lambda s: s["start_ms"]):
+            out.append(s)
+            _walk(s["id"])
+
+    _walk(None)
+    # Spans whose parent was dropped still get shown
+    for s in spans:
+        if s["parent_id"] is not None and s["parent_id"] not in known:
+            out.append(s)
+    return out
+
+
+def render_waterfall(trace: dict, token: str = "") -> str:
+    """HTML waterfall; `token` is carried into the JSON link for token-protected views."""
+    from html import escape
+    from urllib.parse import urlencode
+
+    total = max(trace["duration_ms"] or 0.0, 1.0)
+    depths = _span_depths(trace["spans"])
+    rows = []
+    for s in _ordered(trace["spans"]):
+        left = 100.0 * s["start_ms"] / total
+        width = max(100.0 * s["duration_ms"] / total, 0.2)
+        label = escape(s["name"])
+        if s["attrs"]:
+            label += " " + escape(" ".join(f"{k}={v}" for k, v in s["attrs"].items()))
+        color = "#d9534f" if s["error"] else "#4a90d9"
+        rows.append(
+            f'<tr><td style="padding-left:{depths.get(s["id"], 0) * 16}px;white-space:nowrap">{label}</td>'
+            f'<td style="text-align:right">{s["start_ms"]:.1f}</td>'
+            f'<td style="text-align:right">{s["duration_ms"]:.1f}</td>'
+            f'<td style="width:60%"><div style="margin-left:{left:.2f}%;width:{width:.2f}%;'
+            f'background:{color};height:12px" title="{escape(s["error"] or "")}"></div></td></tr>'
+        )
+    keys = escape(", ".join(trace["keys"]))
+    json_query = urlencode({"format": "json", **({"token": token} if token else {})})
+    return (
+        "<!doctype html><html><head><meta charset='utf-8'>"
+        f"<title>trace {trace['trace_id']}</title></head>"
+        "<body style='font-family:monospace;font-size:12px'>"
+        f"<h3>{escape(trace['name'])} {trace['trace_id']} — {trace['duration_ms']:.1f} ms</h3>"
+        f"<p>keys: {keys} | error: {escape(trace['error'] or 'none')} | "
+        f"<a href='?{escape(json_query)}'>JSON</a></p>"
+        "<table style='width:100%;border-collapse:collapse'>"
+        "<tr><th align=left>span</th><th>start ms</th><th>ms</th><th></th></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
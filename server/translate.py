@@ -2,6 +2,10 @@ from google.cloud import translate
 from dotenv import load_dotenv
 import os
 
+import cassettes
+from metrics import timed_call
+from startup import register_component, timed_component
+
 load_dotenv()
 
 PROJECT_ID = os.getenv("PROJECT_ID")
@@ -13,11 +17,15 @@ def get_translate_client():
     global _translate_client
     if _translate_client is None:
         print("🔹 Initializing Google Translate client...")
-        _translate_client = translate.TranslationServiceClient()
+        with timed_component("translate_client"):
+            _translate_client = translate.TranslationServiceClient()
         print("✅ Google Translate client ready")
     return _translate_client
 
 
+register_component("translate_client", get_translate_client)
+
+
 def translate_to_english(text_to_check: str) -> dict:
     if not text_to_check or not text_to_check.strip():
         return {
@@ -27,14 +35,15 @@ def translate_to_english(text_to_check: str) -> dict:
             "was_translated": False
         }
 
-    client = get_translate_client() 
     parent = f"projects/{PROJECT_ID}/locations/global"
 
     # Detect language (Google auto-detect)
-    detection = client.detect_language(
-        content=text_to_check,
-        parent=parent
-    )
+    with timed_call("translate", op="detect_language"):
+        detection = cassettes.call(
+            "translate", "detect_language", {"content": text_to_check},
+            lambda: get_translate_client().detect_language(content=text_to_check, parent=parent),
+            *cassettes.proto_codec(translate.DetectLanguageResponse),
+        )
     detected_lang = detection.languages[0].language_code
 
     # Already English → return as-is
@@ -47,11 +56,16 @@ def translate_to_english(text_to_check: str) -> dict:
         }
 
     # Translate into English
-    response = client.translate_text(
-        contents=[text_to_check],
-        target_language_code="en",
-        parent=parent
-    )
+    with timed_call("translate", op="translate_text"):
+        response = cassettes.call(
+            "translate", "translate_text", {"contents": [text_to_check], "target": "en"},
+            lambda: get_translate_client().translate_text(
+                contents=[text_to_check],
+                target_language_code="en",
+                parent=parent
+            ),
+            *cassettes.proto_codec(translate.TranslateTextResponse),
+        )
 
     return {
         "original_text": text_to_check,
@@ -5,9 +5,15 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from dotenv import load_dotenv
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 from typing import Optional
 
-from embedding_service import get_embedding 
+import cassettes
+from embedding_service import get_embedding, get_embeddings
+from startup import register_component, timed_component
+from metrics import timed_call
 
 # -----------------------------
 # CONFIGURATION & GLOBALS
@@ -38,32 +44,93 @@ def init_pinecone():
         pc = Pinecone(api_key=PINECONE_API_KEY)
 
     if index is None:
-        print("🔹 Checking Pinecone index...")
+        with timed_component("pinecone"):
+            print("🔹 Checking Pinecone index...")
 
-        existing = [i["name"] for i in pc.list_indexes()]  
+            existing = [i["name"] for i in pc.list_indexes()]  
 
-        if INDEX_NAME not in existing:
-            print(f"🟢 Creating Pinecone index '{INDEX_NAME}'...")
-            pc.create_index(
-                name=INDEX_NAME,
-                dimension=384,              
-                metric="cosine",
-                spec=ServerlessSpec(cloud="aws", region="us-east-1"),
-            )
+            if INDEX_NAME not in existing:
+                print(f"🟢 Creating Pinecone index '{INDEX_NAME}'...")
+                pc.create_index(
+                    name=INDEX_NAME,
+                    dimension=384,              
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+                )
 
-        index = pc.Index(INDEX_NAME)
-        print(f"✅ Connected to Pinecone index '{INDEX_NAME}'")
+            index = pc.Index(INDEX_NAME)
+            print(f"✅ Connected to Pinecone index '{INDEX_NAME}'")
 
     return index
 
 
+register_component("pinecone", init_pinecone)
+
+
+# -----------------------------
+# CASSETTE CODECS (record/replay)
+# -----------------------------
+def _encode_fetch(resp) -> dict:
+    return {"vectors": {
+        vec_id: {"id": vec_id, "metadata": dict(vec.metadata or {})}
+        for vec_id, vec in (resp.vectors or {}).items()
+    }}
+
+
+def _decode_fetch(data: dict):
+    return SimpleNamespace(vectors={vec_id: SimpleNamespace(**vec) for vec_id, vec in data["vectors"].items()})
+
+
+def _encode_query(resp) -> dict:
+    return {"matches": [
+        {"id": m.id, "score": m.score, "metadata": dict(m.metadata or {})}
+        for m in resp.matches or []
+    ]}
+
+
+def _decode_query(data: dict):
+    return SimpleNamespace(matches=[SimpleNamespace(**m) for m in data["matches"]])
+
+
+def _fetch(ids: list, namespace: str):
+    return cassettes.call(
+        "pinecone", "fetch", {"ids": ids, "namespace": namespace},
+        lambda: init_pinecone().fetch(ids=ids, namespace=namespace),
+        encode=_encode_fetch,
+        decode=_decode_fetch,
+    )
+
+
+def _query(text: str, vector: list, top_k: int, namespace: str, query_filter: dict):
+    # Keyed by the text: embeddings drift in the last bits across CPUs
+    return cassettes.call(
+        "pinecone", "query", {"text": text, "top_k": top_k, "namespace": namespace, "filter": query_filter},
+        lambda: init_pinecone().query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=namespace,
+            filter=query_filter,
+        ),
+        encode=_encode_query,
+        decode=_decode_query,
+    )
+
+
+def _upsert(vectors: list, namespace: str):
+    cassettes.call(
+        "pinecone", "upsert", {"ids": [v["id"] for v in vectors], "namespace": namespace},
+        lambda: init_pinecone().upsert(vectors=vectors, namespace=namespace),
+        encode=lambda _: None,   # callers ignore the upsert response
+    )
+
+
 # -----------------------------
 # EMBEDDINGS (now shared)
 # -----------------------------
 def embed_text(text: str) -> list:
-    """Embedding using shared global EMBEDDER (cached)."""
-    normalized = text.lower().strip()
-    emb_tensor = get_embedding(normalized)
+    """Embedding using shared global EMBEDDER (cache key normalization lives in embedding_service)."""
+    emb_tensor = get_embedding(text)
     return emb_tensor.tolist()            
 
 
@@ -87,11 +154,11 @@ def search_feedback(text: str, article_id: Optional[str] = None) -> dict:
     if not text.strip():
         return {"error": "No text provided"}
 
-    index = init_pinecone()
     vec_id = article_id or text_hash(text)
     vector = embed_text(text)
 
-    exact_match = index.fetch(ids=[vec_id], namespace=NAMESPACE)
+    with timed_call("pinecone", op="fetch"):
+        exact_match = _fetch([vec_id], NAMESPACE)
     if exact_match.vectors:
         metadata = exact_match.vectors[vec_id].metadata
         if metadata.get("unique_user_count", 0) >= 1:
@@ -108,13 +175,8 @@ def search_feedback(text: str, article_id: Optional[str] = None) -> dict:
     if article_id:
         query_filter["article_id"] = {"$eq": article_id}
 
-    similar_results = index.query(
-        vector=vector,
-        top_k=1,
-        include_metadata=True,
-        namespace=NAMESPACE,
-        filter=query_filter,
-    )
+    with timed_call("pinecone", op="query"):
+        similar_results = _query(text, vector, 1, NAMESPACE, query_filter)
 
     if similar_results.matches and similar_results.matches[0].score > 0.85:
         metadata = similar_results.matches[0].metadata
@@ -137,7 +199,6 @@ def search_feedback_semantic(
     if not text.strip():
         return {"error": "No text provided"}
 
-    index = init_pinecone()
     vector = embed_text(text)
     namespace = VERIFIED_NAMESPACE if verified_only else NAMESPACE
     query_filter = {"verified": {"$eq": True}} if not verified_only else {}
@@ -145,13 +206,8 @@ def search_feedback_semantic(
     if article_id:
         query_filter["article_id"] = {"$eq": article_id}
 
-    similar_results = index.query(
-        vector=vector,
-        top_k=10,
-        include_metadata=True,
-        namespace=namespace,
-        filter=query_filter,
-    )
+    with timed_call("pinecone", op="query"):
+        similar_results = _query(text, vector, 10, namespace, query_filter)
 
     if similar_results.matches:
         best = max(
@@ -179,6 +235,53 @@ def search_feedback_semantic(
 # -----------------------------
 # STORE FEEDBACK
 # -----------------------------
+PINECONE_UPSERT_BATCH = 100     # Pinecone's recommended max vectors per upsert
+PINECONE_FETCH_BATCH = 100
+PINECONE_PARALLEL_REQUESTS = int(os.getenv("PINECONE_PARALLEL_REQUESTS", "4"))
+
+
+def _new_metadata(
+    text: str,
+    explanation: str,
+    sources: list,
+    anon_id: str,
+    vec_id: str,
+    article_id: Optional[str],
+    score: float,
+    prediction: str,
+    verified: bool,
+) -> dict:
+    return {
+        "article_id": article_id or vec_id,
+        "text_hash": vec_id,
+        "text": text[:1000],
+        "explanation": explanation[:2000],
+        "sources": sources,
+        "score": score,
+        "prediction": prediction,
+        "verified": verified,
+        "timestamp": datetime.utcnow().isoformat(),
+        "ttl_expiry": (datetime.utcnow() + timedelta(days=15)).isoformat(),
+        "confirmations": 1,
+        "unique_users": [anon_id],
+        "unique_user_count": 1,
+    }
+
+
+def _merge_metadata(old: dict, metadata: dict, anon_id: str) -> dict:
+    """Fold a new confirmation into previously stored metadata."""
+    unique_users = list(set(old.get("unique_users", []) + [anon_id]))
+    metadata.update({
+        "score": (old.get("score", 0.5) + metadata["score"]) / 2,
+        "confirmations": old.get("confirmations", 0) + 1,
+        "unique_users": unique_users,
+        "unique_user_count": len(unique_users),
+        "prediction": metadata["prediction"] if metadata["prediction"] != "Unknown" else old.get("prediction"),
+        "verified": metadata["verified"] or old.get("verified", False),
+    })
+    return metadata
+
+
 def store_feedback(
     text: str,
     explanation: str,
@@ -193,49 +296,106 @@ def store_feedback(
     if not text.strip() or not explanation:
         return {"error": "Missing text or explanation"}
 
-    index = init_pinecone()
     vector = embed_text(text)
     vec_id = article_id or text_hash(text)
     anon_id = anon_user_id(user_fingerprint)
-    timestamp = datetime.utcnow().isoformat()
     namespace = VERIFIED_NAMESPACE if verified else NAMESPACE
 
-    existing = index.fetch(ids=[vec_id], namespace=namespace)
+    with timed_call("pinecone", op="fetch"):
+        existing = _fetch([vec_id], namespace)
 
-    metadata = {
-        "article_id": article_id or vec_id,
-        "text_hash": vec_id,
-        "text": text[:1000],
-        "explanation": explanation[:2000],
-        "sources": sources,
-        "score": score,
-        "prediction": prediction,
-        "verified": verified,
-        "timestamp": timestamp,
-        "ttl_expiry": (datetime.utcnow() + timedelta(days=15)).isoformat(),
-        "confirmations": 1,
-        "unique_users": [anon_id],
-        "unique_user_count": 1,
-    }
+    metadata = _new_metadata(
+        text, explanation, sources, anon_id, vec_id, article_id, score, prediction, verified
+    )
 
     if existing.vectors:
-        old = existing.vectors[vec_id].metadata
-        metadata.update({
-            "score": (old.get("score", 0.5) + score) / 2,
-            "confirmations": old.get("confirmations", 0) + 1,
-            "unique_users": list(set(old.get("unique_users", []) + [anon_id])),
-            "unique_user_count": len(list(set(old.get("unique_users", []) + [anon_id]))),
-            "prediction": prediction if prediction != "Unknown" else old.get("prediction"),
-            "verified": verified or old.get("verified", False),
-        })
-
-    index.upsert(
-        vectors=[{"id": vec_id, "values": vector, "metadata": metadata}],
-        namespace=namespace,
-    )
+        metadata = _merge_metadata(existing.vectors[vec_id].metadata, metadata, anon_id)
+
+    with timed_call("pinecone", op="upsert"):
+        _upsert([{"id": vec_id, "values": vector, "metadata": metadata}], namespace)
     return {"status": "stored", "article_id": article_id}
 
 
+def store_feedback_many(records: list) -> dict:
+    """
+    Bulk variant of store_feedback for imports and backfills.
+    Each record is a dict with store_feedback's keyword arguments.
+    Texts are embedded in one batched encode, existing metadata is fetched
+    in chunks, confirmations are merged in memory (including duplicates
+    inside `records`), and upserts go out in parallel batches.
+    """
+    start = time.perf_counter()
+    valid = [r for r in records if (r.get("text") or "").strip() and r.get("explanation")]
+    skipped = len(records) - len(valid)
+    if not valid:
+        return {"status": "stored", "count": 0, "skipped": skipped, "seconds": 0.0, "items_per_second": 0.0}
+
+    vectors = get_embeddings([r["text"] for r in valid])
+
+    # namespace -> vec_id -> {"values", "updates": [(metadata, anon_id), ...]}
+    pending = {}
+    for record, vector in zip(valid, vectors):
+        verified = record.get("verified", True)
+        namespace = VERIFIED_NAMESPACE if verified else NAMESPACE
+        article_id = record.get("article_id")
+        vec_id = article_id or text_hash(record["text"])
+        anon_id = anon_user_id(record.get("user_fingerprint", "system"))
+        metadata = _new_metadata(
+            record["text"], record["explanation"], record.get("sources", []), anon_id, vec_id,
+            article_id, record.get("score", 0.5), record.get("prediction", "Unknown"), verified,
+        )
+        entry = pending.setdefault(namespace, {}).setdefault(vec_id, {"updates": []})
+        entry["values"] = [float(x) for x in vector]
+        entry["updates"].append((metadata, anon_id))
+
+    def _fetch_chunk(namespace, ids):
+        with timed_call("pinecone", op="fetch"):
+            return namespace, _fetch(ids, namespace).vectors or {}
+
+    def _upsert_chunk(namespace, chunk):
+        with timed_call("pinecone", op="upsert"):
+            _upsert(chunk, namespace)
+        return len(chunk)
+
+    with ThreadPoolExecutor(max_workers=PINECONE_PARALLEL_REQUESTS) as pool:
+        fetches = []
+        for ns, slot in pending.items():
+            ids = list(slot)
+            for i in range(0, len(ids), PINECONE_FETCH_BATCH):
+                fetches.append(pool.submit(_fetch_chunk, ns, ids[i:i + PINECONE_FETCH_BATCH]))
+
+        stored = {}
+        for fut in fetches:
+            ns, found = fut.result()
+            for vec_id, vec in found.items():
+                stored[(ns, vec_id)] = vec.metadata
+
+        # Apply updates in arrival order, exactly as repeated store_feedback calls would
+        upserts = []
+        for ns, slot in pending.items():
+            items = []
+            for vec_id, entry in slot.items():
+                current = stored.get((ns, vec_id))
+                for metadata, anon_id in entry["updates"]:
+                    current = metadata if current is None else _merge_metadata(current, metadata, anon_id)
+                items.append({"id": vec_id, "values": entry["values"], "metadata": current})
+            for i in range(0, len(items), PINECONE_UPSERT_BATCH):
+                upserts.append(pool.submit(_upsert_chunk, ns, items[i:i + PINECONE_UPSERT_BATCH]))
+        stored_count = sum(fut.result() for fut in upserts)
+
+    elapsed = time.perf_counter() - start
+    rate = len(valid) / elapsed if elapsed else 0.0
+    print(f"[Pinecone] ✅ Bulk stored {stored_count} vectors from {len(valid)} records ({rate:.1f} items/s)")
+    return {
+        "status": "stored",
+        "count": len(valid),
+        "vectors": stored_count,
+        "skipped": skipped,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(rate, 1),
+    }
+
+
 # -----------------------------
 # CLEANUP EXPIRED CACHE
 # -----------------------------